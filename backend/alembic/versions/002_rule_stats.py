@@ -0,0 +1,40 @@
+"""Add rule_stats rollup table
+
+Revision ID: 002_rule_stats
+Revises: 001_initial
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '002_rule_stats'
+down_revision = '001_initial'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Create rule_stats table
+    op.create_table(
+        'rule_stats',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('rule_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('evaluated', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('matched', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('timed_samples', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('latency_histogram', sa.JSON(), nullable=False),
+        sa.ForeignKeyConstraint(['rule_id'], ['rules.id'], ondelete='CASCADE'),
+        sa.UniqueConstraint('rule_id', 'bucket_start', name='uq_rule_stats_rule_bucket'),
+    )
+    op.create_index('ix_rule_stats_rule_id', 'rule_stats', ['rule_id'])
+    op.create_index('ix_rule_stats_bucket_start', 'rule_stats', ['bucket_start'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_rule_stats_bucket_start', table_name='rule_stats')
+    op.drop_index('ix_rule_stats_rule_id', table_name='rule_stats')
+    op.drop_table('rule_stats')
@@ -0,0 +1,32 @@
+"""Add rule_set_version stamp
+
+Revision ID: 003_rule_set_version
+Revises: 002_rule_stats
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '003_rule_set_version'
+down_revision = '002_rule_stats'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Create the single-row rule_set_version table
+    rule_set_version = op.create_table(
+        'rule_set_version',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('version', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+    )
+    op.bulk_insert(rule_set_version, [{'id': 1, 'version': 1, 'updated_at': datetime.utcnow()}])
+
+
+def downgrade() -> None:
+    op.drop_table('rule_set_version')
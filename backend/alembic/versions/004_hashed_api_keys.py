@@ -0,0 +1,56 @@
+"""Store API key ids and hashes instead of plaintext keys
+
+Revision ID: 004_hashed_api_keys
+Revises: 003_rule_set_version
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.security import api_key_fingerprint
+
+# revision identifiers, used by Alembic.
+revision = '004_hashed_api_keys'
+down_revision = '003_rule_set_version'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('api_key_id', sa.String(64), nullable=True))
+    op.add_column('users', sa.Column('api_key_hash', sa.String(64), nullable=True))
+
+    # Existing keys (including seeded ones like adm_default_ABC123) keep
+    # working as legacy keys; hashes depend on API_SECRET, so run this with
+    # the same API_SECRET as the application
+    users = sa.table(
+        'users',
+        sa.column('id', sa.String),
+        sa.column('api_key', sa.String),
+        sa.column('api_key_id', sa.String),
+        sa.column('api_key_hash', sa.String),
+    )
+    connection = op.get_bind()
+    for user_id, api_key in connection.execute(sa.select(users.c.id, users.c.api_key)).fetchall():
+        key_id, key_hash = api_key_fingerprint(api_key)
+        connection.execute(
+            users.update().where(users.c.id == user_id).values(api_key_id=key_id, api_key_hash=key_hash)
+        )
+
+    op.alter_column('users', 'api_key_id', nullable=False)
+    op.alter_column('users', 'api_key_hash', nullable=False)
+    op.create_index('ix_users_api_key_id', 'users', ['api_key_id'], unique=True)
+    op.drop_index('ix_users_api_key', table_name='users')
+    op.drop_column('users', 'api_key')
+
+
+def downgrade() -> None:
+    # Plaintext keys cannot be recovered from their hashes: the api_key
+    # column comes back empty (and nullable), so every user needs a new key
+    # issued by an admin before they can authenticate again
+    op.add_column('users', sa.Column('api_key', sa.String(255), nullable=True))
+    op.create_index('ix_users_api_key', 'users', ['api_key'], unique=True)
+    op.drop_index('ix_users_api_key_id', table_name='users')
+    op.drop_column('users', 'api_key_hash')
+    op.drop_column('users', 'api_key_id')
@@ -0,0 +1,44 @@
+"""Add credit_leases table
+
+Revision ID: 005_credit_leases
+Revises: 004_hashed_api_keys
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '005_credit_leases'
+down_revision = '004_hashed_api_keys'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Create credit_leases table
+    op.create_table(
+        'credit_leases',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('worker_id', sa.String(255), nullable=False),
+        sa.Column('reserved', sa.Integer(), nullable=False),
+        sa.Column('spent', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    )
+    op.create_index('ix_credit_leases_user_id', 'credit_leases', ['user_id'])
+    op.create_index('ix_credit_leases_expires_at', 'credit_leases', ['expires_at'])
+
+
+def downgrade() -> None:
+    # Hand outstanding leased credits back before dropping the table
+    op.execute(
+        "UPDATE users SET credits = credits + ("
+        "SELECT COALESCE(SUM(reserved - spent), 0) FROM credit_leases WHERE credit_leases.user_id = users.id)"
+    )
+    op.drop_index('ix_credit_leases_expires_at', table_name='credit_leases')
+    op.drop_index('ix_credit_leases_user_id', table_name='credit_leases')
+    op.drop_table('credit_leases')
@@ -0,0 +1,50 @@
+"""Add credit_ledger table
+
+Revision ID: 006_credit_ledger
+Revises: 005_credit_leases
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '006_credit_ledger'
+down_revision = '005_credit_leases'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Create credit_ledger table
+    op.create_table(
+        'credit_ledger',
+        sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('delta', sa.Integer(), nullable=False),
+        sa.Column('reason', sa.String(32), nullable=False),
+        sa.Column('compacted', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    )
+    op.create_index('ix_credit_ledger_user_pending', 'credit_ledger', ['user_id', 'compacted'])
+    op.create_index('ix_credit_ledger_created_at', 'credit_ledger', ['created_at'])
+
+    # Existing balances become compacted opening entries
+    op.execute(
+        "INSERT INTO credit_ledger (user_id, delta, reason, compacted, created_at) "
+        "SELECT id, credits, 'opening', true, now() FROM users"
+    )
+
+
+def downgrade() -> None:
+    # Fold pending entries into users.credits before dropping the table
+    op.execute(
+        "UPDATE users SET credits = credits + ("
+        "SELECT COALESCE(SUM(delta), 0) FROM credit_ledger "
+        "WHERE credit_ledger.user_id = users.id AND NOT credit_ledger.compacted)"
+    )
+    op.drop_index('ix_credit_ledger_created_at', table_name='credit_ledger')
+    op.drop_index('ix_credit_ledger_user_pending', table_name='credit_ledger')
+    op.drop_table('credit_ledger')
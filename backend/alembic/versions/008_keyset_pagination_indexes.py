@@ -0,0 +1,33 @@
+"""Add composite indexes for keyset pagination of commands and audit logs
+
+Revision ID: 008_keyset_pagination_indexes
+Revises: 007_idempotency_keys
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '008_keyset_pagination_indexes'
+down_revision = '007_idempotency_keys'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Built without blocking writes on Postgres, where these tables are large
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_commands_user_created_id', 'commands', ['user_id', 'created_at', 'id'],
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_audit_logs_created_id', 'audit_logs', ['created_at', 'id'],
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_audit_logs_created_id', table_name='audit_logs', postgresql_concurrently=True)
+        op.drop_index('ix_commands_user_created_id', table_name='commands', postgresql_concurrently=True)
@@ -0,0 +1,25 @@
+"""Add QUEUED command state for queued execution
+
+Revision ID: 009_queued_commands
+Revises: 008_keyset_pagination_indexes
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '009_queued_commands'
+down_revision = '008_keyset_pagination_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # ALTER TYPE ... ADD VALUE cannot run inside a transaction block before Postgres 12
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE actiontaken ADD VALUE IF NOT EXISTS 'QUEUED'")
+
+
+def downgrade() -> None:
+    # Enum values cannot be dropped; settle commands that never ran as rejected
+    op.execute("UPDATE commands SET action_taken = 'REJECTED' WHERE action_taken = 'QUEUED'")
@@ -0,0 +1,69 @@
+"""Aho-Corasick automaton for finding many literals in one pass."""
+from collections import deque
+from typing import Dict, FrozenSet, Iterable, List, Tuple
+
+
+class AhoCorasick:
+    """
+    Find which of a fixed set of literal strings occur in a text.
+
+    The automaton is built once; each search walks the text a single time,
+    so the cost depends on the text length, not on the number of literals.
+    """
+
+    def __init__(self, literals: Iterable[str]):
+        self.literals: Tuple[str, ...] = tuple(dict.fromkeys(literals))
+
+        goto: List[Dict[str, int]] = [{}]
+        outputs: List[FrozenSet[int]] = [frozenset()]
+        for literal_id, literal in enumerate(self.literals):
+            state = 0
+            for char in literal:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    outputs.append(frozenset())
+                state = next_state
+            outputs[state] = outputs[state] | {literal_id}
+
+        # Breadth-first, so a state's fail link is known before its children's
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(char, 0)
+                outputs[next_state] = outputs[next_state] | outputs[fail[next_state]]
+
+        self._goto = goto
+        self._fail = fail
+        self._outputs = outputs
+
+    def find(self, text: str) -> FrozenSet[int]:
+        """
+        Return the ids (indexes into self.literals) of literals found in text.
+
+        Args:
+            text: Text to scan
+
+        Returns:
+            Set of literal ids that occur at least once
+        """
+        goto = self._goto
+        fail = self._fail
+        outputs = self._outputs
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+        return frozenset(found)
@@ -1,5 +1,5 @@
 """Audit logging."""
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterable, Tuple
 from uuid import UUID
 from sqlalchemy.orm import Session
 
@@ -33,3 +33,20 @@ def log_event(
     db.flush()
     return audit_log
 
+
+
+def log_events(
+    db: Session,
+    events: Iterable[Tuple[Optional[UUID], str, Optional[Dict[str, Any]]]]
+):
+    """
+    Add many audit events at once, inserted together with the next flush.
+    
+    Args:
+        db: Database session
+        events: (actor_user_id, event_type, details) tuples
+    """
+    db.add_all([
+        AuditLog(actor_user_id=actor_user_id, event_type=event_type, details=details or {})
+        for actor_user_id, event_type, details in events
+    ])
@@ -0,0 +1,34 @@
+"""Parse a submitted command once per request."""
+import shlex
+from typing import NamedTuple, Tuple
+
+
+class ParsedCommand(NamedTuple):
+    """Normalized command text and its shell-style tokens."""
+    text: str
+    argv: Tuple[str, ...]
+    program: str
+    lower: str
+
+
+def parse_command(command_text: str) -> ParsedCommand:
+    """
+    Normalize and tokenize a command.
+
+    Tokens follow POSIX shell quoting (shlex). Text that does not tokenize,
+    such as an unbalanced quote, falls back to splitting on whitespace so
+    every command still gets an argv.
+
+    Args:
+        command_text: The command as submitted
+
+    Returns:
+        ParsedCommand with the stripped text, argv, argv[0] ("" for an
+        empty command) and the lowercased text
+    """
+    text = command_text.strip()
+    try:
+        argv = tuple(shlex.split(text))
+    except ValueError:
+        argv = tuple(text.split())
+    return ParsedCommand(text, argv, argv[0] if argv else "", text.lower())
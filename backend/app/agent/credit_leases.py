@@ -0,0 +1,459 @@
+"""Credit leasing: spend a user's credits from per-worker reserved blocks."""
+import asyncio
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models import CreditLease
+from app.agent.credits import add_credits, deduct_credit, deduct_credits_up_to, get_credit_balance
+
+# Credits a worker reserves per user at once; 0 disables leasing
+CREDIT_LEASE_SIZE = int(os.getenv("CREDIT_LEASE_SIZE", "0"))
+# Seconds a lease lasts before its unused credits go back to the user
+CREDIT_LEASE_TTL = float(os.getenv("CREDIT_LEASE_TTL", "30"))
+# Extra seconds before another worker may reclaim an expired lease (clock skew)
+CREDIT_LEASE_RECLAIM_GRACE = float(os.getenv("CREDIT_LEASE_RECLAIM_GRACE", "30"))
+
+# Identifies this process's leases
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class _HeldLease:
+    """This process's view of one of its leases."""
+    __slots__ = ("id", "user_id", "remaining", "expires_at")
+
+    def __init__(self, lease_id: uuid.UUID, user_id: Any, remaining: int, expires_at: datetime):
+        self.id = lease_id
+        self.user_id = user_id
+        self.remaining = remaining
+        self.expires_at = expires_at
+
+
+class CreditLeaseManager:
+    """
+    Per-process credit leases.
+
+    A lease moves a block of credits out of the user's balance into a
+    credit_leases row owned by this worker, in one short transaction that
+    appends a "lease" ledger entry through deduct_credit. Requests reserve
+    the lease on their own session before their unit of work starts
+    (reserve()), one at a time per user, so a worker holds one lease per
+    user and never needs a second connection. Spending from it is then
+    decided in memory, and recorded by incrementing the lease's spent count
+    in the caller's transaction. That row belongs to this worker alone, so
+    hot users no longer serialize every worker on their balance.
+
+    The spent count commits together with the command it pays for, so
+    reserved - spent is always what is truly unspent. Returning a lease
+    (on expiry, at shutdown, or by another worker after a crash) deletes the
+    row and credits exactly that back through the ledger, so credits can be forfeited by a lost
+    transaction but never minted. A lease that is used up, or deleted under
+    a worker (reclaimed or revoked), makes the charge fall back to a direct
+    deduction.
+    """
+
+    def __init__(self, lease_size: int = CREDIT_LEASE_SIZE, ttl: float = CREDIT_LEASE_TTL,
+                 worker_id: str = WORKER_ID):
+        self.lease_size = lease_size
+        self.ttl = ttl
+        self.worker_id = worker_id
+        # Stop spending from a lease this long before it expires
+        self.margin = timedelta(seconds=min(5.0, ttl / 4))
+        self._leases: Dict[Any, _HeldLease] = {}
+        # Leases replaced by a newer one, waiting to be returned
+        self._retired: List[_HeldLease] = []
+        self._lock = threading.Lock()
+        # Per-user reservations in progress: user id -> [lock, waiting requests]
+        self._reserving: Dict[Any, list] = {}
+
+    def available(self, user_id: Any) -> int:
+        """Credits this process can still spend for a user without touching the ledger."""
+        with self._lock:
+            lease = self._leases.get(user_id)
+            if lease is None or not self._usable(lease, datetime.utcnow()):
+                return 0
+            return lease.remaining
+
+    async def reserve(self, db: AsyncSession, user_id: Any, amount: int = 1):
+        """
+        Make sure a lease covers an amount, leasing a new block if needed.
+
+        Runs before the request's unit of work, on its session, and commits
+        the lease in its own short transaction. Concurrent requests of one
+        user wait for a single reservation instead of each leasing a block.
+        Nothing is reserved if the user cannot cover a whole block; their
+        charges then deduct directly.
+
+        Args:
+            db: The request's async session (committed)
+            user_id: UUID of the user
+            amount: Credits the request is about to spend
+        """
+        if self.available(user_id) >= amount:
+            return
+        entry = self._reserving.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                # Another request may have leased while we waited
+                if self.available(user_id) >= amount:
+                    return
+                size = max(self.lease_size, amount)
+                try:
+                    row = await db.run_sync(self._lease, user_id, size)
+                    await db.commit()
+                except BaseException:
+                    await db.rollback()
+                    raise
+                if row is not None:
+                    self._hold(_HeldLease(row[0], user_id, size, row[1]))
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._reserving[user_id]
+
+    def charge(self, db: Session, user_id: Any, amount: int = 1) -> tuple[bool, Optional[int]]:
+        """
+        Spend credits, from this process's lease when it covers the amount.
+
+        Args:
+            db: Database session of the caller's transaction
+            user_id: UUID of the user
+            amount: Credits to spend
+
+        Returns:
+            Tuple of (success, new_balance including leased credits) or (False, None)
+        """
+        lease = self._take(user_id, amount)
+        if lease is None:
+            # No (big enough) lease: reserve() found too few credits to lease a block
+            return deduct_credit(db, user_id, amount)
+
+        if not self._record_spent(db, lease, amount):
+            return deduct_credit(db, user_id, amount)
+
+        return True, get_balance(db, user_id)
+
+    def charge_up_to(self, db: Session, user_id: Any, amount: int) -> int:
+        """
+        Spend as many credits as the lease and the balance cover, up to an amount.
+
+        Args:
+            db: Database session of the caller's transaction
+            user_id: UUID of the user
+            amount: Most credits to spend
+
+        Returns:
+            Credits actually spent (0 to amount)
+        """
+        spent = 0
+        taken = self._take_up_to(user_id, amount)
+        if taken is not None:
+            lease, spent = taken
+            if not self._record_spent(db, lease, spent):
+                spent = 0
+        return spent + deduct_credits_up_to(db, user_id, amount - spent)
+
+    def release_expiring(self, db: Session) -> int:
+        """
+        Return this process's leases that are (nearly) expired or replaced.
+
+        Args:
+            db: Database session (committed)
+
+        Returns:
+            Credits handed back to users
+        """
+        cutoff = datetime.utcnow() + self.margin
+        with self._lock:
+            due = self._retired + [lease for lease in self._leases.values() if lease.expires_at <= cutoff]
+        return self._release(db, due)
+
+    def release_all(self, db: Session) -> int:
+        """
+        Return every lease of this process (at shutdown).
+
+        Args:
+            db: Database session (committed)
+
+        Returns:
+            Credits handed back to users
+        """
+        with self._lock:
+            due = self._retired + list(self._leases.values())
+        return self._release(db, due)
+
+    def forget_user(self, user_id: Any):
+        """Stop spending from this process's leases of a user (their rows were revoked)."""
+        with self._lock:
+            self._leases.pop(user_id, None)
+            self._retired = [lease for lease in self._retired if lease.user_id != user_id]
+
+    def clear(self):
+        """Forget every lease without returning it."""
+        with self._lock:
+            self._leases.clear()
+            self._retired.clear()
+
+    def _usable(self, lease: _HeldLease, now: datetime) -> bool:
+        """Whether a lease may still be spent from (caller holds the lock)."""
+        return lease.expires_at - self.margin > now
+
+    def _take(self, user_id: Any, amount: int) -> Optional[_HeldLease]:
+        """Spend from the in-memory lease, if it covers the amount."""
+        with self._lock:
+            lease = self._leases.get(user_id)
+            if lease is None or lease.remaining < amount or not self._usable(lease, datetime.utcnow()):
+                return None
+            lease.remaining -= amount
+            return lease
+
+    def _take_up_to(self, user_id: Any, amount: int) -> Optional[Tuple[_HeldLease, int]]:
+        """Spend what the in-memory lease has, up to the amount, as (lease, taken)."""
+        with self._lock:
+            lease = self._leases.get(user_id)
+            if lease is None or lease.remaining <= 0 or not self._usable(lease, datetime.utcnow()):
+                return None
+            taken = min(lease.remaining, amount)
+            lease.remaining -= taken
+            return lease, taken
+
+    def _record_spent(self, db: Session, lease: _HeldLease, amount: int) -> bool:
+        """Count a spend on the lease row; False (and forget it) if the row is gone."""
+        recorded = db.execute(
+            update(CreditLease)
+            .where(CreditLease.id == lease.id, CreditLease.spent + amount <= CreditLease.reserved)
+            .values(spent=CreditLease.spent + amount)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if recorded != 1:
+            # Reclaimed or revoked underneath us
+            self._forget(lease)
+            return False
+        return True
+
+    def _lease(self, db: Session, user_id: Any, size: int) -> Optional[Tuple[uuid.UUID, datetime]]:
+        """Move a block out of the balance into a new lease row (not committed)."""
+        reserved, _ = deduct_credit(db, user_id, size, reason="lease")
+        if not reserved:
+            return None
+        row = CreditLease(
+            user_id=user_id,
+            worker_id=self.worker_id,
+            reserved=size,
+            spent=0,
+            expires_at=datetime.utcnow() + timedelta(seconds=self.ttl)
+        )
+        db.add(row)
+        db.flush()
+        return row.id, row.expires_at
+
+    def _hold(self, lease: _HeldLease):
+        """Start spending from a committed lease, retiring the user's previous one."""
+        with self._lock:
+            previous = self._leases.get(lease.user_id)
+            if previous is not None:
+                self._retired.append(previous)
+            self._leases[lease.user_id] = lease
+
+    def _forget(self, lease: _HeldLease):
+        """Drop a lease whose row is gone."""
+        with self._lock:
+            if self._leases.get(lease.user_id) is lease:
+                del self._leases[lease.user_id]
+            if lease in self._retired:
+                self._retired.remove(lease)
+
+    def _release(self, db: Session, leases: List[_HeldLease]) -> int:
+        """Return leases and stop tracking them."""
+        returned = 0
+        for lease in leases:
+            returned += return_lease(db, lease.id)
+            self._forget(lease)
+        db.commit()
+        return returned
+
+
+def return_lease(db: Session, lease_id: uuid.UUID) -> int:
+    """
+    Delete a lease and give its unspent credits back to the user.
+
+    The unspent count is read by the DELETE itself (or under a row lock
+    where DELETE ... RETURNING is unavailable), so a spend committing
+    concurrently is either included or finds the lease gone, and a lease
+    returned twice only counts once.
+
+    Args:
+        db: Database session (not committed)
+        lease_id: Lease to return
+
+    Returns:
+        Credits handed back
+    """
+    if db.get_bind().dialect.delete_returning:
+        row = db.execute(
+            delete(CreditLease)
+            .where(CreditLease.id == lease_id)
+            .returning(CreditLease.user_id, CreditLease.reserved - CreditLease.spent)
+            .execution_options(synchronize_session=False)
+        ).first()
+    else:
+        row = db.execute(
+            select(CreditLease.user_id, CreditLease.reserved - CreditLease.spent)
+            .where(CreditLease.id == lease_id)
+            .with_for_update()
+        ).first()
+        if row is not None:
+            db.execute(
+                delete(CreditLease).where(CreditLease.id == lease_id).execution_options(synchronize_session=False)
+            )
+
+    if row is None:
+        return 0
+    user_id, unspent = row
+    if unspent > 0:
+        add_credits(db, user_id, unspent, "lease_return")
+    return max(unspent, 0)
+
+
+def reclaim_expired_leases(db: Session, grace: float = CREDIT_LEASE_RECLAIM_GRACE) -> int:
+    """
+    Return leases that expired more than grace seconds ago, whoever owns them.
+
+    This is crash recovery: a live worker returns its own leases before
+    they expire.
+
+    Args:
+        db: Database session (committed)
+        grace: Seconds past expiry before a lease is reclaimed
+
+    Returns:
+        Credits handed back to users
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=grace)
+    lease_ids = db.execute(select(CreditLease.id).where(CreditLease.expires_at < cutoff)).scalars().all()
+    returned = sum(return_lease(db, lease_id) for lease_id in lease_ids)
+    db.commit()
+    return returned
+
+
+def revoke_user_leases(db: Session, user_id: Any):
+    """
+    Delete a user's leases without returning them (before setting the balance outright).
+
+    Args:
+        db: Database session (not committed)
+        user_id: UUID of the user
+    """
+    db.execute(delete(CreditLease).where(CreditLease.user_id == user_id).execution_options(synchronize_session=False))
+    lease_manager.forget_user(user_id)
+
+
+def leased_credits(db: Session, user_ids: Optional[List[Any]] = None) -> Dict[Any, int]:
+    """
+    Unspent leased credits per user.
+
+    Args:
+        db: Database session
+        user_ids: Only these users (default: all)
+
+    Returns:
+        Dict of user id -> credits held in leases (users without leases are absent)
+    """
+    query = select(CreditLease.user_id, func.sum(CreditLease.reserved - CreditLease.spent)).group_by(CreditLease.user_id)
+    if user_ids is not None:
+        query = query.where(CreditLease.user_id.in_(user_ids))
+    return {user_id: int(total) for user_id, total in db.execute(query)}
+
+
+def get_balance(db: Session, user_id: Any) -> Optional[int]:
+    """
+    A user's balance: the ledger balance plus credits held in leases.
+
+    Args:
+        db: Database session
+        user_id: UUID of the user
+
+    Returns:
+        The balance, or None if the user does not exist
+    """
+    credits = get_credit_balance(db, user_id)
+    if credits is None or CREDIT_LEASE_SIZE <= 0:
+        return credits
+    return credits + leased_credits(db, [user_id]).get(user_id, 0)
+
+
+def has_credits(db: Session, user_id: Any, amount: int = 1) -> bool:
+    """
+    Cheap pre-check that a user can cover an amount (the charge itself decides).
+
+    Args:
+        db: Database session
+        user_id: UUID of the user
+        amount: Credits needed
+
+    Returns:
+        True if the balance covers the amount
+    """
+    if CREDIT_LEASE_SIZE > 0 and lease_manager.available(user_id) >= amount:
+        return True
+    balance = get_balance(db, user_id)
+    return balance is not None and balance >= amount
+
+
+async def reserve_credits(db: AsyncSession, user_id: Any, amount: int = 1):
+    """
+    Lease credits for a request about to spend them, when leasing is enabled.
+
+    Args:
+        db: The request's async session, before its unit of work starts
+        user_id: UUID of the user
+        amount: Credits the request may spend
+    """
+    if CREDIT_LEASE_SIZE > 0:
+        await lease_manager.reserve(db, user_id, amount)
+
+
+def charge_credits(db: Session, user_id: Any, amount: int = 1) -> tuple[bool, Optional[int]]:
+    """
+    Spend credits, through this process's lease when leasing is enabled.
+
+    Args:
+        db: Database session of the caller's transaction
+        user_id: UUID of the user
+        amount: Credits to spend
+
+    Returns:
+        Tuple of (success, new_balance) or (False, None) if insufficient credits
+    """
+    if CREDIT_LEASE_SIZE > 0:
+        return lease_manager.charge(db, user_id, amount)
+    return deduct_credit(db, user_id, amount)
+
+
+def charge_credits_up_to(db: Session, user_id: Any, amount: int) -> int:
+    """
+    Spend as many credits as the balance covers, up to an amount, through
+    this process's lease when leasing is enabled.
+
+    Args:
+        db: Database session of the caller's transaction
+        user_id: UUID of the user
+        amount: Most credits to spend
+
+    Returns:
+        Credits actually spent (0 to amount)
+    """
+    if CREDIT_LEASE_SIZE > 0 and amount > 0:
+        return lease_manager.charge_up_to(db, user_id, amount)
+    return deduct_credits_up_to(db, user_id, amount)
+
+
+lease_manager = CreditLeaseManager()
@@ -1,35 +1,278 @@
 """Credit management with transaction safety."""
-from typing import Optional
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import case, false, func, insert, literal, select, text, true, update
 
-from app.models import User
+from app.models import CreditLedger, User
 
+# Seconds between ledger compactions; 0 disables the background compactor
+CREDIT_COMPACTION_INTERVAL = float(os.getenv("CREDIT_COMPACTION_INTERVAL", "10"))
 
-def deduct_credit(db: Session, user_id: str, amount: int = 1) -> tuple[bool, Optional[int]]:
+_ENTRY_COLUMNS = ["user_id", "delta", "reason", "compacted", "created_at"]
+
+
+def deduct_credit(db: Session, user_id: str, amount: int = 1, reason: str = "command") -> tuple[bool, Optional[int]]:
     """
-    Deduct credits from a user atomically using SELECT FOR UPDATE.
-    
+    Deduct credits from a user by appending a ledger entry, if the balance covers it.
+
+    The overdraft check and the insert are one INSERT ... SELECT ... WHERE
+    balance >= amount, where the balance is the compacted users.credits
+    plus the user's uncompacted entries; on Postgres the same statement
+    also returns the new balance. The users row is not written.
+
+    Debits of one user are still ordered, because an uncommitted entry is
+    invisible to other transactions: SQLite runs the statement under its
+    writer lock, and on Postgres a per-user advisory lock is taken just
+    before it and held until commit. So of several deductions that cannot
+    all be covered, exactly as many succeed as the balance allows. Callers
+    should deduct as late in their transaction as they can, since that is
+    how long the user's other debits wait; hot accounts can avoid the wait
+    altogether with credit leases.
+
     Args:
         db: Database session
         user_id: UUID of the user
         amount: Amount of credits to deduct (default 1)
-        
+        reason: Ledger reason for the entry
+
     Returns:
         Tuple of (success, new_balance) or (False, None) if insufficient credits
     """
-    # Use SELECT FOR UPDATE to lock the row
-    stmt = select(User).where(User.id == user_id).with_for_update()
-    user = db.execute(stmt).scalar_one_or_none()
-    
-    if not user:
-        return False, None
-    
-    if user.credits < amount:
+    _lock_user_credits(db, user_id)
+    if db.get_bind().dialect.name == "postgresql":
+        # One round-trip: the new balance is the balance checked plus the entry
+        checked = select(_balance_of(user_id).label("balance")).cte("checked")
+        entry = select(
+            literal(user_id, User.id.type), literal(-amount), literal(reason), false(), literal(datetime.utcnow())
+        ).select_from(checked).where(checked.c.balance >= amount)
+        debit = insert(CreditLedger).from_select(_ENTRY_COLUMNS, entry).returning(CreditLedger.delta).cte("debit")
+        new_balance = db.execute(select(checked.c.balance + debit.c.delta)).scalar()
+        return (True, new_balance) if new_balance is not None else (False, None)
+
+    entry = select(
+        literal(user_id, User.id.type), literal(-amount), literal(reason), false(), literal(datetime.utcnow())
+    ).where(_balance_of(user_id) >= amount)
+    if db.execute(insert(CreditLedger).from_select(_ENTRY_COLUMNS, entry)).rowcount != 1:
         return False, None
-    
-    user.credits -= amount
-    db.flush()  # Flush to get updated balance
-    
-    return True, user.credits
 
+    # SQLite is in process, so reading the balance back costs no round-trip
+    return True, get_credit_balance(db, user_id)
+
+
+def deduct_credits_up_to(db: Session, user_id: Any, amount: int, reason: str = "command") -> int:
+    """
+    Deduct as many credits as the balance covers, up to an amount.
+
+    One INSERT ... SELECT ... RETURNING takes min(amount, balance), so
+    concurrent callers can split a balance between them but never overdraw it.
+
+    Args:
+        db: Database session
+        user_id: UUID of the user
+        amount: Most credits to deduct
+        reason: Ledger reason for the entry
+
+    Returns:
+        Credits actually deducted (0 to amount)
+    """
+    if amount <= 0:
+        return 0
+    if not db.get_bind().dialect.insert_returning:
+        # Take whatever the balance shows; the conditional insert retries if it moved
+        while True:
+            granted = min(amount, get_credit_balance(db, user_id) or 0)
+            if granted <= 0 or deduct_credit(db, user_id, granted, reason)[0]:
+                return max(granted, 0)
+
+    _lock_user_credits(db, user_id)
+    balance = _balance_of(user_id)
+    granted = case((balance >= amount, literal(amount)), else_=balance)
+    entry = select(
+        literal(user_id, User.id.type), -granted, literal(reason), false(), literal(datetime.utcnow())
+    ).where(balance > 0)
+    delta = db.execute(
+        insert(CreditLedger).from_select(_ENTRY_COLUMNS, entry).returning(CreditLedger.delta)
+    ).scalar()
+    return -delta if delta is not None else 0
+
+
+def add_credits(db: Session, user_id: Any, amount: int, reason: str):
+    """
+    Append a ledger entry that can only raise the balance (no lock needed).
+
+    Args:
+        db: Database session (not committed)
+        user_id: UUID of the user
+        amount: Credits to add (not negative)
+        reason: Ledger reason for the entry
+    """
+    db.add(CreditLedger(user_id=user_id, delta=amount, reason=reason, compacted=False))
+
+
+def record_opening_balance(db: Session, user: User):
+    """
+    Record a new user's starting users.credits as an already-compacted entry.
+
+    Keeps users.credits equal to the sum of compacted entries, which is what
+    reconciliation checks.
+
+    Args:
+        db: Database session (not committed)
+        user: Newly added user
+    """
+    db.flush()
+    db.add(CreditLedger(user_id=user.id, delta=user.credits, reason="opening", compacted=True))
+
+
+def set_credit_balance(db: Session, user_id: Any, credits: int):
+    """
+    Set a user's balance outright by appending the difference.
+
+    Args:
+        db: Database session (not committed)
+        user_id: UUID of the user
+        credits: New balance
+    """
+    _lock_user_credits(db, user_id)
+    entry = select(
+        literal(user_id, User.id.type), literal(credits) - _balance_of(user_id), literal("admin_set"),
+        false(), literal(datetime.utcnow())
+    ).where(_balance_of(user_id) != credits)
+    db.execute(insert(CreditLedger).from_select(_ENTRY_COLUMNS, entry))
+
+
+def get_credit_balance(db: Session, user_id: Any) -> Optional[int]:
+    """
+    A user's balance: users.credits plus uncompacted ledger entries.
+
+    Args:
+        db: Database session
+        user_id: UUID of the user
+
+    Returns:
+        The balance, or None if the user does not exist
+    """
+    return db.execute(select(_balance_of(user_id))).scalar()
+
+
+def pending_credits(db: Session, user_ids: Optional[List[Any]] = None) -> Dict[Any, int]:
+    """
+    Sum of uncompacted ledger entries per user.
+
+    Args:
+        db: Database session
+        user_ids: Only these users (default: all)
+
+    Returns:
+        Dict of user id -> pending delta (users without pending entries are absent)
+    """
+    query = (
+        select(CreditLedger.user_id, func.sum(CreditLedger.delta))
+        .where(CreditLedger.compacted == false())
+        .group_by(CreditLedger.user_id)
+    )
+    if user_ids is not None:
+        query = query.where(CreditLedger.user_id.in_(user_ids))
+    return {user_id: int(total) for user_id, total in db.execute(query)}
+
+
+def compact_ledger(db: Session, max_users: int = 500) -> int:
+    """
+    Fold uncompacted ledger entries into users.credits.
+
+    Each user is compacted in its own short transaction that flags the
+    entries it can see and adds their sum to users.credits, so every entry
+    is folded exactly once, including entries that commit late.
+
+    Args:
+        db: Database session (committed per user)
+        max_users: Users compacted per call
+
+    Returns:
+        Number of entries folded
+    """
+    user_ids = db.execute(
+        select(CreditLedger.user_id).where(CreditLedger.compacted == false()).distinct().limit(max_users)
+    ).scalars().all()
+
+    folded = 0
+    for user_id in user_ids:
+        pending = (CreditLedger.user_id == user_id, CreditLedger.compacted == false())
+        if db.get_bind().dialect.update_returning:
+            deltas = db.execute(
+                update(CreditLedger).where(*pending).values(compacted=True)
+                .returning(CreditLedger.delta).execution_options(synchronize_session=False)
+            ).scalars().all()
+        else:
+            rows = db.execute(select(CreditLedger.id, CreditLedger.delta).where(*pending).with_for_update()).all()
+            deltas = [delta for _, delta in rows]
+            db.execute(
+                update(CreditLedger).where(CreditLedger.id.in_([entry_id for entry_id, _ in rows]))
+                .values(compacted=True).execution_options(synchronize_session=False)
+            )
+        if deltas:
+            db.execute(
+                update(User).where(User.id == user_id).values(credits=User.credits + sum(deltas))
+                .execution_options(synchronize_session=False)
+            )
+        db.commit()
+        folded += len(deltas)
+    return folded
+
+
+def reconcile_credits(db: Session) -> Dict[str, Any]:
+    """
+    Compare every materialized balance with its ledger.
+
+    users.credits must equal the sum of the user's compacted entries; any
+    difference (drift) means the balance was changed outside the ledger.
+
+    Args:
+        db: Database session
+
+    Returns:
+        Dict with users (user_id, name, materialized, compacted_total,
+        pending, balance, drift) and pending_entries
+    """
+    compacted_totals = dict(db.execute(
+        select(CreditLedger.user_id, func.sum(CreditLedger.delta))
+        .where(CreditLedger.compacted == true())
+        .group_by(CreditLedger.user_id)
+    ).all())
+    pending = pending_credits(db)
+    pending_entries = db.execute(
+        select(func.count()).select_from(CreditLedger).where(CreditLedger.compacted == false())
+    ).scalar()
+
+    users = []
+    for user_id, name, credits in db.execute(select(User.id, User.name, User.credits).order_by(User.created_at)):
+        compacted_total = int(compacted_totals.get(user_id) or 0)
+        users.append({
+            "user_id": user_id,
+            "name": name,
+            "materialized": credits,
+            "compacted_total": compacted_total,
+            "pending": pending.get(user_id, 0),
+            "balance": credits + pending.get(user_id, 0),
+            "drift": credits - compacted_total,
+        })
+    return {"users": users, "pending_entries": pending_entries}
+
+
+def _balance_of(user_id: Any):
+    """SQL expression for a user's balance (NULL if the user does not exist)."""
+    materialized = select(User.credits).where(User.id == user_id).scalar_subquery()
+    pending = (
+        select(func.coalesce(func.sum(CreditLedger.delta), 0))
+        .where(CreditLedger.user_id == user_id, CreditLedger.compacted == false())
+        .scalar_subquery()
+    )
+    return materialized + pending
+
+
+def _lock_user_credits(db: Session, user_id: Any):
+    """Serialize balance-checked writes for one user until the transaction ends (Postgres)."""
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": f"credits:{user_id}"})
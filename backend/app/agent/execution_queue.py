@@ -0,0 +1,240 @@
+"""Queued command execution: run accepted commands off the request path."""
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+from uuid import UUID
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app.db import AsyncSessionLocal
+from app.models import ActionTaken, AuditLog, Command
+from app.agent.command_parser import ParsedCommand
+from app.agent.executor import EXECUTOR_BACKEND, OutputCallback, get_executor
+from app.notifications.ws import send_to_user
+
+# "inline" runs accepted commands inside the request; "queued" records them
+# as QUEUED, answers 202 and runs them on this worker's execution pool
+# (required by every executor backend except the mock)
+EXECUTION_MODE = os.getenv("EXECUTION_MODE", "inline" if EXECUTOR_BACKEND == "mock" else "queued")
+# Commands run at once per worker process
+EXECUTION_WORKERS = int(os.getenv("EXECUTION_WORKERS", "4"))
+# Commands waiting for a free executor before submissions get 503
+EXECUTION_QUEUE_SIZE = int(os.getenv("EXECUTION_QUEUE_SIZE", "1000"))
+# Seconds shutdown waits for queued commands to finish
+EXECUTION_SHUTDOWN_TIMEOUT = float(os.getenv("EXECUTION_SHUTDOWN_TIMEOUT", "30"))
+
+# Recent queue waits kept for the wait-time percentiles
+_WAIT_SAMPLES = 1000
+
+
+class ExecutionJob(NamedTuple):
+    """An accepted, paid-for command waiting to run."""
+    command_id: UUID
+    user_id: UUID
+    parsed: ParsedCommand
+    rule_id: Optional[UUID]
+    enqueued_at: float = 0.0
+
+
+class ExecutionQueue:
+    """
+    Bounded per-process queue of commands and the workers that run them.
+
+    Submissions reserve a slot before their transaction starts, so a full
+    queue is refused before any credit is taken, and hand the committed
+    command over with submit(). Each worker task awaits the executor
+    backend, which streams output to the user's WebSocket as
+    command_output messages, then marks the command ACCEPTED with its
+    result and sends the final command_update. Commands still queued when
+    the process dies stay QUEUED in the database.
+    """
+
+    def __init__(
+        self,
+        mode: str = EXECUTION_MODE,
+        workers: int = EXECUTION_WORKERS,
+        capacity: int = EXECUTION_QUEUE_SIZE,
+        execute: Callable[[ParsedCommand, Optional[OutputCallback]], Awaitable[Dict[str, Any]]] = get_executor(),
+        session_factory=AsyncSessionLocal
+    ):
+        self.mode = mode
+        self.workers = workers
+        self.capacity = capacity
+        self.execute = execute
+        self.session_factory = session_factory
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._reserved = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._waits = deque(maxlen=_WAIT_SAMPLES)
+
+    @property
+    def queued(self) -> bool:
+        """Whether accepted commands are queued instead of run inline."""
+        return self.mode == "queued"
+
+    @property
+    def started(self) -> bool:
+        """Whether the workers are running."""
+        return self._queue is not None
+
+    def start(self):
+        """Start the worker tasks on the running event loop."""
+        if self.started:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = EXECUTION_SHUTDOWN_TIMEOUT):
+        """
+        Let queued commands finish (up to timeout), then stop the workers.
+
+        Args:
+            timeout: Seconds to wait for the queue to drain
+        """
+        if not self.started:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Warning: {self._queue.qsize()} queued commands left unexecuted at shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._queue = None
+        self._tasks = []
+        self._reserved = 0
+
+    def reserve(self, count: int = 1) -> bool:
+        """
+        Reserve queue slots for commands about to be submitted.
+
+        Args:
+            count: Slots wanted
+
+        Returns:
+            False if the queue cannot take that many more commands
+        """
+        if not self.started or self._reserved + count > self.capacity:
+            return False
+        self._reserved += count
+        return True
+
+    def release(self, count: int = 1):
+        """Give back reserved slots that were not submitted."""
+        self._reserved = max(self._reserved - count, 0)
+
+    def submit(self, job: ExecutionJob):
+        """Queue a committed QUEUED command (using a reserved slot)."""
+        self._queue.put_nowait(job._replace(enqueued_at=time.monotonic()))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Queue depth, worker usage and recent queue wait times.
+
+        Returns:
+            Dict with mode, workers, capacity, depth, running, completed,
+            failed and wait percentiles in milliseconds (None without samples)
+        """
+        waits = sorted(self._waits)
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "depth": self._queue.qsize() if self.started else 0,
+            "running": self._running,
+            "completed": self._completed,
+            "failed": self._failed,
+            "wait_p50_ms": waits[len(waits) // 2] * 1000 if waits else None,
+            "wait_p99_ms": waits[max(int(len(waits) * 0.99) - 1, 0)] * 1000 if waits else None,
+            "wait_max_ms": waits[-1] * 1000 if waits else None,
+        }
+
+    async def _work(self):
+        """Run queued commands one at a time."""
+        while True:
+            job = await self._queue.get()
+            self._waits.append(time.monotonic() - job.enqueued_at)
+            self._reserved -= 1
+            self._running += 1
+            try:
+                try:
+                    result = await self.execute(job.parsed, self._streamer(job))
+                except Exception as e:
+                    self._failed += 1
+                    result = {"stdout": "", "stderr": f"Execution failed: {e}\n", "exit_code": -1}
+                await self._record(job, result)
+                self._completed += 1
+            except Exception as e:
+                print(f"Warning: recording queued command {job.command_id} failed: {e}")
+            finally:
+                self._running -= 1
+                self._queue.task_done()
+
+    @staticmethod
+    def _streamer(job: ExecutionJob) -> OutputCallback:
+        """Output callback pushing a command's output chunks to its user."""
+        async def stream(name: str, text: str):
+            await send_to_user(job.user_id, {
+                "type": "command_output",
+                "command_id": str(job.command_id),
+                "stream": name,
+                "data": text
+            })
+        return stream
+
+    async def _record(self, job: ExecutionJob, result: Dict[str, Any]):
+        """Save a command's result and tell its user."""
+        async with self.session_factory() as db:
+            await db.execute(
+                update(Command)
+                .where(Command.id == job.command_id, Command.action_taken == ActionTaken.QUEUED)
+                .values(action_taken=ActionTaken.ACCEPTED, result=result, executed_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            db.add(AuditLog(actor_user_id=job.user_id, event_type="COMMAND_EXECUTED", details={
+                "command_id": str(job.command_id),
+                "rule_id": str(job.rule_id) if job.rule_id else None,
+                "command_text": job.parsed.text,
+                "cost": 1
+            }))
+            await db.commit()
+        await send_to_user(job.user_id, {
+            "type": "command_update",
+            "command_id": str(job.command_id),
+            "status": "executed",
+            "result": result
+        })
+
+
+execution_queue = ExecutionQueue()
+
+
+def defer_execution(db: Session, job: ExecutionJob):
+    """
+    Remember a QUEUED command to submit once its transaction commits.
+
+    Args:
+        db: Session the command was added in
+        job: The command to run
+    """
+    db.info.setdefault("execution_jobs", []).append(job)
+
+
+def take_deferred_executions(db: Session) -> List[ExecutionJob]:
+    """
+    Collect the commands deferred in a session (after its commit).
+
+    Args:
+        db: Session passed to defer_execution
+
+    Returns:
+        The jobs, in the order they were deferred
+    """
+    return db.info.pop("execution_jobs", [])
@@ -1,59 +1,285 @@
-"""Mock command executor."""
-import re
-from typing import Dict, Any
+"""Command executors: the mock and a subprocess backend with resource limits."""
+import asyncio
+import codecs
+import os
+import shutil
+import signal
+import tempfile
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
+try:
+    import resource
+except ImportError:  # not available on Windows; limits are then not applied
+    resource = None
 
-def simulate_execution(command_text: str) -> Dict[str, Any]:
+from app.agent.command_parser import ParsedCommand
+
+# "mock" returns canned output; "subprocess" really runs the command
+EXECUTOR_BACKEND = os.getenv("EXECUTOR_BACKEND", "mock")
+# Parent of the per-command working directories (subprocess backend)
+EXECUTOR_SANDBOX_DIR = os.getenv("EXECUTOR_SANDBOX_DIR", os.path.join(tempfile.gettempdir(), "command-gateway"))
+# PATH the commands are looked up in
+EXECUTOR_PATH = os.getenv("EXECUTOR_PATH", "/usr/local/bin:/usr/bin:/bin")
+# CPU seconds per command (RLIMIT_CPU)
+EXECUTOR_CPU_SECONDS = int(os.getenv("EXECUTOR_CPU_SECONDS", "5"))
+# Address space per command in MiB (RLIMIT_AS)
+EXECUTOR_MEMORY_MB = int(os.getenv("EXECUTOR_MEMORY_MB", "512"))
+# Bytes of stdout and stderr (together) kept and streamed before the command is killed;
+# also the largest file it may write (RLIMIT_FSIZE)
+EXECUTOR_OUTPUT_LIMIT = int(os.getenv("EXECUTOR_OUTPUT_LIMIT", "65536"))
+# Wall-clock seconds before the command is killed (covers sleeping and blocked commands)
+EXECUTOR_TIMEOUT = float(os.getenv("EXECUTOR_TIMEOUT", "10"))
+# Seconds to collect remaining output after a kill before the pipes are closed
+# (something that left the process group, e.g. via setsid, can hold them open)
+EXECUTOR_DRAIN_TIMEOUT = float(os.getenv("EXECUTOR_DRAIN_TIMEOUT", "1"))
+# Largest output chunk read (and streamed) at once
+EXECUTOR_CHUNK_SIZE = int(os.getenv("EXECUTOR_CHUNK_SIZE", "4096"))
+
+# util-linux prlimit sets the rlimits and execs the command, sparing the
+# event loop a full fork of this process for preexec_fn
+_PRLIMIT = shutil.which("prlimit")
+
+# Receives (stream name, text) for every chunk of output as it arrives
+OutputCallback = Callable[[str, str], Awaitable[None]]
+
+
+def simulate_execution(command: ParsedCommand) -> Dict[str, Any]:
     """
     Simulate command execution with mock responses.
-    
+
     Args:
-        command_text: The command to execute
-        
+        command: The parsed command to execute
+
     Returns:
         Dictionary with stdout, stderr, and exit_code
     """
-    command_text = command_text.strip()
-    
+    program = command.program.lower()
+
     # Handle ls commands
-    if re.match(r'^ls\s', command_text, re.IGNORECASE) or command_text.lower() == 'ls':
+    if program == 'ls':
         return {
             "stdout": "file1.txt\nfile2.txt\nfile3.txt\n",
             "stderr": "",
             "exit_code": 0
         }
-    
+
     # Handle cat commands
-    if re.match(r'^cat\s', command_text, re.IGNORECASE):
-        filename = command_text.split()[1] if len(command_text.split()) > 1 else "file.txt"
+    if program == 'cat' and len(command.argv) > 1:
+        filename = command.argv[1]
         return {
             "stdout": f"Contents of {filename}\nLine 1\nLine 2\nLine 3\n",
             "stderr": "",
             "exit_code": 0
         }
-    
+
     # Handle pwd
-    if command_text.lower() == 'pwd':
+    if command.lower == 'pwd':
         return {
             "stdout": "/home/user\n",
             "stderr": "",
             "exit_code": 0
         }
-    
+
     # Handle echo
-    if re.match(r'^echo\s', command_text, re.IGNORECASE):
-        # Extract text after 'echo'
-        echo_text = command_text[4:].strip()
+    if program == 'echo' and len(command.argv) > 1:
+        # Arguments as the shell would pass them, quotes removed
+        echo_text = " ".join(command.argv[1:])
         return {
             "stdout": f"{echo_text}\n",
             "stderr": "",
             "exit_code": 0
         }
-    
+
     # Default mock response
     return {
-        "stdout": f"Mock execution of: {command_text}\n",
+        "stdout": f"Mock execution of: {command.text}\n",
         "stderr": "",
         "exit_code": 0
     }
 
+
+async def mock_execution(command: ParsedCommand, on_output: Optional[OutputCallback] = None) -> Dict[str, Any]:
+    """
+    Run simulate_execution as an executor backend.
+
+    Args:
+        command: The parsed command to execute
+        on_output: Receives the canned output as one chunk per stream
+
+    Returns:
+        Dictionary with stdout, stderr, and exit_code
+    """
+    result = simulate_execution(command)
+    if on_output is not None:
+        for stream in ("stdout", "stderr"):
+            if result[stream]:
+                await on_output(stream, result[stream])
+    return result
+
+
+async def subprocess_execution(command: ParsedCommand, on_output: Optional[OutputCallback] = None) -> Dict[str, Any]:
+    """
+    Run a command as a subprocess in a fresh working directory, with limits.
+
+    argv is executed directly (no shell) in its own session, in an empty
+    directory under EXECUTOR_SANDBOX_DIR that is removed afterwards, with a
+    minimal environment. CPU time, address space, written file size and
+    core dumps are capped with rlimits. Output is passed to on_output as it
+    arrives; once stdout and stderr together pass EXECUTOR_OUTPUT_LIMIT, or
+    the command runs longer than EXECUTOR_TIMEOUT, its process group is
+    killed; output still arriving EXECUTOR_DRAIN_TIMEOUT seconds after that
+    (from a process that escaped the group) is dropped. This limits resources; it does not isolate the command from
+    the host the way a container would.
+
+    Args:
+        command: The parsed command to execute
+        on_output: Receives (stream, text) for each chunk of output
+
+    Returns:
+        Dictionary with stdout, stderr, exit_code (128 + signal if killed)
+        and killed ("timeout", "output_limit" or None)
+    """
+    if not command.argv:
+        return {"stdout": "", "stderr": "empty command\n", "exit_code": 127, "killed": None}
+
+    os.makedirs(EXECUTOR_SANDBOX_DIR, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix="cmd-", dir=EXECUTOR_SANDBOX_DIR)
+    try:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *_limited_argv(command.argv),
+                cwd=workdir,
+                env={"PATH": EXECUTOR_PATH, "HOME": workdir, "TMPDIR": workdir, "LANG": "C.UTF-8"},
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
+                preexec_fn=_apply_limits if _PRLIMIT is None and resource is not None else None
+            )
+        except OSError as e:
+            # Same exit codes as a shell: 127 not found, 126 not executable (prlimit reports these itself)
+            exit_code = 127 if isinstance(e, FileNotFoundError) else 126
+            return {"stdout": "", "stderr": f"{command.program}: {e.strerror}\n", "exit_code": exit_code, "killed": None}
+
+        output = _Output(EXECUTOR_OUTPUT_LIMIT)
+        readers = asyncio.gather(
+            _pump(process, process.stdout, "stdout", output, on_output),
+            _pump(process, process.stderr, "stderr", output, on_output)
+        )
+        try:
+            await asyncio.wait_for(asyncio.shield(readers), EXECUTOR_TIMEOUT)
+        except asyncio.TimeoutError:
+            output.killed = output.killed or "timeout"
+            _kill(process)
+            try:
+                # Cancels the readers if the pipes stay open past the grace period
+                await asyncio.wait_for(readers, EXECUTOR_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                _close_pipes(process)
+        exit_code = await process.wait()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "stdout": "".join(output.chunks["stdout"]),
+        "stderr": "".join(output.chunks["stderr"]),
+        "exit_code": 128 - exit_code if exit_code < 0 else exit_code,
+        "killed": output.killed,
+    }
+
+
+EXECUTOR_BACKENDS = {"mock": mock_execution, "subprocess": subprocess_execution}
+
+
+def get_executor(name: str = EXECUTOR_BACKEND) -> Callable[..., Awaitable[Dict[str, Any]]]:
+    """
+    Look up an executor backend.
+
+    Args:
+        name: Backend name ("mock" or "subprocess")
+
+    Returns:
+        Coroutine function taking (command, on_output)
+
+    Raises:
+        ValueError: If there is no such backend
+    """
+    if name not in EXECUTOR_BACKENDS:
+        raise ValueError(f"Unknown executor backend: {name}")
+    return EXECUTOR_BACKENDS[name]
+
+
+class _Output:
+    """Output kept from one command, shared by its stdout and stderr readers."""
+
+    def __init__(self, limit: int):
+        self.remaining = limit
+        self.chunks: Dict[str, List[str]] = {"stdout": [], "stderr": []}
+        self.killed: Optional[str] = None
+
+
+async def _pump(process, stream: asyncio.StreamReader, name: str, output: _Output,
+                on_output: Optional[OutputCallback]):
+    """Forward one output stream chunk by chunk until EOF or the output limit."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        data = await stream.read(EXECUTOR_CHUNK_SIZE)
+        final = not data or len(data) > output.remaining
+        if len(data) > output.remaining:
+            data = data[:output.remaining]
+            if output.killed is None:
+                output.killed = "output_limit"
+                _kill(process)
+        output.remaining -= len(data)
+        text = decoder.decode(data, final=final)
+        if text:
+            output.chunks[name].append(text)
+            if on_output is not None:
+                await on_output(name, text)
+        if final:
+            return
+
+
+def _kill(process):
+    """Kill a command and anything it started (its own session)."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _close_pipes(process):
+    """Stop reading a command's output pipes that something outside it still holds open."""
+    # asyncio.subprocess.Process does not expose its transport publicly
+    transport = getattr(process, "_transport", None)
+    if transport is None:
+        return
+    for fd in (1, 2):
+        pipe = transport.get_pipe_transport(fd)
+        if pipe is not None:
+            pipe.close()
+
+
+def _limited_argv(argv) -> List[str]:
+    """argv run under prlimit with the command's rlimits (unchanged without prlimit)."""
+    if _PRLIMIT is None:
+        return list(argv)
+    memory = EXECUTOR_MEMORY_MB * 1024 * 1024
+    return [
+        _PRLIMIT,
+        f"--cpu={EXECUTOR_CPU_SECONDS}:{EXECUTOR_CPU_SECONDS}",
+        f"--as={memory}:{memory}",
+        f"--fsize={EXECUTOR_OUTPUT_LIMIT}:{EXECUTOR_OUTPUT_LIMIT}",
+        "--core=0:0",
+        "--",
+        *argv,
+    ]
+
+
+def _apply_limits():
+    """Set the command's rlimits (runs in the child before exec)."""
+    resource.setrlimit(resource.RLIMIT_CPU, (EXECUTOR_CPU_SECONDS, EXECUTOR_CPU_SECONDS))
+    memory = EXECUTOR_MEMORY_MB * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (EXECUTOR_OUTPUT_LIMIT, EXECUTOR_OUTPUT_LIMIT))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
@@ -0,0 +1,187 @@
+"""Streaming export of command history and audit logs as NDJSON or CSV."""
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import datetime
+from enum import Enum
+from typing import Any, Iterable, Iterator, List, Optional, Sequence
+from uuid import UUID
+
+from sqlalchemy import Select, select
+from sqlalchemy.engine import Engine
+
+from app.models import ActionTaken, AuditLog, Command
+
+# Rows fetched per round-trip from the server-side cursor (and encoded per chunk)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+_commands = Command.__table__
+_audit_logs = AuditLog.__table__
+
+COMMAND_EXPORT_COLUMNS = [
+    _commands.c.id, _commands.c.user_id, _commands.c.command_text, _commands.c.matched_rule_id,
+    _commands.c.action_taken, _commands.c.cost, _commands.c.result, _commands.c.executed_at,
+    _commands.c.created_at,
+]
+AUDIT_LOG_EXPORT_COLUMNS = [
+    _audit_logs.c.id, _audit_logs.c.actor_user_id, _audit_logs.c.event_type, _audit_logs.c.details,
+    _audit_logs.c.created_at,
+]
+
+
+def command_export_query(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user_id: Optional[UUID] = None,
+    actions: Optional[List[ActionTaken]] = None
+) -> Select:
+    """
+    Commands to export, oldest first.
+
+    Args:
+        since: Only commands created at or after this time
+        until: Only commands created before this time
+        user_id: Only this user's commands
+        actions: Only commands with one of these outcomes
+
+    Returns:
+        Core select of COMMAND_EXPORT_COLUMNS
+    """
+    query = select(*COMMAND_EXPORT_COLUMNS)
+    if since is not None:
+        query = query.where(_commands.c.created_at >= since)
+    if until is not None:
+        query = query.where(_commands.c.created_at < until)
+    if user_id is not None:
+        query = query.where(_commands.c.user_id == user_id)
+    if actions:
+        query = query.where(_commands.c.action_taken.in_(actions))
+    return query.order_by(_commands.c.created_at, _commands.c.id)
+
+
+def audit_log_export_query(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    event_types: Optional[List[str]] = None,
+    actor_user_id: Optional[UUID] = None
+) -> Select:
+    """
+    Audit log entries to export, oldest first.
+
+    Args:
+        since: Only entries created at or after this time
+        until: Only entries created before this time
+        event_types: Only entries of these event types
+        actor_user_id: Only entries caused by this user
+
+    Returns:
+        Core select of AUDIT_LOG_EXPORT_COLUMNS
+    """
+    query = select(*AUDIT_LOG_EXPORT_COLUMNS)
+    if since is not None:
+        query = query.where(_audit_logs.c.created_at >= since)
+    if until is not None:
+        query = query.where(_audit_logs.c.created_at < until)
+    if event_types:
+        query = query.where(_audit_logs.c.event_type.in_(event_types))
+    if actor_user_id is not None:
+        query = query.where(_audit_logs.c.actor_user_id == actor_user_id)
+    return query.order_by(_audit_logs.c.created_at, _audit_logs.c.id)
+
+
+def stream_export(engine: Engine, query: Select, fmt: str, compress: bool = False) -> Iterator[bytes]:
+    """
+    Encode a query's rows as they are fetched.
+
+    Rows are plain tuples read EXPORT_BATCH_SIZE at a time through a
+    server-side cursor on a connection of its own, and each batch is
+    encoded (and compressed) into one chunk, so memory does not grow with
+    the number of rows. The connection is held until the stream ends or
+    is closed.
+
+    Args:
+        engine: Engine to read from
+        query: Core select (from command_export_query or audit_log_export_query)
+        fmt: "ndjson" or "csv"
+        compress: Gzip the stream
+
+    Yields:
+        Chunks of the encoded export
+    """
+    columns = [column.name for column in query.selected_columns]
+    encode = _NdjsonEncoder(columns) if fmt == "ndjson" else _CsvEncoder(columns)
+    compressor = zlib.compressobj(wbits=31) if compress else None  # 31: gzip container
+
+    def emit(data: bytes) -> Optional[bytes]:
+        if compressor is not None:
+            data = compressor.compress(data)
+        return data or None
+
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE).execute(query)
+        if fmt == "csv":
+            chunk = emit(encode.header())
+            if chunk:
+                yield chunk
+        for rows in result.partitions():
+            chunk = emit(encode(rows))
+            if chunk:
+                yield chunk
+    if compressor is not None:
+        yield compressor.flush()
+
+
+class _NdjsonEncoder:
+    """One JSON object per row and line."""
+
+    def __init__(self, columns: Sequence[str]):
+        self.columns = columns
+
+    def __call__(self, rows: Iterable[Sequence[Any]]) -> bytes:
+        return "".join(
+            json.dumps(dict(zip(self.columns, row)), default=_json_value, separators=(",", ":")) + "\n"
+            for row in rows
+        ).encode()
+
+
+class _CsvEncoder:
+    """RFC 4180 rows; JSON columns are embedded as JSON text."""
+
+    def __init__(self, columns: Sequence[str]):
+        self.columns = columns
+
+    def header(self) -> bytes:
+        return self._encode([self.columns])
+
+    def __call__(self, rows: Iterable[Sequence[Any]]) -> bytes:
+        return self._encode([[_csv_value(value) for value in row] for row in rows])
+
+    @staticmethod
+    def _encode(rows: List[Sequence[Any]]) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+
+
+def _json_value(value: Any) -> Any:
+    """JSON form of the non-JSON values in exported rows."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return str(value)
+
+
+def _csv_value(value: Any) -> Any:
+    """CSV cell for an exported value."""
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(",", ":"))
+    if isinstance(value, (datetime, Enum, UUID)):
+        return _json_value(value)
+    return value
@@ -0,0 +1,300 @@
+"""Combined multi-pattern matcher for priority-ordered rules."""
+import re
+from typing import Callable, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from app.agent.aho_corasick import AhoCorasick
+from app.agent.regex_analysis import (
+    has_backreference, is_anchored_at_start, literal_form, needs_isolation, required_literals
+)
+
+# Evaluates a pattern that must not run inline; returns whether it matched
+IsolatedSearch = Callable[[re.Pattern, str], bool]
+
+# Unanchored patterns are merged in chunks of this size, so a hit only costs
+# one chunk scan per chunk plus individual searches inside the chunk that hit
+CHUNK_SIZE = 32
+
+
+def match_sequential(patterns: Sequence[re.Pattern], text: str) -> Optional[int]:
+    """
+    Reference first-match-wins evaluation: search each pattern in turn.
+
+    Args:
+        patterns: Compiled patterns in priority order
+        text: Text to match
+
+    Returns:
+        Index of the first matching pattern, or None
+    """
+    for index, pattern in enumerate(patterns):
+        if pattern.search(text):
+            return index
+    return None
+
+
+def _is_mergeable(pattern: re.Pattern) -> bool:
+    """
+    Check whether a pattern can be embedded in a combined alternation.
+
+    Named groups would clash across rules, backreferences would point at the
+    wrong group once renumbered, and global inline flags such as (?x) are
+    only legal at the very start of a pattern.
+    """
+    if pattern.groupindex or pattern.flags & (re.MULTILINE | re.VERBOSE | re.DOTALL | re.ASCII):
+        return False
+    try:
+        if has_backreference(pattern.pattern):
+            return False
+        re.compile(f"(?:{pattern.pattern})", re.IGNORECASE)
+    except re.error:
+        return False
+    return True
+
+
+class RuleMatcher:
+    """
+    Evaluate a priority-ordered list of patterns with as few scans as possible.
+
+    When the matcher is built, each pattern is filed under the cheapest check
+    that can decide it:
+
+    * anchored pure literals such as ^pwd$ go into a hash map keyed by the
+      lowercased command, and are answered without running the regex;
+    * unanchored pure literals such as mkfs\\. and patterns with required
+      literals such as git\\s+(status|log|diff) go into an Aho-Corasick
+      index. One pass over the command finds every literal present; pure
+      literals are then confirmed outright, the rest become candidates that
+      still get a full regex check;
+    * everything else is handled by a merged scanner (see _MergedScanner).
+
+    Literals are ASCII and compared case-insensitively, which is only exact
+    for ASCII commands; any other command is matched rule by rule.
+
+    Patterns that could backtrack catastrophically (see needs_isolation) are
+    never merged, and are evaluated through the isolated_search callback
+    passed to first_match when one is given.
+
+    Rules are only checked ahead of the best match found so far, so the
+    result is always identical to match_sequential, and a rule after the
+    winner is never searched (nor sent to the isolated evaluator).
+    """
+
+    def __init__(self, patterns: Sequence[re.Pattern]):
+        self.patterns = tuple(patterns)
+        self._isolated: FrozenSet[int] = frozenset(
+            index for index, pattern in enumerate(self.patterns) if needs_isolation(pattern.pattern)
+        )
+
+        self._exact: Dict[str, List[int]] = {}
+        # Anchored with $, which also matches just before a trailing newline
+        self._exact_newline: Dict[str, List[int]] = {}
+        literal_rules: Dict[str, List[Tuple[int, bool]]] = {}
+        unfiltered = []
+
+        for index, pattern in enumerate(self.patterns):
+            form = literal_form(pattern.pattern)
+            if form is not None and form.anchored_start:
+                self._exact.setdefault(form.text, []).append(index)
+                if form.anchored_end == "$":
+                    self._exact_newline.setdefault(form.text, []).append(index)
+                continue
+            if form is not None:
+                literal_rules.setdefault(form.text, []).append((index, True))
+                continue
+            literals = required_literals(pattern.pattern)
+            if literals:
+                for literal in literals:
+                    literal_rules.setdefault(literal, []).append((index, False))
+            else:
+                unfiltered.append(index)
+
+        self._index = AhoCorasick(literal_rules)
+        self._literal_rules = tuple(tuple(literal_rules[literal]) for literal in self._index.literals)
+        self._scanner = _MergedScanner(self.patterns, unfiltered, self._isolated)
+
+    def first_match(self, text: str, isolated_search: Optional[IsolatedSearch] = None,
+                    lowered: Optional[str] = None) -> Optional[int]:
+        """
+        Find the first pattern (in priority order) that matches the text.
+
+        Args:
+            text: Text to match
+            isolated_search: Evaluator for untrusted patterns (default: inline)
+            lowered: text.lower(), if the caller already has it
+
+        Returns:
+            Index of the first matching pattern, or None
+        """
+        check = self._checker(isolated_search)
+
+        if not text.isascii():
+            for index in range(len(self.patterns)):
+                if check(index, text):
+                    return index
+            return None
+
+        if lowered is None:
+            lowered = text.lower()
+        # position -> True if already known to match, False if it needs a regex check
+        candidates: Dict[int, bool] = {}
+        for index in self._exact.get(lowered, ()):
+            candidates[index] = True
+        if lowered.endswith("\n"):
+            for index in self._exact_newline.get(lowered[:-1], ()):
+                candidates[index] = True
+        for literal_id in self._index.find(lowered):
+            for index, confirmed in self._literal_rules[literal_id]:
+                candidates[index] = candidates.get(index, False) or confirmed
+
+        # A rule confirmed by its literal alone is the best answer so far;
+        # everything else is checked in priority order up to it, so no rule
+        # after the winner is ever searched
+        bound = min((index for index, confirmed in candidates.items() if confirmed), default=None)
+        unconfirmed = sorted(index for index, confirmed in candidates.items()
+                             if not confirmed and (bound is None or index < bound))
+        return self._scanner.first_match(text, check, bound, unconfirmed)
+
+    def is_isolated(self, index: int) -> bool:
+        """Whether the pattern at a position must not run inline."""
+        return index in self._isolated
+
+    def _checker(self, isolated_search: Optional[IsolatedSearch]):
+        """Build the per-pattern check used for one first_match call."""
+        patterns = self.patterns
+        isolated = self._isolated
+
+        def check(index: int, text: str) -> bool:
+            if isolated_search is not None and index in isolated:
+                return isolated_search(patterns[index], text)
+            return patterns[index].search(text) is not None
+
+        return check
+
+
+class _MergedScanner:
+    """
+    First-match evaluation over a subset of patterns using merged regexes.
+
+    The subset is split three ways:
+
+    * anchored patterns (every branch starts with ^ or \\A) are merged into a
+      single alternation tried at position 0. Alternatives are tried in order,
+      so the first alternative to succeed is the lowest-priority-number rule,
+      and a marker group after each alternative tells us which one it was;
+    * other mergeable patterns are merged into one group-free alternation,
+      which answers "does any of them match?" in a single scan. Only when it
+      does are the smaller per-chunk alternations consulted to find the rule;
+    * everything else, including isolated patterns, is checked individually.
+    """
+
+    def __init__(self, patterns: Sequence[re.Pattern], positions: Sequence[int], isolated: FrozenSet[int]):
+        self.patterns = patterns
+
+        anchored = []
+        unanchored = []
+        standalone = []
+        for index in positions:
+            pattern = self.patterns[index]
+            if index in isolated or not _is_mergeable(pattern):
+                standalone.append(index)
+            elif is_anchored_at_start(pattern.pattern):
+                anchored.append(index)
+            else:
+                unanchored.append(index)
+
+        self._anchored = None
+        self._marker_positions = {}
+        if anchored:
+            alternatives = "|".join(
+                f"(?:{self.patterns[index].pattern})(?P<_r{index}>)" for index in anchored
+            )
+            self._anchored = re.compile(f"(?:{alternatives})", re.IGNORECASE)
+            for index in anchored:
+                self._marker_positions[self._anchored.groupindex[f"_r{index}"]] = index
+
+        self._unanchored = None
+        if unanchored:
+            self._unanchored = _merge([self.patterns[index] for index in unanchored])
+
+        # Segments that may need checking beyond the anchored scan, in priority
+        # order: (positions, merged pattern or None for a standalone pattern)
+        segments = []
+        run = []
+        unanchored_set = set(unanchored)
+        for index in sorted(unanchored + standalone):
+            if index in unanchored_set:
+                run.append(index)
+                if len(run) == CHUNK_SIZE:
+                    segments.append(self._chunk(run))
+                    run = []
+            else:
+                if run:
+                    segments.append(self._chunk(run))
+                    run = []
+                segments.append(((index,), None))
+        if run:
+            segments.append(self._chunk(run))
+        self._segments = tuple(segments)
+
+    def _chunk(self, positions):
+        """Build a merged segment for a run of unanchored positions."""
+        return tuple(positions), _merge([self.patterns[index] for index in positions])
+
+    def first_match(self, text: str, check: Callable[[int, str], bool], bound: Optional[int] = None,
+                    candidates: Sequence[int] = ()) -> Optional[int]:
+        """
+        Find the first pattern of the subset that matches the text.
+
+        Args:
+            text: Text to match
+            check: Per-pattern check for patterns searched individually
+            bound: Index already known to match; nothing at or after it is checked
+            candidates: Sorted indices outside the subset to check with check,
+                interleaved in priority order
+
+        Returns:
+            Index (into the full pattern list) of the first match, or None
+        """
+        if self._anchored is not None:
+            m = self._anchored.match(text)
+            if m:
+                marker = self._marker_positions[m.lastindex]
+                bound = marker if bound is None else min(bound, marker)
+
+        pending = iter(candidates)
+        candidate = next(pending, None)
+
+        def before(limit: Optional[int]) -> Optional[int]:
+            """Check candidates ahead of limit (and of bound); return the first match."""
+            nonlocal candidate
+            while candidate is not None and (limit is None or candidate < limit) and \
+                    (bound is None or candidate < bound):
+                index, candidate = candidate, next(pending, None)
+                if check(index, text):
+                    return index
+            return None
+
+        any_unanchored = self._unanchored is not None and self._unanchored.search(text) is not None
+
+        for positions, merged in self._segments:
+            if bound is not None and positions[0] >= bound:
+                break
+            if merged is not None:
+                if not any_unanchored or not merged.search(text):
+                    continue
+            for index in positions:
+                if bound is not None and index >= bound:
+                    break
+                found = before(index)
+                if found is not None:
+                    return found
+                if check(index, text):
+                    return index
+
+        found = before(None)
+        return found if found is not None else bound
+
+
+def _merge(patterns: Sequence[re.Pattern]) -> re.Pattern:
+    """Merge mergeable patterns into a single group-free alternation."""
+    return re.compile("|".join(f"(?:{pattern.pattern})" for pattern in patterns), re.IGNORECASE)
@@ -0,0 +1,491 @@
+"""Structural analysis of rule regex patterns."""
+import re
+from typing import FrozenSet, List, NamedTuple, Optional, Tuple
+
+try:  # Python 3.11+
+    from re import _parser as sre_parse
+    from re import _compiler as sre_compile
+    from re import _constants as sre_constants
+except ImportError:  # pragma: no cover - older interpreters
+    import sre_parse
+    import sre_compile
+    import sre_constants
+
+_AT_START = (sre_constants.AT_BEGINNING, sre_constants.AT_BEGINNING_STRING)
+_AT_END = (sre_constants.AT_END, sre_constants.AT_END_STRING)
+_REPEATS = tuple(op for op in (
+    sre_constants.MAX_REPEAT,
+    sre_constants.MIN_REPEAT,
+    getattr(sre_constants, "POSSESSIVE_REPEAT", None),
+) if op is not None)
+
+
+# Characters tried when a character class needs a representative member
+_SAMPLE_CHARS = "a1 _-./:!#A"
+# Upper bound on sample strings kept per sub-pattern
+_MAX_SAMPLES = 12
+
+
+class RedosRisk(NamedTuple):
+    """A repeat that can match the same input in many ways, with an attack shape."""
+    kind: str
+    prefix: str
+    pump: str
+    suffix: str
+
+    def attack(self, n: int) -> str:
+        """Build the adversarial input with the pump repeated n times."""
+        return self.prefix + self.pump * n + self.suffix
+
+    def shape(self) -> str:
+        """Human-readable description of the adversarial input."""
+        return f"{self.prefix!r} + {self.pump!r} * n + {self.suffix!r}"
+
+
+class LiteralForm(NamedTuple):
+    """A pattern that is nothing but a (lowercase, ASCII) literal string."""
+    text: str
+    anchored_start: bool
+    # None: unanchored; "$": end or before a final newline; "\\Z": end only
+    anchored_end: Optional[str]
+
+
+def parse_pattern(pattern: str) -> List[Tuple]:
+    """
+    Parse a pattern into the regex module's internal opcode tree.
+
+    Args:
+        pattern: Regex pattern (must already compile)
+
+    Returns:
+        List of (opcode, argument) tuples for the top-level sequence
+    """
+    return list(sre_parse.parse(pattern, re.IGNORECASE))
+
+
+def find_redos_risks(pattern: str) -> List[RedosRisk]:
+    r"""
+    Find repeats that make a pattern prone to catastrophic backtracking.
+
+    Two shapes are reported:
+
+    * a variable-length repeat whose body can match some string both in one
+      iteration and in several, e.g. (a+)+ (nested quantifier) or (a|aa)+
+      (overlapping alternation): exponential in the input length;
+    * two adjacent variable-length repeats that can match the same string,
+      e.g. \d+\d+ : polynomial in the input length.
+
+    Each risk comes with an input shape (prefix + pump * n + suffix) that
+    exercises it, for probing with real timings.
+
+    Args:
+        pattern: Regex pattern (must already compile)
+
+    Returns:
+        List of risks found, outermost first
+    """
+    parsed = sre_parse.parse(pattern, re.IGNORECASE)
+    risks: List[RedosRisk] = []
+    _collect_risks(parsed.state, list(parsed), [], risks)
+    return risks
+
+
+def generate_samples(pattern: str, limit: int = 8) -> List[str]:
+    """
+    Generate a few non-empty strings the pattern matches.
+
+    Samples come from the parse tree: each alternative with minimum repeat
+    counts, the same wrapped in surrounding words (which tells anchored and
+    unanchored rules apart), then longer repeats. Only strings the pattern really
+    matches are returned; lookarounds or word boundaries can reject some.
+
+    Args:
+        pattern: Regex pattern (must already compile)
+        limit: Maximum number of samples
+
+    Returns:
+        Up to limit sample strings, shortest first
+    """
+    compiled = re.compile(pattern, re.IGNORECASE)
+    parsed = sre_parse.parse(pattern, re.IGNORECASE)
+    try:
+        minimal = sorted(_samples(parsed.state, list(parsed), minimal=True))
+        longer = sorted(_samples(parsed.state, list(parsed)) - set(minimal), key=lambda sample: (len(sample), sample))
+    except (re.error, RecursionError, TypeError):
+        return []
+
+    # Every alternative first, then the same in context, then longer repeats
+    candidates = minimal + [f"x {sample} x" for sample in minimal] + longer
+    samples = []
+    for sample in candidates:
+        if sample.strip() and sample not in samples and compiled.search(sample):
+            samples.append(sample)
+            if len(samples) == limit:
+                break
+    return samples
+
+
+def has_backreference(pattern: str) -> bool:
+    """
+    Check whether a pattern refers back to one of its own groups.
+
+    Backreferences and conditional groups use group numbers, so such a
+    pattern cannot be embedded in a larger pattern without changing meaning.
+
+    Args:
+        pattern: Regex pattern
+
+    Returns:
+        True if the pattern uses a backreference or group conditional
+    """
+    return _contains_op(parse_pattern(pattern), (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS))
+
+
+def needs_isolation(pattern: str) -> bool:
+    """
+    Check whether a pattern could backtrack badly enough to stall a request.
+
+    Nested quantifiers such as (a+)+ and backreferences can take exponential
+    time on hostile input, so such patterns are evaluated out of process.
+
+    Args:
+        pattern: Regex pattern
+
+    Returns:
+        True if the pattern should not run inline
+    """
+    items = parse_pattern(pattern)
+    return _has_nested_repeat(items, inside_repeat=False) or \
+        _contains_op(items, (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS)) or \
+        bool(find_redos_risks(pattern))
+
+
+def is_anchored_at_start(pattern: str) -> bool:
+    """
+    Check whether every match of a pattern must start at position 0.
+
+    Args:
+        pattern: Regex pattern (compiled without MULTILINE)
+
+    Returns:
+        True if the pattern is anchored with ^ or \\A on every branch
+    """
+    if re.compile(pattern).flags & re.MULTILINE:
+        return False
+    return _sequence_anchored(parse_pattern(pattern))
+
+
+def literal_form(pattern: str) -> Optional[LiteralForm]:
+    """
+    Describe a pattern that matches one fixed string, ignoring case.
+
+    Only the shapes the literal index can answer without running the regex
+    are recognised: a plain literal, or a literal anchored at both ends.
+
+    Args:
+        pattern: Regex pattern
+
+    Returns:
+        The literal form, or None if the pattern is not a pure literal
+    """
+    if re.compile(pattern).flags & re.MULTILINE:
+        return None
+    items = parse_pattern(pattern)
+    anchored_start = False
+    anchored_end = None
+    if items and items[0][0] is sre_constants.AT and items[0][1] in _AT_START:
+        anchored_start = True
+        items = items[1:]
+    if items and items[-1][0] is sre_constants.AT and items[-1][1] in _AT_END:
+        anchored_end = "$" if items[-1][1] is sre_constants.AT_END else "\\Z"
+        items = items[:-1]
+    if anchored_start != (anchored_end is not None):
+        return None
+    text = _literal_text(items)
+    if not text:
+        return None
+    return LiteralForm(text, anchored_start, anchored_end)
+
+
+def required_literals(pattern: str) -> Optional[FrozenSet[str]]:
+    """
+    Extract literals of which every match must contain at least one.
+
+    Literals are lowercase ASCII, so they are only meaningful when checked
+    against the lowercased form of an ASCII command.
+
+    Args:
+        pattern: Regex pattern
+
+    Returns:
+        Set of alternative literals, or None if no literal is required
+    """
+    return _best_factor(parse_pattern(pattern))
+
+
+def _literal_text(items) -> Optional[str]:
+    """Return the lowercase text of a sequence made only of ASCII literals."""
+    chars = []
+    for op, av in items:
+        if op is sre_constants.LITERAL and av < 128:
+            chars.append(chr(av).lower())
+        elif op is sre_constants.SUBPATTERN and not av[1] & re.VERBOSE and not av[2] & re.IGNORECASE:
+            # (?-i:...) is case-sensitive; the lowercased text would not describe it
+            inner = _literal_text(av[3])
+            if inner is None:
+                return None
+            chars.append(inner)
+        else:
+            return None
+    return "".join(chars)
+
+
+def _best_factor(items) -> Optional[FrozenSet[str]]:
+    """Pick the most selective required factor of a parsed sequence."""
+    best = None
+    for factor in _factors(items):
+        if best is None or _selectivity(factor) > _selectivity(best):
+            best = factor
+    return best
+
+
+def _selectivity(factor: FrozenSet[str]):
+    """Longer shortest-literal first, then fewer alternatives."""
+    return min(len(literal) for literal in factor), -len(factor)
+
+
+def _factors(items):
+    """Yield literal sets that every match of the sequence must contain."""
+    run = []
+    for op, av in items:
+        if op is sre_constants.LITERAL and av < 128:
+            run.append(chr(av).lower())
+            continue
+        if op is sre_constants.SUBPATTERN:
+            inner = _literal_text(av[3])
+            if inner:
+                run.append(inner)
+                continue
+        if run:
+            yield frozenset(["".join(run)])
+            run = []
+        factor = None
+        if op is sre_constants.SUBPATTERN:
+            factor = _best_factor(av[3])
+        elif op is sre_constants.BRANCH:
+            alternatives = [_best_factor(branch) for branch in av[1]]
+            if all(alternatives):
+                factor = frozenset().union(*alternatives)
+        elif op in _REPEATS and av[0] >= 1:
+            factor = _best_factor(av[2])
+        elif op is getattr(sre_constants, "ATOMIC_GROUP", None):
+            factor = _best_factor(av)
+        if factor:
+            yield factor
+    if run:
+        yield frozenset(["".join(run)])
+
+
+def _is_variable_repeat(op, av) -> bool:
+    """A repeat that can match a varying number of times, more than once."""
+    return op in _REPEATS and av[1] != av[0] and av[1] > 1
+
+
+def _collect_risks(state, items, preceding, risks: List[RedosRisk]):
+    """
+    Walk a parsed sequence, recording risky repeats and their attack shapes.
+
+    preceding holds the parsed items that come before this sequence; a sample
+    of them becomes the attack prefix, built only when a risk is found.
+    """
+    previous_repeat = None
+    for position, (op, av) in enumerate(items):
+        before = preceding + items[:position]
+        if _is_variable_repeat(op, av):
+            body = list(av[2])
+            pump = _ambiguous_sample(state, body, body, min_count=2)
+            if pump:
+                kind = "nested quantifier" if _contains_op(body, _REPEATS) else "overlapping alternation"
+                risks.append(RedosRisk(kind, _first_sample(state, before), pump, _failing_suffix(pump)))
+            elif previous_repeat is not None:
+                pump = _ambiguous_sample(state, previous_repeat, body, min_count=1)
+                if pump:
+                    risks.append(RedosRisk(
+                        "adjacent overlapping quantifiers", _first_sample(state, before), pump, _failing_suffix(pump)
+                    ))
+            _collect_risks(state, body, before, risks)
+            previous_repeat = body
+        else:
+            for child in _children(op, av):
+                _collect_risks(state, list(child), before, risks)
+            if op is not sre_constants.AT:
+                previous_repeat = None
+
+
+def _ambiguous_sample(state, repeated, body, min_count: int) -> Optional[str]:
+    """
+    Find a non-empty string matched by body that (repeated){min_count,} also matches.
+
+    With repeated == body and min_count=2, such a string can be split across
+    iterations in more than one way; with two adjacent repeats and
+    min_count=1, it can be split between them. Either way the engine has many
+    equivalent paths to backtrack through.
+    """
+    if min_count > 1:
+        low, high = _sub(state, body).getwidth()
+        if low and high < min_count * low:
+            # Too narrow for one match to hold several non-empty iterations
+            return None
+    try:
+        several = _compile(state, [
+            (sre_constants.MAX_REPEAT, (min_count, sre_constants.MAXREPEAT, _sub(state, repeated)))
+        ])
+    except (re.error, RecursionError, TypeError):
+        return None
+    for sample in sorted(_samples(state, body), key=len):
+        if sample and several.fullmatch(sample):
+            return sample
+    return None
+
+
+def _failing_suffix(pump: str) -> str:
+    """A trailing character unlikely to let the overall match succeed."""
+    for char in "!#\x00":
+        if char not in pump:
+            return char
+    return "!"
+
+
+def _first_sample(state, items) -> str:
+    """Shortest sample string for a sequence, using minimum repeat counts."""
+    samples = _samples(state, items, minimal=True)
+    return min(samples, key=len) if samples else ""
+
+
+def _samples(state, items, minimal: bool = False) -> set:
+    """
+    Generate a few strings a parsed sequence can match.
+
+    Repeats contribute their minimum count and one more; branches contribute
+    each alternative. With minimal=True only minimum counts are used.
+    """
+    results = {""}
+    for op, av in items:
+        options = _item_samples(state, op, av, minimal)
+        if not options:
+            return set()
+        results = {head + tail for head in results for tail in options}
+        if len(results) > _MAX_SAMPLES:
+            results = set(sorted(results, key=len)[:_MAX_SAMPLES])
+    return results
+
+
+def _item_samples(state, op, av, minimal: bool) -> set:
+    """Sample strings for a single parsed item."""
+    if op is sre_constants.LITERAL:
+        return {chr(av)}
+    if op is sre_constants.ANY:
+        return {"a"}
+    if op in (sre_constants.NOT_LITERAL, sre_constants.IN):
+        member = _class_member(state, op, av)
+        return {member} if member is not None else set()
+    if op in _REPEATS:
+        body = _samples(state, av[2], minimal)
+        counts = {av[0]} if minimal else {av[0], min(av[0] + 1, av[1])}
+        return {sample * count for sample in body for count in counts}
+    if op is sre_constants.SUBPATTERN:
+        return _samples(state, av[3], minimal)
+    if op is sre_constants.BRANCH:
+        options = set()
+        for branch in av[1]:
+            options |= _samples(state, branch, minimal)
+        return options
+    if op is getattr(sre_constants, "ATOMIC_GROUP", None):
+        return _samples(state, av, minimal)
+    # Zero-width assertions, backreferences and the like
+    return {""}
+
+
+def _class_member(state, op, av) -> Optional[str]:
+    """Pick a character matched by a character class or negated literal."""
+    try:
+        compiled = _compile(state, [(op, av)])
+    except (re.error, TypeError):
+        return None
+    for char in _SAMPLE_CHARS:
+        if compiled.fullmatch(char):
+            return char
+    return None
+
+
+def _sub(state, items):
+    """Wrap a list of parsed items back into a SubPattern."""
+    return sre_parse.SubPattern(state, list(items))
+
+
+def _compile(state, items) -> re.Pattern:
+    """Compile a parsed fragment (case-insensitive, like the rules themselves)."""
+    return sre_compile.compile(_sub(state, items), re.IGNORECASE)
+
+
+def _sequence_anchored(items) -> bool:
+    """Check whether a parsed sequence begins with a start-of-string anchor."""
+    for op, av in items:
+        if op is sre_constants.AT:
+            if av in _AT_START:
+                return True
+            continue  # other zero-width assertions don't move the start
+        if op is sre_constants.SUBPATTERN:
+            add_flags = av[1]
+            if add_flags & re.MULTILINE:
+                return False
+            return _sequence_anchored(av[3])
+        if op is sre_constants.BRANCH:
+            return all(_sequence_anchored(branch) for branch in av[1])
+        return False
+    return False
+
+
+def _has_nested_repeat(items, inside_repeat: bool) -> bool:
+    """Check for a variable-length repeat nested inside another one."""
+    for op, av in items:
+        if op in _REPEATS and av[1] != av[0]:
+            if inside_repeat:
+                return True
+            if _has_nested_repeat(av[2], inside_repeat=True):
+                return True
+            continue
+        for child in _children(op, av):
+            if _has_nested_repeat(child, inside_repeat):
+                return True
+    return False
+
+
+def _contains_op(items, ops) -> bool:
+    """Recursively check a parsed sequence for any of the given opcodes."""
+    for op, av in items:
+        if op in ops:
+            return True
+        for child in _children(op, av):
+            if _contains_op(child, ops):
+                return True
+    return False
+
+
+def _children(op, av):
+    """Yield the nested sequences of a parsed opcode."""
+    if op is sre_constants.SUBPATTERN:
+        yield av[3]
+    elif op is sre_constants.BRANCH:
+        yield from av[1]
+    elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) or \
+            op is getattr(sre_constants, "POSSESSIVE_REPEAT", None):
+        yield av[2]
+    elif op is getattr(sre_constants, "ATOMIC_GROUP", None):
+        yield av
+    elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        yield av[1]
+    elif op is sre_constants.GROUPREF_EXISTS:
+        yield av[1]
+        if av[2] is not None:
+            yield av[2]
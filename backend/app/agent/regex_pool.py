@@ -0,0 +1,170 @@
+"""Pool of worker processes for evaluating untrusted regex patterns."""
+import multiprocessing
+import queue
+import re
+import threading
+import time
+from typing import Optional, Tuple
+
+
+def _worker_main(conn):
+    """
+    Worker loop: receive (pattern, text) and reply with whether it matched
+    and the seconds the search took.
+    """
+    while True:
+        try:
+            pattern, text = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            compiled = re.compile(pattern, re.IGNORECASE)
+        except re.error:
+            conn.send((False, 0.0))
+            continue
+        start = time.perf_counter()
+        matched = compiled.search(text) is not None
+        conn.send((matched, time.perf_counter() - start))
+
+
+def _start_method() -> str:
+    """Prefer forkserver: cheap to start and safe in a multi-threaded server."""
+    methods = multiprocessing.get_all_start_methods()
+    return "forkserver" if "forkserver" in methods else "spawn"
+
+
+class _Worker:
+    """One worker process and the parent end of its pipe."""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        """Terminate the worker, whatever it is doing."""
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class RegexWorkerPool:
+    """
+    Evaluate regex searches in pre-started worker processes with a deadline.
+
+    A search that overruns its deadline is abandoned: the worker running it
+    is killed and a replacement is started in the background, so one
+    catastrophic pattern can only ever cost the caller its time budget.
+    Unlike SIGALRM this works from any thread. The deadline starts once a
+    worker has the request; waiting for a free worker is bounded separately.
+    """
+
+    def __init__(self, size: int = 2):
+        self.size = size
+        self._context = multiprocessing.get_context(_start_method())
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        """Start the worker processes (idempotent)."""
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.size):
+                self._idle.put(_Worker(self._context))
+            self._started = True
+
+    def shutdown(self):
+        """Kill all idle workers; busy ones are killed when they return."""
+        with self._lock:
+            self._started = False
+            while True:
+                try:
+                    self._idle.get_nowait().kill()
+                except queue.Empty:
+                    break
+
+    def search(self, pattern: str, text: str, timeout: float, wait: Optional[float] = None) -> Optional[bool]:
+        """
+        Search text for a pattern (case-insensitive) in a worker process.
+
+        Args:
+            pattern: Regex pattern
+            text: Text to search
+            timeout: Seconds the search may take once a worker has it
+            wait: Seconds to wait for a free worker (default: timeout)
+
+        Returns:
+            Whether the pattern matched, or None if either limit passed
+        """
+        reply = self.search_timed(pattern, text, timeout, wait)
+        return reply[0] if reply is not None else None
+
+    def time_search(self, pattern: str, text: str, timeout: float, wait: Optional[float] = None) -> Optional[float]:
+        """
+        Measure how long a search takes, timed inside the worker process.
+
+        Args:
+            pattern: Regex pattern
+            text: Text to search
+            timeout: Seconds the search may take once a worker has it
+            wait: Seconds to wait for a free worker (default: timeout)
+
+        Returns:
+            Seconds spent in the search, or None if either limit passed
+        """
+        reply = self.search_timed(pattern, text, timeout, wait)
+        return reply[1] if reply is not None else None
+
+    def search_timed(self, pattern: str, text: str, timeout: float,
+                     wait: Optional[float] = None) -> Optional[Tuple[bool, float]]:
+        """
+        Search text for a pattern and time the search inside the worker.
+
+        Args:
+            pattern: Regex pattern
+            text: Text to search
+            timeout: Seconds the search may take once a worker has it
+            wait: Seconds to wait for a free worker (default: timeout)
+
+        Returns:
+            Tuple of (matched, seconds spent in the search), or None if
+            no worker became free in time or the search overran timeout
+        """
+        self.start()
+        try:
+            worker = self._idle.get(timeout=max(timeout if wait is None else wait, 0))
+        except queue.Empty:
+            return None
+
+        try:
+            deadline = time.monotonic() + timeout
+            worker.conn.send((pattern, text))
+            remaining = deadline - time.monotonic()
+            if remaining > 0 and worker.conn.poll(remaining):
+                reply = worker.conn.recv()
+                self._release(worker)
+                return reply
+        except (EOFError, OSError):
+            pass
+
+        self._replace(worker)
+        return None
+
+    def _release(self, worker: _Worker):
+        """Return a healthy worker to the pool, unless the pool was shut down."""
+        if self._started:
+            self._idle.put(worker)
+        else:
+            worker.kill()
+
+    def _replace(self, worker: _Worker):
+        """Kill a stuck worker and start a fresh one off the request path."""
+        def restart():
+            worker.kill()
+            if self._started:
+                self._idle.put(_Worker(self._context))
+
+        threading.Thread(target=restart, daemon=True).start()
@@ -0,0 +1,123 @@
+"""Find rules that never decide a command under first-match-wins."""
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from app.agent.regex_analysis import generate_samples
+from app.agent.rule_engine import CompiledRuleSet, evaluate_rule_set, get_rule_set, search_rule
+from app.agent.rule_simulation import recent_command_texts
+
+# Rule never decided anything and its own samples are all decided by earlier rules
+SHADOWED = "shadowed"
+# Rule never decided anything and no sample could be generated for it
+DEAD = "dead"
+# Rule decides some commands, but the next matching rule would take the same action
+REDUNDANT = "redundant"
+ACTIVE = "active"
+
+
+def analyze_rules(db: Session, history_limit: int = 10000, samples_per_rule: int = 8) -> Dict[str, Any]:
+    """
+    Classify every rule by whether it can be the first match.
+
+    The corpus is the distinct text of recent commands plus samples generated
+    from every rule's pattern. Each corpus text is run through the live rule
+    set to find the rule that decides it, and the rule that would decide it
+    if that one were removed. From that:
+
+    * shadowed: the rule decides no corpus text, and every string generated
+      from its own pattern is decided by an earlier rule (shadowed_by);
+    * dead: the rule decides no corpus text and no sample could be generated;
+    * redundant: the rule decides some texts, but removing it would leave
+      every one of them to a rule with the same action (replaced_by);
+    * active: anything else.
+
+    Each verdict assumes only that rule is removed. Generated samples are
+    evidence, not proof, so verdicts are only as good as the corpus.
+
+    Args:
+        db: Database session
+        history_limit: Number of most recent commands to include
+        samples_per_rule: Samples generated per pattern
+
+    Returns:
+        Dict with history_commands, generated_samples, rules (in priority
+        order) and removable (ids of rules that are not active)
+    """
+    rule_set = get_rule_set(db)
+    rules = rule_set.rules
+    positions = {rule.id: index for index, rule in enumerate(rules)}
+
+    history: Set[str] = set()
+    for batch in recent_command_texts(db, history_limit):
+        history.update(batch)
+    samples = [generate_samples(rule.pattern.pattern, samples_per_rule) for rule in rules]
+    generated = {sample for rule_samples in samples for sample in rule_samples}
+
+    winners: Dict[str, Optional[int]] = {}
+    first_matches: Counter = Counter()
+    history_first_matches: Counter = Counter()
+    # rule position -> positions of the rules that would decide its texts instead (None: no rule)
+    takeovers: Dict[int, Set[Optional[int]]] = defaultdict(set)
+
+    for text in history | generated:
+        matched, _ = evaluate_rule_set(rule_set, text)
+        winner = winners[text] = positions[matched.id] if matched is not None else None
+        if winner is None:
+            continue
+        first_matches[winner] += 1
+        if text in history:
+            history_first_matches[winner] += 1
+        takeovers[winner].add(_next_match(rule_set, winner, text))
+
+    entries = []
+    for index, rule in enumerate(rules):
+        shadowed_by: List[Any] = []
+        replaced_by: List[Any] = []
+        if first_matches[index] == 0:
+            if samples[index]:
+                status = SHADOWED
+                shadowed_by = _rule_ids(rules, {winners[sample] for sample in samples[index]})
+            else:
+                status = DEAD
+        elif None not in takeovers[index] and all(
+            rules[other].action == rule.action for other in takeovers[index]
+        ):
+            status = REDUNDANT
+            replaced_by = _rule_ids(rules, takeovers[index])
+        else:
+            status = ACTIVE
+
+        entries.append({
+            "rule_id": rule.id,
+            "priority": rule.priority,
+            "pattern": rule.pattern.pattern,
+            "action": rule.action.value,
+            "status": status,
+            "first_matches": first_matches[index],
+            "history_first_matches": history_first_matches[index],
+            "samples": len(samples[index]),
+            "shadowed_by": shadowed_by,
+            "replaced_by": replaced_by,
+        })
+
+    return {
+        "history_commands": len(history),
+        "generated_samples": len(generated),
+        "rules": entries,
+        "removable": [entry["rule_id"] for entry in entries if entry["status"] != ACTIVE],
+    }
+
+
+def _next_match(rule_set: CompiledRuleSet, after: int, text: str) -> Optional[int]:
+    """Position of the first rule after the given one that matches the text."""
+    for index in range(after + 1, len(rule_set.rules)):
+        if search_rule(rule_set, index, text):
+            return index
+    return None
+
+
+def _rule_ids(rules, indexes) -> List[Any]:
+    """Rule ids for a set of positions, in priority order."""
+    return [rules[index].id for index in sorted(index for index in indexes if index is not None)]
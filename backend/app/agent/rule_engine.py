@@ -1,88 +1,689 @@
 """Rule matching engine."""
+import asyncio
+import os
 import re
-import signal
-from typing import Optional
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Hashable, Iterable, List, NamedTuple, Optional, Tuple
+from uuid import UUID
+from sqlalchemy import select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.models import Rule, RuleAction
+from app.models import Rule, RuleAction, RuleSetVersion
+from app.agent.command_parser import ParsedCommand
+from app.agent.matcher import RuleMatcher
+from app.agent.regex_analysis import RedosRisk, find_redos_risks, needs_isolation
+from app.agent.regex_pool import RegexWorkerPool
+from app.agent.rule_stats import RuleStatsRecorder
 
+# "pool": untrusted patterns run in worker processes under a time budget
+# "inline": everything runs in the request thread (no timeout protection)
+REGEX_EVAL_MODE = os.getenv("REGEX_EVAL_MODE", "pool")
+REGEX_POOL_SIZE = int(os.getenv("REGEX_POOL_SIZE", "2"))
+# Seconds a single match_rule call may spend searching untrusted patterns in total
+RULE_MATCH_TIME_BUDGET = float(os.getenv("RULE_MATCH_TIME_BUDGET", "1.0"))
+# Seconds each untrusted search may wait for a free pool worker (not part of the budget)
+RULE_MATCH_QUEUE_TIMEOUT = float(os.getenv("RULE_MATCH_QUEUE_TIMEOUT", "5.0"))
+# Number of (rule-set version, command text) decisions to remember; 0 disables
+RULE_DECISION_CACHE_SIZE = int(os.getenv("RULE_DECISION_CACHE_SIZE", "4096"))
+# Postgres NOTIFY channel announcing new rule-set versions
+RULE_SET_CHANNEL = "rule_set_changed"
+# Seconds validate_regex_pattern may spend timing adversarial inputs
+REDOS_PROBE_BUDGET = float(os.getenv("REDOS_PROBE_BUDGET", "2.0"))
+# Longest adversarial input tried when probing a pattern
+REDOS_PROBE_MAX_LENGTH = int(os.getenv("REDOS_PROBE_MAX_LENGTH", "4096"))
 
-class RegexTimeoutError(Exception):
-    """Raised when regex matching times out."""
-    pass
+# Probes faster than this are treated as noise when comparing timings
+_PROBE_NOISE_FLOOR = 0.001
+# Doubling the input must not multiply the time by this much or more
+_PROBE_GROWTH_LIMIT = 3.0
+# Extra seconds allowed per probe for the round-trip to the worker
+_PROBE_SLACK = 0.25
 
+regex_pool = RegexWorkerPool(REGEX_POOL_SIZE)
 
-def _timeout_handler(signum, frame):
-    """Signal handler for regex timeout."""
-    raise RegexTimeoutError("Regex matching timed out")
 
+class CompiledRule(NamedTuple):
+    """Immutable, pre-compiled view of a Rule row."""
+    id: UUID
+    priority: int
+    action: RuleAction
+    pattern: re.Pattern
 
-def match_rule(command_text: str, db: Session) -> Optional[Rule]:
+
+# Decision for a command whose matching ran out of time: a rule that might
+# have matched was never decided, so no later rule can be trusted and the
+# command is rejected (AUTO_REJECT, with no rule of its own)
+MATCH_TIMED_OUT = CompiledRule(None, -1, RuleAction.AUTO_REJECT, None)
+
+
+class CompiledRuleSet(NamedTuple):
+    """Priority-sorted snapshot of all rules, stamped with the version it was built for."""
+    version: int
+    rules: Tuple[CompiledRule, ...]
+    matcher: RuleMatcher
+
+
+class DecisionCache:
+    """Thread-safe bounded LRU map with hit/miss/eviction counters."""
+
+    MISSING = object()
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Any:
+        """Return the cached value, or DecisionCache.MISSING."""
+        with self._lock:
+            value = self._entries.get(key, self.MISSING)
+            if value is self.MISSING:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        """Store a value, evicting the least recently used entry if full."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry (counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Snapshot of the cache counters."""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Process-wide compiled rule set. Readers grab the current snapshot without
+# locking; rebuilds query without the lock and swap the reference under it.
+_rule_set: Optional[CompiledRuleSet] = None
+# Newest published rule-set version this process knows about
+_rule_set_version = 0
+# Bumped by invalidate_rule_set, so a rebuild that started before it is dropped
+_rule_set_generation = 0
+_rule_set_lock = threading.Lock()
+# Rebuild in progress on the event loop, awaited by concurrent async lookups
+_rule_set_reload: Optional[asyncio.Future] = None
+
+# Memoized match_rule results keyed by (rule-set version, command text)
+decision_cache = DecisionCache(RULE_DECISION_CACHE_SIZE)
+
+# Per-rule decision counters, flushed to the rule_stats table
+rule_stats = RuleStatsRecorder()
+
+
+class _MatchTimedOut(Exception):
+    """Raised out of a first_match call when an untrusted pattern could not be decided."""
+
+
+class _IsolatedSearch:
+    """
+    Pool-backed search for untrusted patterns, sharing one time budget.
+
+    Only time spent searching counts against the budget; waiting for a
+    free worker is bounded by RULE_MATCH_QUEUE_TIMEOUT instead, so a busy
+    pool does not use up the budget of the commands queued behind it.
     """
-    Match command text against rules, returning the first matching rule by priority.
-    
+
+    def __init__(self, budget: float, wait: float):
+        self.remaining = budget
+        self.wait = wait
+
+    def __call__(self, pattern: re.Pattern, text: str) -> bool:
+        reply = regex_pool.search_timed(pattern.pattern, text, self.remaining, self.wait) if self.remaining > 0 else None
+        if reply is None:
+            # Undecided: stop here rather than fall through to lower-priority rules
+            raise _MatchTimedOut()
+        matched, elapsed = reply
+        self.remaining -= elapsed
+        return matched
+
+
+def compile_rules(rules: Iterable[Rule], version: int = 0) -> CompiledRuleSet:
+    """
+    Compile rules into an immutable, priority-sorted rule set.
+
+    Rules whose pattern does not compile are skipped, mirroring how
+    match_rule has always ignored invalid patterns.
+
     Args:
-        command_text: The command text to match
-        db: Database session
-        
+        rules: Rule rows (or any objects with id, priority, action, pattern)
+        version: Rule-set version the snapshot is built for
+
     Returns:
-        The first matching Rule by priority, or None if no match
+        The compiled rule set
     """
-    # Load rules ordered by priority (ascending - lower number = higher priority)
-    rules = db.query(Rule).order_by(Rule.priority.asc()).all()
-    
-    for rule in rules:
+    compiled = []
+    for rule in sorted(rules, key=lambda r: r.priority):
         try:
-            # Set timeout for regex matching (5 seconds)
-            if hasattr(signal, 'SIGALRM'):  # Unix only
-                signal.signal(signal.SIGALRM, _timeout_handler)
-                signal.alarm(5)
-            
-            try:
-                # Compile and match pattern (case-insensitive)
-                pattern = re.compile(rule.pattern, re.IGNORECASE)
-                if pattern.search(command_text):
-                    return rule
-            finally:
-                if hasattr(signal, 'SIGALRM'):
-                    signal.alarm(0)  # Cancel alarm
-        except RegexTimeoutError:
-            # Skip this rule if it times out
-            continue
+            pattern = re.compile(rule.pattern, re.IGNORECASE)
         except re.error:
-            # Skip invalid regex patterns
             continue
-    
-    return None
+        compiled.append(CompiledRule(rule.id, rule.priority, rule.action, pattern))
+    matcher = RuleMatcher([rule.pattern for rule in compiled])
+    return CompiledRuleSet(version, tuple(compiled), matcher)
+
+
+def get_rule_set(db: Session) -> CompiledRuleSet:
+    """
+    Return the current compiled rule set, rebuilding it from the database
+    only if a newer rule-set version has been published since it was built.
+
+    The newest version is learned from this process's own rule changes and
+    from the rule-set watcher (see app.agent.rule_sync), so the common case
+    is a comparison of two integers and no query.
+
+    Args:
+        db: Database session (used only on rebuild)
+
+    Returns:
+        The current compiled rule set
+    """
+    rule_set = _rule_set
+    if rule_set is not None and rule_set.version >= _rule_set_version:
+        return rule_set
+    return load_rule_set(db)
+
+
+def load_rule_set(db: Session) -> CompiledRuleSet:
+    """
+    Rebuild the compiled rule set from the database and swap it in.
+
+    The queries and compilation run without holding the rule-set lock; only
+    the swap is locked, and it never replaces a newer snapshot.
+
+    Args:
+        db: Database session
+
+    Returns:
+        The freshly built rule set (or a newer one built meanwhile)
+    """
+    return _install_rule_set(*_read_rules(db))
+
+
+def _read_rules(db: Session) -> Tuple[int, int, List[Any]]:
+    """Read the version stamp and the rules, as (generation, version, rule rows)."""
+    generation = _rule_set_generation
+    # Read the stamp before the rules: the rules are then at least that new
+    version = read_rule_set_version(db)
+    rules = db.execute(
+        select(Rule.id, Rule.priority, Rule.action, Rule.pattern).order_by(Rule.priority.asc())
+    ).all()
+    return generation, version, rules
+
+
+def _install_rule_set(generation: int, version: int, rules: List[Any]) -> CompiledRuleSet:
+    """Compile rules read by _read_rules and swap them in unless something newer is there."""
+    global _rule_set, _rule_set_version
+    rule_set = compile_rules(rules, version)
+    with _rule_set_lock:
+        if generation != _rule_set_generation:
+            # Invalidated while we read: these rules may be the dropped ones
+            return rule_set
+        if _rule_set is None or _rule_set.version <= version:
+            if _rule_set is not None and _rule_set.version < version:
+                decision_cache.clear()
+            _rule_set = rule_set
+        _rule_set_version = max(_rule_set_version, version)
+        return _rule_set
+
+
+async def get_rule_set_async(db: AsyncSession) -> CompiledRuleSet:
+    """
+    Async get_rule_set that never compiles on the event loop.
+
+    A stale rule set is rebuilt once per event loop: the rules are read on
+    the request's session and compiled in a thread. While that rebuild is
+    in flight, other lookups keep getting the current snapshot (and only
+    wait when there is none yet).
+
+    Args:
+        db: Async database session (used only on rebuild)
+
+    Returns:
+        The current compiled rule set
+    """
+    global _rule_set_reload
+    rule_set = _rule_set
+    if rule_set is not None and rule_set.version >= _rule_set_version:
+        return rule_set
+
+    loop = asyncio.get_running_loop()
+    reload = _rule_set_reload
+    if reload is not None and not reload.done() and reload.get_loop() is loop:
+        if rule_set is not None:
+            return rule_set
+        rule_set = await asyncio.shield(reload)
+        if rule_set is not None:
+            return rule_set
+        # That rebuild failed; try our own
+
+    reload = _rule_set_reload = loop.create_future()
+    rule_set = None
+    try:
+        generation, version, rules = await db.run_sync(_read_rules)
+        rule_set = await asyncio.to_thread(_install_rule_set, generation, version, rules)
+        return rule_set
+    finally:
+        reload.set_result(rule_set)
+        if _rule_set_reload is reload:
+            _rule_set_reload = None
+
+
+def invalidate_rule_set():
+    """
+    Drop the compiled rule set so the next lookup rebuilds it from the database.
+
+    Used after changing rules without publishing a new version (e.g. when
+    the rules table is seeded directly).
+    """
+    global _rule_set, _rule_set_version, _rule_set_generation
+    with _rule_set_lock:
+        _rule_set = None
+        _rule_set_version = 0
+        _rule_set_generation += 1
+        decision_cache.clear()
+
+
+def note_rule_set_version(version: int) -> bool:
+    """
+    Record that a rule-set version has been published (by any process).
+
+    Args:
+        version: Published rule-set version
+
+    Returns:
+        True if it is newer than the compiled rule set, which will then be
+        rebuilt on the next lookup
+    """
+    global _rule_set_version
+    with _rule_set_lock:
+        if version <= _rule_set_version:
+            return False
+        _rule_set_version = version
+        decision_cache.clear()
+        return True
+
+
+def known_rule_set_version() -> int:
+    """The newest rule-set version this process knows about."""
+    return _rule_set_version
+
+
+def refresh_rule_set(db: Session) -> CompiledRuleSet:
+    """
+    Rebuild the compiled rule set immediately.
+
+    Called by the admin rule endpoints after committing a change (and its
+    publish_rule_set_version) so the next command submission in this
+    process does not pay for the rebuild. Other processes pick the change
+    up through their rule-set watcher.
+
+    Args:
+        db: Database session
+
+    Returns:
+        The freshly built rule set
+    """
+    invalidate_rule_set()
+    return load_rule_set(db)
+
+
+def read_rule_set_version(db: Session) -> int:
+    """
+    Read the published rule-set version stamp.
+
+    Args:
+        db: Database session
+
+    Returns:
+        The current version (0 if none has been published yet)
+    """
+    return db.query(RuleSetVersion.version).filter(RuleSetVersion.id == 1).scalar() or 0
+
+
+def publish_rule_set_version(db: Session) -> int:
+    """
+    Bump the rule-set version stamp as part of the caller's transaction.
+
+    Call before committing any change to the rules table. On Postgres a
+    notification is also queued on RULE_SET_CHANNEL; like the bump itself
+    it is only delivered if the transaction commits.
+
+    Args:
+        db: Database session
+
+    Returns:
+        The new version
+    """
+    stamps = RuleSetVersion.__table__
+    version = db.execute(
+        update(stamps)
+        .where(stamps.c.id == 1)
+        .values(version=stamps.c.version + 1, updated_at=datetime.utcnow())
+        .returning(stamps.c.version)
+    ).scalar()
+    if version is None:
+        version = 1
+        db.add(RuleSetVersion(id=1, version=version, updated_at=datetime.utcnow()))
+        db.flush()
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": RULE_SET_CHANNEL, "payload": str(version)})
+    return version
+
+
+def match_rule(command: ParsedCommand, db: Session) -> Optional[CompiledRule]:
+    """
+    Match a command against rules, returning the first matching rule by priority.
+
+    Decisions are memoized per rule-set version, so repeated commands skip
+    evaluation entirely until a rule changes.
+
+    Args:
+        command: The parsed command to match
+        db: Database session (only touched when the rule set must be rebuilt)
+
+    Returns:
+        The first matching CompiledRule by priority, None if no match, or
+        MATCH_TIMED_OUT if an untrusted pattern could not be searched in time
+    """
+    return _match_in(get_rule_set(db), command)
+
+
+def match_rules(commands: List[ParsedCommand], db: Session) -> List[Optional[CompiledRule]]:
+    """
+    Match a batch of commands against one snapshot of the rule set.
+
+    Every command sees the same rules even if they change mid-batch, and
+    repeats within the batch are answered by the decision cache.
+
+    Args:
+        commands: The parsed commands to match
+        db: Database session (only touched when the rule set must be rebuilt)
+
+    Returns:
+        The first matching CompiledRule (None, or MATCH_TIMED_OUT) for each
+        command, in order
+    """
+    rule_set = get_rule_set(db)
+    return [_match_in(rule_set, command) for command in commands]
+
+
+async def match_rule_async(command: ParsedCommand, db: AsyncSession) -> Optional[CompiledRule]:
+    """
+    match_rule for async callers: only cached decisions are answered on the event loop.
+
+    Evaluating the rules (and waiting on the regex worker pool) runs in a
+    thread, so a slow pattern never stalls other requests.
+
+    Args:
+        command: The parsed command to match
+        db: Async database session (only touched when the rule set must be rebuilt)
+
+    Returns:
+        The first matching CompiledRule by priority, None if no match, or
+        MATCH_TIMED_OUT if an untrusted pattern could not be searched in time
+    """
+    rule_set = await get_rule_set_async(db)
+    cached = _cached_decision(rule_set, command)
+    if cached is not DecisionCache.MISSING:
+        return cached
+    return await asyncio.to_thread(_evaluate_in, rule_set, command)
+
+
+async def match_rules_async(commands: List[ParsedCommand], db: AsyncSession) -> List[Optional[CompiledRule]]:
+    """
+    match_rules for async callers: commands not in the decision cache are
+    evaluated together in one thread.
+
+    Args:
+        commands: The parsed commands to match
+        db: Async database session (only touched when the rule set must be rebuilt)
+
+    Returns:
+        The first matching CompiledRule (None, or MATCH_TIMED_OUT) for each
+        command, in order
+    """
+    rule_set = await get_rule_set_async(db)
+    decisions = [_cached_decision(rule_set, command) for command in commands]
+    missing = [i for i, decision in enumerate(decisions) if decision is DecisionCache.MISSING]
+    if missing:
+        evaluated = await asyncio.to_thread(_evaluate_all, rule_set, [commands[i] for i in missing])
+        for i, decision in zip(missing, evaluated):
+            decisions[i] = decision
+    return decisions
+
+
+def _match_in(rule_set: CompiledRuleSet, command: ParsedCommand) -> Optional[CompiledRule]:
+    """Match one command against a given rule set, through the decision cache."""
+    cached = _cached_decision(rule_set, command)
+    if cached is not DecisionCache.MISSING:
+        return cached
+    return _evaluate_in(rule_set, command)
+
+
+def _cached_decision(rule_set: CompiledRuleSet, command: ParsedCommand) -> Any:
+    """A remembered decision for the command (counted in the rule stats), or DecisionCache.MISSING."""
+    cached = decision_cache.get((rule_set.version, command.text))
+    if cached is not DecisionCache.MISSING:
+        rule_stats.record(rule_set, cached, command.text, evaluated=False)
+    return cached
+
+
+def _evaluate_all(rule_set: CompiledRuleSet, commands: List[ParsedCommand]) -> List[Optional[CompiledRule]]:
+    """Evaluate commands against a given rule set, once per distinct text."""
+    decided: Dict[str, Optional[CompiledRule]] = {}
+    decisions = []
+    for command in commands:
+        if command.text in decided:
+            rule_stats.record(rule_set, decided[command.text], command.text, evaluated=False)
+        else:
+            decided[command.text] = _evaluate_in(rule_set, command)
+        decisions.append(decided[command.text])
+    return decisions
+
+
+def _evaluate_in(rule_set: CompiledRuleSet, command: ParsedCommand) -> Optional[CompiledRule]:
+    """Evaluate one command against a given rule set and remember the decision."""
+    matched, timed_out = evaluate_rule_set(rule_set, command.text, command.lower)
+    rule_stats.record(rule_set, matched, command.text, evaluated=True)
+
+    # A timed-out rule may well be decided next time; don't keep the rejection
+    if timed_out:
+        return MATCH_TIMED_OUT
+    decision_cache.put((rule_set.version, command.text), matched)
+    return matched
+
+
+def evaluate_rule_set(rule_set: CompiledRuleSet, command_text: str,
+                      lowered: Optional[str] = None) -> Tuple[Optional[CompiledRule], bool]:
+    """
+    Find the first matching rule of a compiled rule set, without caching.
+
+    Args:
+        rule_set: Compiled rule set (current or candidate)
+        command_text: The command text to match
+        lowered: command_text.lower(), if the caller already has it
+
+    Returns:
+        Tuple of (first matching CompiledRule or None, whether an untrusted
+        pattern could not be searched in time). Matching stops at such a
+        pattern, so a timed-out evaluation never reports a match.
+    """
+    isolated_search = _IsolatedSearch(RULE_MATCH_TIME_BUDGET, RULE_MATCH_QUEUE_TIMEOUT) \
+        if REGEX_EVAL_MODE == "pool" else None
+    try:
+        index = rule_set.matcher.first_match(command_text, isolated_search, lowered)
+    except _MatchTimedOut:
+        return None, True
+    return (rule_set.rules[index] if index is not None else None), False
+
+
+def search_rule(rule_set: CompiledRuleSet, index: int, command_text: str) -> bool:
+    """
+    Check a single rule of a rule set against a command, on its own.
+
+    Untrusted patterns run in the regex worker pool; one that overruns
+    RULE_MATCH_TIME_BUDGET counts as not matching (this is for analysis,
+    not for deciding commands).
+
+    Args:
+        rule_set: Compiled rule set
+        index: Position of the rule in the rule set
+        command_text: The command text to search
+
+    Returns:
+        Whether the rule matches
+    """
+    rule = rule_set.rules[index]
+    if REGEX_EVAL_MODE == "pool" and rule_set.matcher.is_isolated(index):
+        return bool(regex_pool.search(rule.pattern.pattern, command_text, RULE_MATCH_TIME_BUDGET,
+                                      RULE_MATCH_QUEUE_TIMEOUT))
+    return rule.pattern.search(command_text) is not None
+
+
+def time_rule(rule_set: CompiledRuleSet, index: int, command_text: str) -> Optional[float]:
+    """
+    Time a single rule of a rule set against a command, on its own.
+
+    Args:
+        rule_set: Compiled rule set
+        index: Position of the rule in the rule set
+        command_text: The command text to search
+
+    Returns:
+        Seconds the search took, or None if an untrusted pattern timed out
+    """
+    rule = rule_set.rules[index]
+    if REGEX_EVAL_MODE == "pool" and rule_set.matcher.is_isolated(index):
+        return regex_pool.time_search(rule.pattern.pattern, command_text, RULE_MATCH_TIME_BUDGET,
+                                      RULE_MATCH_QUEUE_TIMEOUT)
+    start = time.perf_counter()
+    rule.pattern.search(command_text)
+    return time.perf_counter() - start
+
+
+def flush_rule_stats(db: Session) -> int:
+    """
+    Flush this process's rule counters into the rule_stats rollup table.
+
+    Args:
+        db: Database session
+
+    Returns:
+        Number of rule_stats rows written
+    """
+    rule_set = get_rule_set(db)
+    return rule_stats.flush(db, rule_set.rules, lambda index, text: time_rule(rule_set, index, text))
 
 
 def validate_regex_pattern(pattern: str, timeout: int = 5) -> tuple[bool, Optional[str]]:
     """
     Validate a regex pattern for safety.
-    
+
+    Patterns with a structural backtracking risk (see find_redos_risks) are
+    run against adversarial inputs of doubling length (in a worker process,
+    or inline with REGEX_EVAL_MODE=inline), and rejected if matching time
+    grows super-linearly or overruns the probe budget. Risky shapes that
+    turn out to be cheap in practice are accepted.
+
     Args:
         pattern: The regex pattern to validate
         timeout: Timeout in seconds
-        
+
     Returns:
         Tuple of (is_valid, error_message)
     """
     try:
-        if hasattr(signal, 'SIGALRM'):
-            signal.signal(signal.SIGALRM, _timeout_handler)
-            signal.alarm(timeout)
-        
-        try:
-            compiled = re.compile(pattern, re.IGNORECASE)
-            # Test with empty string
-            compiled.search("")
-        finally:
-            if hasattr(signal, 'SIGALRM'):
-                signal.alarm(0)
-        
-        return True, None
-    except RegexTimeoutError:
-        return False, "Regex pattern matching timed out - likely catastrophic backtracking"
+        compiled = re.compile(pattern, re.IGNORECASE)
     except re.error as e:
         return False, f"Invalid regex pattern: {str(e)}"
 
+    if REGEX_EVAL_MODE == "pool" and needs_isolation(pattern):
+        # Test with empty string, out of process
+        if regex_pool.search(pattern, "", timeout) is None:
+            return False, "Regex pattern matching timed out - likely catastrophic backtracking"
+    else:
+        # Test with empty string
+        compiled.search("")
+
+    deadline = time.monotonic() + REDOS_PROBE_BUDGET
+    for risk in find_redos_risks(pattern):
+        if not _probe_is_linear(compiled, risk, deadline):
+            return False, (
+                f"Regex pattern is vulnerable to catastrophic backtracking ({risk.kind}): "
+                f"matching time explodes on input shaped {risk.shape()}"
+            )
+
+    return True, None
+
+
+def _probe_is_linear(compiled: re.Pattern, risk: RedosRisk, deadline: float) -> bool:
+    """
+    Time a pattern against a risk's attack input at doubling lengths.
+
+    Args:
+        compiled: The compiled regex pattern
+        risk: Risk whose attack shape to try
+        deadline: time.monotonic() value by which probing must finish
+
+    Returns:
+        False if a probe overran the deadline or time grew super-linearly
+    """
+    n = 1
+    previous = None
+    while len(risk.attack(n)) <= REDOS_PROBE_MAX_LENGTH:
+        timeout = deadline - time.monotonic()
+        if previous is not None:
+            # Anything slower than this has already grown too fast; the slack
+            # covers process round-trips, which the measurement itself excludes
+            timeout = min(timeout, _PROBE_GROWTH_LIMIT * max(previous, _PROBE_NOISE_FLOOR) + _PROBE_SLACK)
+        elapsed = _time_probe(compiled, risk.attack(n), timeout)
+        if elapsed is None:
+            return False
+        if previous is not None and elapsed > _PROBE_NOISE_FLOOR and \
+                elapsed >= _PROBE_GROWTH_LIMIT * max(previous, _PROBE_NOISE_FLOOR / 2):
+            return False
+        previous = elapsed
+        n *= 2
+    return True
+
+
+def _time_probe(compiled: re.Pattern, text: str, timeout: float) -> Optional[float]:
+    """
+    Seconds one probe search takes, or None if it overran the timeout.
+
+    Inline mode has no way to stop a search, so an overrun is only noticed
+    once it finishes; growth is normally caught a few doublings earlier.
+    """
+    if REGEX_EVAL_MODE == "pool":
+        return regex_pool.time_search(compiled.pattern, text, timeout)
+    start = time.perf_counter()
+    compiled.search(text)
+    elapsed = time.perf_counter() - start
+    return elapsed if elapsed <= timeout else None
@@ -0,0 +1,143 @@
+"""Rule import and export in the rules_seed.json format."""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Mapping
+
+from sqlalchemy.orm import Session
+
+from app.models import Command, Rule, RuleAction
+from app.agent.rule_engine import publish_rule_set_version, validate_regex_pattern
+
+# Threads used to validate imported patterns (probing waits on regex workers)
+RULE_IMPORT_WORKERS = int(os.getenv("RULE_IMPORT_WORKERS", "8"))
+
+
+def load_rules_file(path: str) -> List[Dict[str, Any]]:
+    """
+    Read rule definitions from a rules_seed.json-style file.
+
+    Args:
+        path: Path to a JSON list of {priority, pattern, action, description}
+
+    Returns:
+        The rule definitions
+    """
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def rule_from_definition(definition: Mapping[str, Any]) -> Rule:
+    """
+    Build a (not yet added) Rule from a rule definition.
+
+    Args:
+        definition: Mapping with priority, pattern, action and optional description
+
+    Returns:
+        The new Rule
+    """
+    return Rule(
+        priority=definition["priority"],
+        pattern=definition["pattern"],
+        action=RuleAction(definition["action"]),
+        description=definition.get("description", "")
+    )
+
+
+def export_rules(db: Session) -> List[Dict[str, Any]]:
+    """
+    Export all rules as rule definitions, in priority order.
+
+    Args:
+        db: Database session
+
+    Returns:
+        List of {priority, pattern, action, description}, loadable by import_rules
+    """
+    return [
+        {
+            "priority": rule.priority,
+            "pattern": rule.pattern,
+            "action": rule.action.value,
+            "description": rule.description,
+        }
+        for rule in db.query(Rule).order_by(Rule.priority.asc(), Rule.created_at.asc())
+    ]
+
+
+def validate_patterns(patterns: Iterable[str]) -> Dict[str, str]:
+    """
+    Validate distinct patterns concurrently.
+
+    Args:
+        patterns: Regex patterns
+
+    Returns:
+        Dict of pattern -> error message for every invalid pattern
+    """
+    distinct = list(dict.fromkeys(patterns))
+    if not distinct:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(RULE_IMPORT_WORKERS, len(distinct))) as executor:
+        results = executor.map(validate_regex_pattern, distinct)
+        return {pattern: error for pattern, (valid, error) in zip(distinct, results) if not valid}
+
+
+def import_rules(db: Session, definitions: List[Mapping[str, Any]], mode: str) -> Dict[str, int]:
+    """
+    Apply rule definitions in one transaction, matching existing rules by pattern.
+
+    Existing rules with an imported pattern are updated in place (keeping
+    their ids, counters and command history); other imported rules are
+    created. In replace mode, rules whose pattern is not in the import are
+    deleted, and commands that matched them keep their history with
+    matched_rule_id cleared.
+
+    A new rule-set version is published in the same transaction. The caller
+    validates patterns first and rebuilds its own rule set afterwards.
+
+    Args:
+        db: Database session (committed on success)
+        definitions: Rule definitions with distinct patterns
+        mode: "replace" or "upsert"
+
+    Returns:
+        Dict with created, updated, unchanged and deleted counts
+    """
+    existing: Dict[str, Rule] = {}
+    # Later rules sharing a pattern with an earlier one; replace mode drops them
+    duplicates: List[Rule] = []
+    for rule in db.query(Rule).order_by(Rule.priority.asc(), Rule.created_at.asc()):
+        if rule.pattern in existing:
+            duplicates.append(rule)
+        else:
+            existing[rule.pattern] = rule
+    counts = {"created": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+
+    for definition in definitions:
+        new_rule = rule_from_definition(definition)
+        rule = existing.pop(new_rule.pattern, None)
+        if rule is None:
+            db.add(new_rule)
+            counts["created"] += 1
+            continue
+        changed = False
+        for field in ("priority", "action", "description"):
+            if getattr(rule, field) != getattr(new_rule, field):
+                setattr(rule, field, getattr(new_rule, field))
+                changed = True
+        counts["updated" if changed else "unchanged"] += 1
+
+    stale = list(existing.values()) + duplicates if mode == "replace" else []
+    if stale:
+        stale_ids = [rule.id for rule in stale]
+        db.query(Command).filter(Command.matched_rule_id.in_(stale_ids)).update(
+            {Command.matched_rule_id: None}, synchronize_session=False
+        )
+        db.query(Rule).filter(Rule.id.in_(stale_ids)).delete(synchronize_session=False)
+        counts["deleted"] = len(stale_ids)
+
+    publish_rule_set_version(db)
+    db.commit()
+    return counts
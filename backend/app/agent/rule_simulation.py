@@ -0,0 +1,162 @@
+"""Replay command history against a candidate rule set."""
+import os
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import Command, Rule, RuleAction
+from app.agent.rule_engine import CompiledRuleSet, compile_rules, evaluate_rule_set, get_rule_set
+
+# Rows fetched per round-trip from the server-side cursor
+SIMULATION_BATCH_SIZE = int(os.getenv("SIMULATION_BATCH_SIZE", "5000"))
+
+# Reported in place of an action when no rule matches
+NO_MATCH = "NO_MATCH"
+
+
+class CandidateRule(NamedTuple):
+    """A rule as it would exist under the candidate rule set (never persisted)."""
+    id: Optional[UUID]
+    priority: int
+    pattern: str
+    action: RuleAction
+
+
+def candidate_from_rules(rules: Iterable[Any]) -> List[CandidateRule]:
+    """
+    Build a candidate rule set from a full list of rule definitions.
+
+    Args:
+        rules: Objects with priority, pattern and action (a RuleAction or its value)
+
+    Returns:
+        Candidate rules
+    """
+    return [CandidateRule(None, rule.priority, rule.pattern, RuleAction(rule.action)) for rule in rules]
+
+
+def candidate_from_diff(
+    current: Sequence[Rule],
+    create: Iterable[Any] = (),
+    update: Iterable[Any] = (),
+    delete: Iterable[UUID] = (),
+) -> List[CandidateRule]:
+    """
+    Build a candidate rule set by applying a diff to the current rules.
+
+    Args:
+        current: Current Rule rows
+        create: Objects with priority, pattern and action for new rules
+        update: Objects with an id plus optional priority, pattern and action
+        delete: Ids of rules to drop
+
+    Returns:
+        Candidate rules
+
+    Raises:
+        KeyError: If an update or delete refers to an unknown rule id
+    """
+    candidates: Dict[UUID, CandidateRule] = {
+        rule.id: CandidateRule(rule.id, rule.priority, rule.pattern, rule.action) for rule in current
+    }
+
+    for change in update:
+        if change.id not in candidates:
+            raise KeyError(change.id)
+        rule = candidates[change.id]
+        candidates[change.id] = rule._replace(
+            priority=change.priority if change.priority is not None else rule.priority,
+            pattern=change.pattern if change.pattern is not None else rule.pattern,
+            action=RuleAction(change.action) if change.action is not None else rule.action,
+        )
+
+    for rule_id in delete:
+        if candidates.pop(rule_id, None) is None:
+            raise KeyError(rule_id)
+
+    return list(candidates.values()) + candidate_from_rules(create)
+
+
+def recent_command_texts(db: Session, limit: int) -> Iterator[Sequence[str]]:
+    """
+    Stream the text of the most recent commands, newest first, in batches.
+
+    Uses a server-side cursor (yield_per) so history is never loaded whole.
+
+    Args:
+        db: Database session
+        limit: Number of most recent commands to read
+
+    Yields:
+        Batches of up to SIMULATION_BATCH_SIZE command texts
+    """
+    # Plain Core rows: no ORM entity processing per history row
+    commands = Command.__table__
+    stmt = (
+        select(commands.c.command_text)
+        .order_by(commands.c.created_at.desc())
+        .limit(limit)
+        .execution_options(yield_per=SIMULATION_BATCH_SIZE)
+    )
+    yield from db.connection().execute(stmt).scalars().partitions()
+
+
+def simulate_rules(db: Session, candidate: Iterable[CandidateRule], limit: int) -> Dict[str, Any]:
+    """
+    Replay the most recent commands through the current and candidate rule sets.
+
+    History is streamed in batches (see recent_command_texts), and each
+    distinct command text is evaluated only once per rule set, so repeated
+    commands cost a dictionary lookup.
+
+    Args:
+        db: Database session
+        candidate: Candidate rules
+        limit: Number of most recent commands to replay
+
+    Returns:
+        Dict with replayed, distinct_commands, changed, timed_out, flips
+        (old_action, new_action, count, most frequent first) and elapsed_ms
+    """
+    started = time.perf_counter()
+    current_set = get_rule_set(db)
+    candidate_set = compile_rules(candidate)
+
+    decisions: Dict[str, Tuple[str, str]] = {}
+    flips: Counter = Counter()
+    replayed = 0
+    timed_out = 0
+
+    for batch in recent_command_texts(db, limit):
+        for command_text in batch:
+            decision = decisions.get(command_text)
+            if decision is None:
+                old_action, old_timed_out = _decide(current_set, command_text)
+                new_action, new_timed_out = _decide(candidate_set, command_text)
+                decision = decisions[command_text] = (old_action, new_action)
+                timed_out += old_timed_out or new_timed_out
+            if decision[0] != decision[1]:
+                flips[decision] += 1
+        replayed += len(batch)
+
+    return {
+        "replayed": replayed,
+        "distinct_commands": len(decisions),
+        "changed": sum(flips.values()),
+        "timed_out": timed_out,
+        "flips": [
+            {"old_action": old, "new_action": new, "count": count}
+            for (old, new), count in flips.most_common()
+        ],
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def _decide(rule_set: CompiledRuleSet, command_text: str) -> Tuple[str, bool]:
+    """Action name a rule set takes for a command, and whether evaluation timed out."""
+    matched, timed_out = evaluate_rule_set(rule_set, command_text)
+    return (matched.action.value if matched else NO_MATCH), timed_out
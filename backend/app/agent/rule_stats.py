@@ -0,0 +1,248 @@
+"""Per-rule hit counters and sampled match latency."""
+import bisect
+import os
+import random
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models import Rule, RuleStat
+
+# Seconds between flushes of the in-process counters to the rule_stats table; 0 disables
+RULE_STATS_FLUSH_INTERVAL = float(os.getenv("RULE_STATS_FLUSH_INTERVAL", "60"))
+# Commands kept per flush interval for timing every rule; 0 disables latency sampling
+RULE_STATS_SAMPLE_SIZE = int(os.getenv("RULE_STATS_SAMPLE_SIZE", "32"))
+
+# Upper bounds (microseconds) of the latency histogram buckets; the last
+# histogram slot counts anything slower, including timeouts
+LATENCY_BUCKETS_US = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 10000, 100000)
+
+# Times one rule (by position in a rule set) on one text; None means it timed out
+RuleTimer = Callable[[int, str], Optional[float]]
+
+
+class RuleStatsRecorder:
+    """
+    Cheap in-process counters for rule decisions, flushed periodically.
+
+    Recording a decision is O(1): only the first-matching rule (or "no
+    match") is counted. Under first-match-wins, every rule up to and
+    including that one was evaluated, so per-rule evaluation counts are
+    derived at flush time from the rule order of the rule set that made the
+    decisions.
+
+    Match latency is not measured on the request path, where rules are
+    evaluated together by the combined matcher. Instead a small reservoir of
+    recent commands is kept, and at flush time each rule is timed against
+    them on its own.
+    """
+
+    def __init__(self, sample_size: int = RULE_STATS_SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self._lock = threading.Lock()
+        self._reset()
+
+    def clear(self):
+        """Drop everything recorded since the last flush."""
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        """Start a new interval (caller holds the lock or owns the recorder)."""
+        # Every decision, including those served from the decision cache
+        self._matched: Counter = Counter()
+        # rule-set version -> (rules in priority order, first-match counts by rule id or None)
+        self._evaluations: Dict[int, Tuple[Sequence[Any], Counter]] = {}
+        self._samples: List[str] = []
+        self._seen = 0
+
+    def record(self, rule_set, matched, command_text: str, evaluated: bool):
+        """
+        Record one match_rule decision.
+
+        Args:
+            rule_set: CompiledRuleSet that made the decision
+            matched: The CompiledRule that matched, or None
+            command_text: The command text
+            evaluated: False if the decision came from the decision cache
+        """
+        matched_id = matched.id if matched is not None else None
+        with self._lock:
+            if matched_id is not None:
+                self._matched[matched_id] += 1
+            if not evaluated:
+                return
+            entry = self._evaluations.get(rule_set.version)
+            if entry is None:
+                entry = self._evaluations[rule_set.version] = (rule_set.rules, Counter())
+            entry[1][matched_id] += 1
+
+            # Reservoir sampling keeps a uniform sample of the interval's commands
+            self._seen += 1
+            if len(self._samples) < self.sample_size:
+                self._samples.append(command_text)
+            else:
+                slot = random.randrange(self._seen)
+                if slot < self.sample_size:
+                    self._samples[slot] = command_text
+
+    def flush(self, db: Session, rules: Sequence[Any], timer: RuleTimer) -> int:
+        """
+        Add the counters gathered since the last flush to the hourly rollup.
+
+        Args:
+            db: Database session
+            rules: Current compiled rules in priority order (timed against the samples)
+            timer: Times the rule at a given position on a text
+
+        Returns:
+            Number of rule_stats rows written
+        """
+        with self._lock:
+            matched, evaluations, samples = self._matched, self._evaluations, self._samples
+            self._reset()
+
+        evaluated: Counter = Counter()
+        for version_rules, first_matches in evaluations.values():
+            reached = sum(first_matches.values())
+            for rule in version_rules:
+                if reached <= 0:
+                    break
+                evaluated[rule.id] += reached
+                reached -= first_matches.get(rule.id, 0)
+
+        histograms: Dict[Any, List[int]] = {}
+        if samples:
+            for index, rule in enumerate(rules):
+                histogram = [0] * (len(LATENCY_BUCKETS_US) + 1)
+                for text in samples:
+                    histogram[latency_bucket(timer(index, text))] += 1
+                histograms[rule.id] = histogram
+
+        deltas = {
+            rule_id: (evaluated.get(rule_id, 0), matched.get(rule_id, 0), histograms.get(rule_id))
+            for rule_id in set(evaluated) | set(matched) | set(histograms)
+        }
+        if not deltas:
+            return 0
+
+        bucket_start = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        # Another process may create the same hourly rows concurrently; retry once on conflict
+        for attempt in range(2):
+            try:
+                return _write_rollup(db, bucket_start, deltas)
+            except IntegrityError:
+                db.rollback()
+                if attempt:
+                    raise
+        return 0
+
+
+def _write_rollup(db: Session, bucket_start: datetime, deltas: Dict[Any, Tuple[int, int, Optional[List[int]]]]) -> int:
+    """Upsert one rollup row per rule for the given hour and commit."""
+    # Rules deleted since the decisions were made have nothing to roll up into
+    live_ids = {rule_id for (rule_id,) in db.query(Rule.id).filter(Rule.id.in_(list(deltas)))}
+    existing = {
+        row.rule_id: row
+        for row in db.query(RuleStat).filter(
+            RuleStat.bucket_start == bucket_start,
+            RuleStat.rule_id.in_(list(live_ids))
+        )
+    }
+
+    for rule_id in live_ids:
+        evaluated, matched, histogram = deltas[rule_id]
+        row = existing.get(rule_id)
+        if row is None:
+            row = RuleStat(
+                rule_id=rule_id,
+                bucket_start=bucket_start,
+                evaluated=0,
+                matched=0,
+                timed_samples=0,
+                latency_histogram=[0] * (len(LATENCY_BUCKETS_US) + 1)
+            )
+            db.add(row)
+        row.evaluated += evaluated
+        row.matched += matched
+        if histogram is not None:
+            row.timed_samples += sum(histogram)
+            # Assign a new list so the JSON column is seen as changed
+            row.latency_histogram = merge_histograms([row.latency_histogram, histogram])
+
+    db.commit()
+    return len(live_ids)
+
+
+def summarize(db: Session, since: Optional[datetime] = None) -> Dict[Any, Dict[str, Any]]:
+    """
+    Total the rollup rows per rule.
+
+    Args:
+        db: Database session
+        since: Only include hourly buckets starting at or after this time
+
+    Returns:
+        Dict of rule id -> evaluated, matched, timed_samples, latency_histogram
+    """
+    query = db.query(RuleStat)
+    if since is not None:
+        query = query.filter(RuleStat.bucket_start >= since)
+
+    totals: Dict[Any, Dict[str, Any]] = {}
+    for row in query:
+        total = totals.setdefault(row.rule_id, {
+            "evaluated": 0,
+            "matched": 0,
+            "timed_samples": 0,
+            "latency_histogram": [0] * (len(LATENCY_BUCKETS_US) + 1),
+        })
+        total["evaluated"] += row.evaluated
+        total["matched"] += row.matched
+        total["timed_samples"] += row.timed_samples
+        total["latency_histogram"] = merge_histograms([total["latency_histogram"], row.latency_histogram])
+    return totals
+
+
+def latency_bucket(seconds: Optional[float]) -> int:
+    """Histogram slot for a latency in seconds (None, a timeout, goes in the last slot)."""
+    if seconds is None:
+        return len(LATENCY_BUCKETS_US)
+    return bisect.bisect_left(LATENCY_BUCKETS_US, seconds * 1e6)
+
+
+def merge_histograms(histograms: Iterable[Optional[List[int]]]) -> List[int]:
+    """Sum latency histograms slot by slot (missing or short histograms count as zeros)."""
+    total = [0] * (len(LATENCY_BUCKETS_US) + 1)
+    for histogram in histograms:
+        for slot, count in enumerate(histogram or ()):
+            total[slot] += count
+    return total
+
+
+def histogram_percentile(histogram: Sequence[int], fraction: float) -> Optional[float]:
+    """
+    Estimate a latency percentile from a histogram.
+
+    Args:
+        histogram: Counts per latency bucket
+        fraction: Percentile as a fraction, e.g. 0.99
+
+    Returns:
+        Upper bound (microseconds) of the bucket holding the percentile, or
+        None if there are no samples or it falls beyond the last bucket
+    """
+    total = sum(histogram)
+    if not total:
+        return None
+    threshold = fraction * total
+    running = 0
+    for slot, count in enumerate(histogram):
+        running += count
+        if running >= threshold:
+            return LATENCY_BUCKETS_US[slot] if slot < len(LATENCY_BUCKETS_US) else None
+    return None
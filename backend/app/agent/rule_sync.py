@@ -0,0 +1,108 @@
+"""Keep every worker process's compiled rules in step with the database."""
+import os
+import select
+import threading
+from typing import Callable
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.agent.rule_engine import (
+    RULE_SET_CHANNEL, known_rule_set_version, load_rule_set, read_rule_set_version
+)
+
+# Upper bound (seconds) on how long a rule change made by another worker
+# takes to reach this one; 0 disables the watcher
+RULE_SET_POLL_INTERVAL = float(os.getenv("RULE_SET_POLL_INTERVAL", "2.0"))
+
+
+class RuleSetWatcher:
+    """
+    Background thread that notices rule-set versions published by other workers.
+
+    On Postgres it LISTENs on RULE_SET_CHANNEL, so a change is picked up as
+    soon as the publishing transaction commits. Every other database (and
+    Postgres too, in case a notification is missed while reconnecting) is
+    polled every interval seconds. Either way one cheap query reads the
+    version stamp, and the rules are only reloaded when it has moved; the
+    reload happens here, off the request path.
+    """
+
+    def __init__(self, engine: Engine, session_factory: Callable[[], Session],
+                 interval: float = RULE_SET_POLL_INTERVAL):
+        self.engine = engine
+        self.session_factory = session_factory
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start watching (idempotent)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rule-set-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching and wait for the thread to exit."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def check(self) -> bool:
+        """
+        Read the version stamp once and reload the rules if it moved.
+
+        Returns:
+            True if the rules were reloaded
+        """
+        db = self.session_factory()
+        try:
+            # Only load_rule_set raises the known version, once the new rules
+            # are swapped in, so lookups never see the rules as stale while
+            # this thread is still rebuilding them
+            if read_rule_set_version(db) <= known_rule_set_version():
+                return False
+            load_rule_set(db)
+            return True
+        finally:
+            db.close()
+
+    def _run(self):
+        """Thread body: listen or poll until stopped, backing off after errors."""
+        while not self._stop.is_set():
+            try:
+                if self.engine.dialect.name == "postgresql":
+                    self._listen()
+                else:
+                    self._poll()
+            except Exception as e:
+                print(f"Warning: rule-set watcher error: {e}")
+                self._stop.wait(self.interval)
+
+    def _poll(self):
+        """Check the stamp every interval."""
+        while not self._stop.is_set():
+            self.check()
+            self._stop.wait(self.interval)
+
+    def _listen(self):
+        """Wait for NOTIFY on a dedicated connection, checking at least every interval."""
+        connection = self.engine.raw_connection()
+        try:
+            dbapi_connection = connection.dbapi_connection
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {RULE_SET_CHANNEL}")
+            # Catch changes published before LISTEN took effect
+            self.check()
+            while not self._stop.is_set():
+                readable, _, _ = select.select([dbapi_connection], [], [], self.interval)
+                if readable:
+                    dbapi_connection.poll()
+                    dbapi_connection.notifies.clear()
+                self.check()
+        finally:
+            connection.invalidate()
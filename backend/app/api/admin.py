@@ -1,19 +1,37 @@
 """Admin endpoints for user and rule management."""
-import secrets
-from typing import List
+from datetime import datetime, timedelta
+from typing import List, Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from app.db import get_db
-from app.models import User, Rule, UserRole, RuleAction, AuditLog
+from app.models import User, Rule, UserRole, RuleAction, AuditLog, ActionTaken
 from app.schemas import (
     UserCreate, UserResponse, UserWithApiKey, UserUpdate,
-    RuleCreate, RuleUpdate, RuleResponse, AuditLogResponse
+    RuleCreate, RuleUpdate, RuleResponse, AuditLogResponse,
+    RuleSimulationRequest, RuleSimulationResponse, RuleStatsResponse, RuleAnalysisResponse,
+    RuleBulkResponse, CreditReconciliationResponse, ExecutionQueueStatsResponse
 )
-from app.api.auth import get_current_admin
-from app.agent.rule_engine import validate_regex_pattern
+from app.api.auth import AuthenticatedUser, auth_cache, get_current_admin
+from app.api.pagination import keyset_page, set_next_cursor
+from app.security import generate_api_key
+from app.agent.rule_engine import (
+    validate_regex_pattern, refresh_rule_set, publish_rule_set_version, flush_rule_stats, decision_cache
+)
+from app.agent import rule_stats
+from app.agent.credits import (
+    get_credit_balance, pending_credits, reconcile_credits, record_opening_balance, set_credit_balance
+)
+from app.agent.credit_leases import leased_credits, revoke_user_leases
+from app.agent.execution_queue import execution_queue
+from app.agent.export import EXPORT_FORMATS, audit_log_export_query, command_export_query, stream_export
+from app.agent.rule_analysis import analyze_rules
+from app.agent.rule_io import export_rules, import_rules, validate_patterns
+from app.agent.rule_simulation import candidate_from_diff, candidate_from_rules, simulate_rules
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -22,15 +40,15 @@ router = APIRouter(prefix="/admin", tags=["admin"])
 def create_user(
     user_data: UserCreate,
     db: Session = Depends(get_db),
-    admin: User = Depends(get_current_admin)
+    admin: AuthenticatedUser = Depends(get_current_admin)
 ):
     """
     Create a new user and return API key (shown only once).
     
     Only admins can create users.
     """
-    # Generate API key
-    api_key = f"usr_{secrets.token_urlsafe(32)}"
+    # Generate API key (only its id and a hash of its secret are stored)
+    api_key = generate_api_key()
     
     # Determine role
     role = UserRole.ADMIN if user_data.role == "admin" else UserRole.MEMBER
@@ -43,8 +61,11 @@ def create_user(
     )
     
     db.add(user)
+    record_opening_balance(db, user)
     db.commit()
     db.refresh(user)
+    # The new key may have been presented (and cached as unknown) already
+    auth_cache.forget_key(api_key)
     
     return UserWithApiKey(
         id=user.id,
@@ -59,11 +80,22 @@ def create_user(
 @router.get("/users", response_model=List[UserResponse])
 def list_users(
     db: Session = Depends(get_db),
-    admin: User = Depends(get_current_admin)
+    admin: AuthenticatedUser = Depends(get_current_admin)
 ):
-    """List all users (admin only)."""
+    """List all users (admin only), counting uncompacted ledger entries and worker leases."""
     users = db.query(User).all()
-    return users
+    pending = pending_credits(db)
+    leased = leased_credits(db)
+    return [
+        UserResponse(
+            id=user.id,
+            name=user.name,
+            role=user.role.value,
+            credits=user.credits + pending.get(user.id, 0) + leased.get(user.id, 0),
+            created_at=user.created_at
+        )
+        for user in users
+    ]
 
 
 @router.put("/users/{user_id}", response_model=UserResponse)
@@ -71,7 +103,7 @@ def update_user(
     user_id: UUID,
     user_data: UserUpdate,
     db: Session = Depends(get_db),
-    admin: User = Depends(get_current_admin)
+    admin: AuthenticatedUser = Depends(get_current_admin)
 ):
     """Update a user's credits (admin only)."""
     user = db.query(User).filter(User.id == user_id).first()
@@ -83,18 +115,60 @@ def update_user(
         )
     
     if user_data.credits is not None:
-        user.credits = user_data.credits
+        # The new balance replaces whatever workers had leased
+        revoke_user_leases(db, user.id)
+        set_credit_balance(db, user.id, user_data.credits)
     
     db.commit()
     db.refresh(user)
+    auth_cache.forget_user(user.id)
+    
+    return UserResponse(
+        id=user.id,
+        name=user.name,
+        role=user.role.value,
+        credits=get_credit_balance(db, user.id),
+        created_at=user.created_at
+    )
+
+
+@router.get("/execution/stats", response_model=ExecutionQueueStatsResponse)
+def get_execution_stats(admin: AuthenticatedUser = Depends(get_current_admin)):
+    """
+    This worker's execution queue: depth, busy executors and recent queue waits (admin only).
+    
+    Each worker process has its own queue; wait times cover the last 1000
+    commands it started.
+    """
+    return execution_queue.stats()
+
+
+@router.get("/credits/reconciliation", response_model=CreditReconciliationResponse)
+def get_credit_reconciliation(
+    db: Session = Depends(get_db),
+    admin: AuthenticatedUser = Depends(get_current_admin)
+):
+    """
+    Check every user's materialized balance against the credit ledger (admin only).
     
-    return user
+    users.credits must equal the sum of the user's compacted ledger entries;
+    users where it does not are listed with a non-zero drift. Balances
+    include entries not yet compacted; leased is reported separately.
+    """
+    report = reconcile_credits(db)
+    leased = leased_credits(db)
+    users = [{**entry, "leased": leased.get(entry["user_id"], 0)} for entry in report["users"]]
+    return {
+        "users": users,
+        "pending_entries": report["pending_entries"],
+        "drifted": sum(1 for entry in users if entry["drift"] != 0),
+    }
 
 
 @router.get("/rules", response_model=List[RuleResponse])
 def list_rules(
     db: Session = Depends(get_db),
-    admin: User = Depends(get_current_admin)
+    admin: AuthenticatedUser = Depends(get_current_admin)
 ):
     """List all rules (admin only)."""
     rules = db.query(Rule).order_by(Rule.priority.asc()).all()
@@ -105,7 +179,7 @@ def list_rules(
 def create_rule(
     rule_data: RuleCreate,
     db: Session = Depends(get_db),
-    admin: User = Depends(get_current_admin)
+    admin: AuthenticatedUser = Depends(get_current_admin)
 ):
     """
     Create a new rule (admin only).
@@ -131,8 +205,10 @@ def create_rule(
     )
     
     db.add(rule)
+    publish_rule_set_version(db)
     db.commit()
     db.refresh(rule)
+    refresh_rule_set(db)
     
     return rule
 
@@ -142,7 +218,7 @@ def update_rule(
     rule_id: UUID,
     rule_data: RuleUpdate,
     db: Session = Depends(get_db),
-    admin: User = Depends(get_current_admin)
+    admin: AuthenticatedUser = Depends(get_current_admin)
 ):
     """Update a rule (admin only)."""
     rule = db.query(Rule).filter(Rule.id == rule_id).first()
@@ -173,8 +249,10 @@ def update_rule(
     if rule_data.description is not None:
         rule.description = rule_data.description
     
+    publish_rule_set_version(db)
     db.commit()
     db.refresh(rule)
+    refresh_rule_set(db)
     
     return rule
 
@@ -183,7 +261,7 @@ def update_rule(
 def delete_rule(
     rule_id: UUID,
     db: Session = Depends(get_db),
-    admin: User = Depends(get_current_admin)
+    admin: AuthenticatedUser = Depends(get_current_admin)
 ):
     """Delete a rule (admin only)."""
     rule = db.query(Rule).filter(Rule.id == rule_id).first()
@@ -195,21 +273,240 @@ def delete_rule(
         )
     
     db.delete(rule)
+    publish_rule_set_version(db)
     db.commit()
+    refresh_rule_set(db)
     
     return None
 
 
+@router.post("/rules/bulk", response_model=RuleBulkResponse)
+def bulk_import_rules(
+    rules: List[RuleCreate],
+    mode: str = Query("upsert", pattern="^(replace|upsert)$"),
+    db: Session = Depends(get_db),
+    admin: AuthenticatedUser = Depends(get_current_admin)
+):
+    """
+    Import many rules at once (admin only).
+    
+    Takes the rules_seed.json format. Rules are matched to existing ones by
+    pattern: upsert updates or creates them, replace additionally deletes
+    every rule not in the import. All patterns are validated up front and
+    everything is written in one transaction, followed by a single rule-set
+    rebuild.
+    """
+    patterns = [rule.pattern for rule in rules]
+    duplicates = sorted({pattern for pattern in patterns if patterns.count(pattern) > 1})
+    if duplicates:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": "Duplicate patterns in import", "patterns": duplicates}
+        )
+    
+    errors = validate_patterns(patterns)
+    if errors:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                "message": f"{len(errors)} invalid pattern(s)",
+                "errors": [{"pattern": pattern, "error": error} for pattern, error in errors.items()]
+            }
+        )
+    
+    counts = import_rules(db, [rule.model_dump() for rule in rules], mode)
+    rule_set = refresh_rule_set(db)
+    
+    return {"mode": mode, "version": rule_set.version, **counts}
+
+
+@router.get("/rules/export", response_model=List[RuleCreate])
+def export_all_rules(
+    db: Session = Depends(get_db),
+    admin: AuthenticatedUser = Depends(get_current_admin)
+):
+    """Export all rules in the rules_seed.json format (admin only)."""
+    return export_rules(db)
+
+
+@router.get("/rules/stats", response_model=RuleStatsResponse)
+def get_rule_stats(
+    hours: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db),
+    admin: AuthenticatedUser = Depends(get_current_admin)
+):
+    """
+    Per-rule evaluation and match counts with sampled match latency (admin only).
+    
+    Counters are rolled up hourly; pass hours to only include recent buckets.
+    Rules are listed in priority order, including rules that never matched.
+    """
+    # Include this process's counters gathered since the last periodic flush
+    flush_rule_stats(db)
+    
+    since = None
+    if hours is not None:
+        since = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours - 1)
+    totals = rule_stats.summarize(db, since)
+    
+    entries = []
+    for rule in db.query(Rule).order_by(Rule.priority.asc()).all():
+        total = totals.get(rule.id, {})
+        histogram = total.get("latency_histogram") or rule_stats.merge_histograms([])
+        entries.append({
+            "rule_id": rule.id,
+            "priority": rule.priority,
+            "pattern": rule.pattern,
+            "action": rule.action.value,
+            "evaluated": total.get("evaluated", 0),
+            "matched": total.get("matched", 0),
+            "timed_samples": total.get("timed_samples", 0),
+            "latency_histogram": histogram,
+            "p50_us": rule_stats.histogram_percentile(histogram, 0.5),
+            "p99_us": rule_stats.histogram_percentile(histogram, 0.99),
+        })
+    
+    return {
+        "since": since,
+        "latency_buckets_us": list(rule_stats.LATENCY_BUCKETS_US),
+        "rules": entries,
+        "decision_cache": decision_cache.stats(),
+    }
+
+
+@router.get("/rules/analysis", response_model=RuleAnalysisResponse)
+def get_rule_analysis(
+    history: int = Query(10000, ge=0, le=1000000),
+    samples: int = Query(8, ge=1, le=64),
+    db: Session = Depends(get_db),
+    admin: AuthenticatedUser = Depends(get_current_admin)
+):
+    """
+    Find rules that can never be the first match (admin only).
+    
+    Replays recent command history plus strings generated from every
+    pattern. Rules that never decide anything are reported as shadowed (with
+    the earlier rules that catch their samples) or dead; rules whose commands
+    would fall through to a rule with the same action are reported as
+    redundant.
+    """
+    return analyze_rules(db, history, samples)
+
+
+@router.post("/rules/simulate", response_model=RuleSimulationResponse)
+def simulate_rule_changes(
+    request: RuleSimulationRequest,
+    db: Session = Depends(get_db),
+    admin: AuthenticatedUser = Depends(get_current_admin)
+):
+    """
+    Replay recent command history against a candidate rule set (admin only).
+    
+    The candidate is either a full rule list or a diff against the current
+    rules. Nothing is saved; the response counts the commands whose decision
+    would change, grouped by old and new action.
+    """
+    if (request.rules is None) == (request.diff is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide exactly one of 'rules' or 'diff'"
+        )
+    
+    current = db.query(Rule).order_by(Rule.priority.asc()).all()
+    if request.rules is not None:
+        candidate = candidate_from_rules(request.rules)
+    else:
+        try:
+            candidate = candidate_from_diff(
+                current, request.diff.create, request.diff.update, request.diff.delete
+            )
+        except KeyError as e:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Rule not found: {e.args[0]}"
+            )
+    
+    # Patterns already live have been validated when they were saved
+    existing_patterns = {rule.pattern for rule in current}
+    for pattern in {rule.pattern for rule in candidate} - existing_patterns:
+        is_valid, error_msg = validate_regex_pattern(pattern)
+        if not is_valid:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"{pattern}: {error_msg}"
+            )
+    
+    return simulate_rules(db, candidate, request.limit)
+
+
 @router.get("/audit-logs", response_model=List[AuditLogResponse])
 def list_audit_logs(
+    response: Response,
+    cursor: Optional[str] = None,
     skip: int = 0,
     limit: int = 100,
     db: Session = Depends(get_db),
-    admin: User = Depends(get_current_admin)
+    admin: AuthenticatedUser = Depends(get_current_admin)
 ):
-    """List audit logs (admin only)."""
-    logs = db.query(AuditLog).order_by(
-        AuditLog.created_at.desc()
-    ).offset(skip).limit(limit).all()
+    """
+    List audit logs, newest first (admin only).
+    
+    Paged like GET /commands: follow the X-Next-Cursor header.
+    """
+    logs = db.scalars(keyset_page(select(AuditLog), AuditLog, cursor, limit).offset(skip)).all()
+    set_next_cursor(response, logs, limit)
     return logs
 
+
+@router.get("/export/commands")
+def export_commands(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    gzip: bool = False,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user_id: Optional[UUID] = None,
+    action: Optional[List[ActionTaken]] = Query(None),
+    db: Session = Depends(get_db),
+    admin: AuthenticatedUser = Depends(get_current_admin)
+):
+    """
+    Stream command history as NDJSON or CSV, oldest first (admin only).
+    
+    Filter by creation time (since inclusive, until exclusive), user and
+    outcome (action, repeatable). Rows are streamed from a server-side
+    cursor, so exports of any size use the same memory.
+    """
+    query = command_export_query(since, until, user_id, action)
+    return _export_response(db, query, "commands", format, gzip)
+
+
+@router.get("/export/audit-logs")
+def export_audit_logs(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    gzip: bool = False,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    event_type: Optional[List[str]] = Query(None),
+    actor_user_id: Optional[UUID] = None,
+    db: Session = Depends(get_db),
+    admin: AuthenticatedUser = Depends(get_current_admin)
+):
+    """
+    Stream audit logs as NDJSON or CSV, oldest first (admin only).
+    
+    Filter by creation time (since inclusive, until exclusive), event type
+    (repeatable) and actor, as for GET /admin/export/commands.
+    """
+    query = audit_log_export_query(since, until, event_type, actor_user_id)
+    return _export_response(db, query, "audit_logs", format, gzip)
+
+
+def _export_response(db: Session, query, name: str, fmt: str, compress: bool) -> StreamingResponse:
+    """Stream an export as a file download."""
+    filename = f"{name}.{fmt}" + (".gz" if compress else "")
+    return StreamingResponse(
+        # Reads on a connection of its own, so it outlives the request's session
+        stream_export(db.get_bind(), query, fmt, compress),
+        media_type="application/gzip" if compress else EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -1,32 +1,190 @@
 """Authentication middleware and dependencies."""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+from uuid import UUID
+
 from fastapi import Depends, HTTPException, status, Header
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.db import get_db
-from app.models import User
+from app.db import get_async_db
+from app.models import User, UserRole
+from app.security import parse_api_key, verify_api_key_secret
+
+# Seconds a resolved API key is trusted without asking the database; 0 disables caching
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))
+# Seconds an unknown API key is remembered as invalid
+AUTH_CACHE_NEGATIVE_TTL = float(os.getenv("AUTH_CACHE_NEGATIVE_TTL", "5"))
+# Number of API keys (valid or not) to remember
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
+
+class AuthenticatedUser(NamedTuple):
+    """Immutable snapshot of the user behind an API key."""
+    id: UUID
+    name: str
+    role: UserRole
+
+
+class AuthCache:
+    """
+    Thread-safe bounded LRU map from API key to AuthenticatedUser, with expiry.
+
+    Unknown keys are stored as None with the (shorter) negative TTL, so a
+    flood of bad keys costs one query per key per negative TTL. Admin
+    changes drop entries in this process immediately; other worker
+    processes see them once their entries expire.
+    """
+
+    MISSING = object()
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # api key -> (expires at, user snapshot or None for an unknown key)
+        self._entries: "OrderedDict[str, Tuple[float, Optional[AuthenticatedUser]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
 
-# For demo purposes, we'll use plaintext API keys
-# In production, use hashed keys (bcrypt, etc.)
+    def get(self, api_key: str) -> Any:
+        """Return the cached snapshot (None for a known-bad key), or AuthCache.MISSING."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(api_key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[api_key]
+                self.misses += 1
+                return self.MISSING
+            self._entries.move_to_end(api_key)
+            self.hits += 1
+            return entry[1]
 
+    def put(self, api_key: str, user: Optional[AuthenticatedUser]):
+        """Store a lookup result, evicting the least recently used entry if full."""
+        ttl = self.ttl if user is not None else self.negative_ttl
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[api_key] = (time.monotonic() + ttl, user)
+            self._entries.move_to_end(api_key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
 
-def get_current_user(
+    def forget_key(self, api_key: str):
+        """Drop one API key (e.g. a newly issued key that may be cached as unknown)."""
+        with self._lock:
+            self._entries.pop(api_key, None)
+
+    def forget_user(self, user_id: UUID):
+        """Drop every key that resolves to a user."""
+        with self._lock:
+            stale = [key for key, (_, user) in self._entries.items() if user is not None and user.id == user_id]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        """Drop every entry (counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Snapshot of the cache counters."""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+auth_cache = AuthCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL, AUTH_CACHE_NEGATIVE_TTL)
+
+
+def authenticate(api_key: str, db: Session) -> Optional[AuthenticatedUser]:
+    """
+    Resolve an API key to a user snapshot, consulting the auth cache first.
+
+    The user is looked up by the key's public id and the secret is checked
+    against the stored hash; the cache remembers verified keys, so the hash
+    is only computed on a miss.
+
+    Args:
+        api_key: API key presented by the client
+        db: Database session (only queried on a cache miss)
+
+    Returns:
+        AuthenticatedUser, or None if no user has this key
+    """
+    cached = auth_cache.get(api_key)
+    if cached is not AuthCache.MISSING:
+        return cached
+
+    key_id, secret = parse_api_key(api_key)
+    row = db.execute(_user_by_key_id(key_id)).first()
+    return _remember(api_key, secret, row)
+
+
+async def authenticate_async(api_key: str, db: AsyncSession) -> Optional[AuthenticatedUser]:
+    """
+    Like authenticate, on an async session (the event loop never blocks on the lookup).
+
+    Args:
+        api_key: API key presented by the client
+        db: Async database session (only queried on a cache miss)
+
+    Returns:
+        AuthenticatedUser, or None if no user has this key
+    """
+    cached = auth_cache.get(api_key)
+    if cached is not AuthCache.MISSING:
+        return cached
+
+    key_id, secret = parse_api_key(api_key)
+    row = (await db.execute(_user_by_key_id(key_id))).first()
+    return _remember(api_key, secret, row)
+
+
+def _user_by_key_id(key_id: str):
+    """Query for the user columns authentication needs."""
+    return select(User.id, User.name, User.role, User.api_key_hash).where(User.api_key_id == key_id)
+
+
+def _remember(api_key: str, secret: str, row: Any) -> Optional[AuthenticatedUser]:
+    """Verify a looked-up row against the presented secret and cache the outcome."""
+    if row is not None and verify_api_key_secret(secret, row.api_key_hash):
+        user = AuthenticatedUser(row.id, row.name, row.role)
+    else:
+        user = None
+    auth_cache.put(api_key, user)
+    return user
+
+
+async def get_current_user(
     x_api_key: str = Header(..., alias="X-API-KEY"),
-    db: Session = Depends(get_db)
-) -> User:
+    db: AsyncSession = Depends(get_async_db)
+) -> AuthenticatedUser:
     """
     Get current user from API key header.
     
     Args:
         x_api_key: API key from X-API-KEY header
-        db: Database session
+        db: Async database session
         
     Returns:
-        User object
+        AuthenticatedUser snapshot (read credits from the database)
         
     Raises:
         HTTPException: If API key is invalid
     """
-    user = db.query(User).filter(User.api_key == x_api_key).first()
+    user = await authenticate_async(x_api_key, db)
     
     if not user:
         raise HTTPException(
@@ -38,8 +196,8 @@ def get_current_user(
 
 
 def get_current_admin(
-    current_user: User = Depends(get_current_user)
-) -> User:
+    current_user: AuthenticatedUser = Depends(get_current_user)
+) -> AuthenticatedUser:
     """
     Ensure current user is an admin.
     
@@ -47,13 +205,11 @@ def get_current_admin(
         current_user: Current user from get_current_user
         
     Returns:
-        User object (admin)
+        AuthenticatedUser snapshot (admin)
         
     Raises:
         HTTPException: If user is not an admin
     """
-    from app.models import UserRole
-    
     if current_user.role != UserRole.ADMIN:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
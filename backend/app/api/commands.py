@@ -1,20 +1,43 @@
 """Command submission endpoints."""
+import os
+import uuid
 from datetime import datetime
 from uuid import UUID
-from typing import List
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.db import get_db
-from app.models import User, Command, ActionTaken, RuleAction
-from app.schemas import CommandRequest, CommandResponse, CommandDetailResponse
-from app.agent.rule_engine import match_rule
+from app.db import get_async_db
+from app.models import Command, ActionTaken, RuleAction
+from app.schemas import (
+    CommandRequest, CommandResponse, CommandDetailResponse, CommandBatchRequest, CommandBatchResponse
+)
+from app.agent.command_parser import ParsedCommand, parse_command
+from app.agent.rule_engine import (
+    CompiledRule, MATCH_TIMED_OUT, match_rule_async, match_rules_async
+)
 from app.agent.executor import simulate_execution
-from app.agent.credits import deduct_credit
-from app.agent.audit import log_event
-from app.notifications.ws import send_to_user, send_to_admins
-from app.api.auth import get_current_user
+from app.agent.execution_queue import (
+    ExecutionJob, defer_execution, execution_queue, take_deferred_executions
+)
+from app.agent.credit_leases import (
+    charge_credits, charge_credits_up_to, get_balance, has_credits, reserve_credits
+)
+from app.agent.audit import log_event, log_events
+from app.notifications.ws import send_to_user, send_to_admins, send_many_to_admins
+from app.api.auth import AuthenticatedUser, get_current_user
+from app.api.pagination import keyset_page, set_next_cursor
+from app.api.idempotency import (
+    IdempotentRequest, claim_idempotency_key, find_idempotent_response, idempotency_cache, idempotent_request,
+    remember_idempotent_response, store_idempotent_response
+)
+from app.api.rate_limit import enforce_rate_limits, rate_limited_user
+
+# Most commands accepted by one POST /commands/batch request
+COMMAND_BATCH_MAX_SIZE = int(os.getenv("COMMAND_BATCH_MAX_SIZE", "200"))
 
 router = APIRouter(prefix="/commands", tags=["commands"])
 
@@ -22,24 +45,195 @@ router = APIRouter(prefix="/commands", tags=["commands"])
 @router.post("", response_model=CommandResponse)
 async def submit_command(
     request: CommandRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", min_length=1, max_length=255),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(rate_limited_user)
 ):
     """
     Submit a command for execution.
     
-    Implements the full transaction flow:
-    1. Check credits
-    2. Match rules (first priority wins)
-    3. Apply rule action (reject/accept/require approval)
-    4. Execute if accepted (atomic credit deduction + execution)
-    5. Save command record
-    6. Send WebSocket notification
+    Rate limits (per user, then global) are enforced right after authentication.
+    The decision and its writes run as one unit of work on the async
+    session's connection, so the event loop serves other requests and
+    WebSockets while the database works; notifications go out afterwards.
+    
+    With EXECUTION_MODE=queued an accepted command is charged and recorded
+    as QUEUED and the response is 202; the result is pushed over WebSocket
+    (and shows in GET /commands/{id}) once the execution queue has run it.
+    
+    With an Idempotency-Key header, a retry of the same request returns
+    the first response (marked Idempotent-Replayed) without matching,
+    charging or executing again.
+    """
+    idempotent = idempotent_request(idempotency_key, "/commands", request)
+    replayed = await _stored_response(db, current_user, idempotent, response)
+    if replayed is not None:
+        return replayed
+    
+    # Normalized and tokenized once, shared by rule matching and execution
+    parsed = parse_command(request.command_text)
+    # Matched before the unit of work: regex evaluation runs off the event loop
+    matched_rule = await match_rule_async(parsed, db)
+    
+    # With credit leasing, make sure this worker holds the credit up front;
+    # only an accepted command can need an execution queue slot
+    accepted = matched_rule is not None and matched_rule.action == RuleAction.AUTO_ACCEPT
+    if accepted:
+        await reserve_credits(db, current_user.id, 1)
+    
+    reserved = _reserve_executions(1 if accepted else 0)
+    try:
+        replayed, outcome = await db.run_sync(
+            _process_idempotent, current_user, idempotent, _process_command, parsed, matched_rule
+        )
+    except BaseException:
+        _discard_executions(db, reserved)
+        raise
+    _submit_executions(db, reserved)
+    if replayed is not None:
+        return _replay(replayed, response)
+    
+    command_response, user_message, admin_message = outcome
+    if command_response.status == "queued":
+        response.status_code = status.HTTP_202_ACCEPTED
+    if admin_message is not None:
+        await send_to_admins(admin_message, db)
+    if user_message is not None:
+        await send_to_user(current_user.id, user_message)
+    
+    return command_response
+
+
+async def _stored_response(
+    db: AsyncSession,
+    current_user: AuthenticatedUser,
+    idempotent: Optional[IdempotentRequest],
+    response: Response
+) -> Optional[Dict[str, Any]]:
+    """
+    A committed response for this Idempotency-Key, from the in-process cache
+    or else the idempotency_keys table (checked before any matching or charging).
     """
-    command_text = request.command_text.strip()
+    if idempotent is None:
+        return None
+    stored = idempotency_cache.get(current_user.id, idempotent)
+    if stored is None:
+        stored = await db.run_sync(find_idempotent_response, current_user.id, idempotent)
+    return _replay(stored, response) if stored is not None else None
+
+
+def _replay(stored: Dict[str, Any], response: Response) -> Dict[str, Any]:
+    """Mark a stored response as replayed (202 again if it queued work)."""
+    response.headers["Idempotent-Replayed"] = "true"
+    if stored.get("status") == "queued" or stored.get("queued"):
+        response.status_code = status.HTTP_202_ACCEPTED
+    return stored
+
+
+def _reserve_executions(count: int) -> int:
+    """
+    Reserve execution queue slots for up to count accepted commands (queued mode).
+    
+    Returns:
+        Slots reserved (0 when commands run inline)
     
-    # Step 1: Check credits (before rule matching for early rejection)
-    if current_user.credits < 1:
+    Raises:
+        HTTPException: 503 if the execution queue is full
+    """
+    if not execution_queue.queued or not count:
+        return 0
+    if not execution_queue.reserve(count):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Execution queue is full",
+            headers={"Retry-After": "1"}
+        )
+    return count
+
+
+def _submit_executions(db: AsyncSession, reserved: int):
+    """Queue the commands a committed request deferred and free its unused slots."""
+    jobs = take_deferred_executions(db.sync_session)
+    for job in jobs:
+        execution_queue.submit(job)
+    execution_queue.release(reserved - len(jobs))
+
+
+def _discard_executions(db: AsyncSession, reserved: int):
+    """Drop the commands of a request that did not commit and free its slots."""
+    take_deferred_executions(db.sync_session)
+    execution_queue.release(reserved)
+
+
+def _process_idempotent(
+    db: Session,
+    current_user: AuthenticatedUser,
+    idempotent: Optional[IdempotentRequest],
+    process: Callable[..., tuple],
+    *args
+) -> Tuple[Optional[Dict[str, Any]], Optional[tuple]]:
+    """
+    Run a command handler in one transaction, behind its Idempotency-Key (if any).
+    
+    The key is reserved first, in the same transaction as the handler's
+    writes and the response stored under it, so either all of them commit
+    or none do.
+    
+    Args:
+        db: Database session (committed)
+        current_user: Submitting user
+        idempotent: The request's key, or None
+        process: Handler returning a tuple whose first item is the response
+        *args: Further handler arguments
+    
+    Returns:
+        (stored response, None) when replaying an earlier request,
+        otherwise (None, handler result)
+    """
+    if idempotent is not None:
+        stored = claim_idempotency_key(db, current_user.id, idempotent)
+        if stored is not None:
+            db.rollback()
+            return stored, None
+    
+    outcome = process(db, current_user, *args)
+    if idempotent is None:
+        db.commit()
+        return None, outcome
+    
+    stored = outcome[0].model_dump(mode="json")
+    store_idempotent_response(db, current_user.id, idempotent, stored)
+    db.commit()
+    remember_idempotent_response(db, current_user.id, idempotent, stored)
+    return None, outcome
+
+
+def _process_command(
+    db: Session,
+    current_user: AuthenticatedUser,
+    parsed: ParsedCommand,
+    matched_rule: Optional[CompiledRule]
+) -> Tuple[CommandResponse, Optional[dict], Optional[dict]]:
+    """
+    Decide, execute and record one command (sync; the caller commits).
+    
+    The rules were matched before the unit of work began (see
+    match_rule_async), so it only touches the database. Transaction flow:
+    1. Check credits (an empty balance rejects whatever rule matched)
+    2. No matching rule: reject
+    3. AUTO_REJECT (or matching that timed out): reject
+    4. REQUIRE_APPROVAL: record as pending for an admin
+    5. AUTO_ACCEPT: execute (or queue) and save the command record, then
+       deduct the credit last (atomically; a failed deduction rejects instead)
+    
+    Returns:
+        Tuple of (response, message for the user, message for admins);
+        the messages are None when there is nothing to send
+    """
+    command_text = parsed.text
+    # Step 1: Check credits (the rule is already matched, but not yet applied)
+    if not has_credits(db, current_user.id):
         # Create command record with REJECTED status
         command = Command(
             user_id=current_user.id,
@@ -56,18 +250,15 @@ async def submit_command(
             "COMMAND_REJECTED",
             {"reason": "INSUFFICIENT_CREDITS", "command_text": command_text}
         )
-        db.commit()
+        db.flush()
         
         return CommandResponse(
             status="rejected",
             reason="INSUFFICIENT_CREDITS",
             command_id=command.id
-        )
-    
-    # Step 2: Match rules
-    matched_rule = match_rule(command_text, db)
+        ), None, None
     
-    # Step 3: Handle no match
+    # Step 2: Handle no match
     if not matched_rule:
         command = Command(
             user_id=current_user.id,
@@ -84,16 +275,17 @@ async def submit_command(
             "NO_MATCH",
             {"command_text": command_text}
         )
-        db.commit()
+        db.flush()
         
         return CommandResponse(
             status="rejected",
             reason="NO_MATCHING_RULE",
             command_id=command.id
-        )
+        ), None, None
     
-    # Step 4: Handle AUTO_REJECT
+    # Step 3: Handle AUTO_REJECT (and matching that ran out of time, which fails closed)
     if matched_rule.action == RuleAction.AUTO_REJECT:
+        reason = "RULE_TIMEOUT" if matched_rule is MATCH_TIMED_OUT else "AUTO_REJECT"
         command = Command(
             user_id=current_user.id,
             command_text=command_text,
@@ -108,28 +300,25 @@ async def submit_command(
             current_user.id,
             "COMMAND_REJECTED",
             {
-                "reason": "AUTO_REJECT",
-                "rule_id": str(matched_rule.id),
+                "reason": reason,
+                "rule_id": str(matched_rule.id) if matched_rule.id else None,
                 "command_text": command_text
             }
         )
-        db.commit()
-        
-        # Send notification
-        await send_to_user(current_user.id, {
-            "type": "command_update",
-            "command_id": str(command.id),
-            "status": "rejected",
-            "reason": "AUTO_REJECT"
-        })
+        db.flush()
         
         return CommandResponse(
             status="rejected",
-            reason="AUTO_REJECT",
+            reason=reason,
             command_id=command.id
-        )
+        ), {
+            "type": "command_update",
+            "command_id": str(command.id),
+            "status": "rejected",
+            "reason": reason
+        }, None
     
-    # Step 5: Handle REQUIRE_APPROVAL
+    # Step 4: Handle REQUIRE_APPROVAL
     if matched_rule.action == RuleAction.REQUIRE_APPROVAL:
         command = Command(
             user_id=current_user.id,
@@ -150,79 +339,61 @@ async def submit_command(
                 "command_text": command_text
             }
         )
-        db.commit()
+        db.flush()
         
-        # Send notification to admins
-        await send_to_admins({
+        return CommandResponse(
+            status="pending",
+            command_id=command.id
+        ), {
+            "type": "command_update",
+            "command_id": str(command.id),
+            "status": "pending"
+        }, {
             "type": "approval_request",
             "command_id": str(command.id),
             "command_text": command_text,
             "submitted_by": str(current_user.id),
             "user_name": current_user.name
-        }, db)
-        
-        # Send notification to user
-        await send_to_user(current_user.id, {
-            "type": "command_update",
-            "command_id": str(command.id),
-            "status": "pending"
-        })
-        
-        return CommandResponse(
-            status="pending",
-            command_id=command.id
-        )
+        }
     
-    # Step 6: Handle AUTO_ACCEPT (atomic transaction)
+    # Step 5: Handle AUTO_ACCEPT (atomic transaction)
     if matched_rule.action == RuleAction.AUTO_ACCEPT:
-        # Use SELECT FOR UPDATE to lock user row
-        success, new_balance = deduct_credit(db, current_user.id, amount=1)
-        
-        if not success:
-            # Insufficient credits after lock
+        # The command is written first and paid for last, so the user's
+        # other debits only wait from the charge to the commit (see
+        # deduct_credit). Inline mode only ever runs the mock executor, and
+        # queued commands run after the commit, so nothing real runs unpaid.
+        if execution_queue.queued:
+            # Queued mode: record the command, run it once this commits
+            execution_result = None
             command = Command(
+                id=uuid.uuid4(),
                 user_id=current_user.id,
                 command_text=command_text,
                 matched_rule_id=matched_rule.id,
-                action_taken=ActionTaken.REJECTED,
-                cost=0,
+                action_taken=ActionTaken.QUEUED,
+                cost=1,
                 result=None
             )
-            db.add(command)
-            log_event(
-                db,
-                current_user.id,
-                "COMMAND_REJECTED",
-                {"reason": "INSUFFICIENT_CREDITS", "command_text": command_text}
-            )
-            db.commit()
-            
-            return CommandResponse(
-                status="rejected",
-                reason="INSUFFICIENT_CREDITS",
-                command_id=command.id
+        else:
+            # Execute command
+            execution_result = simulate_execution(parsed)
+            command = Command(
+                id=uuid.uuid4(),
+                user_id=current_user.id,
+                command_text=command_text,
+                matched_rule_id=matched_rule.id,
+                action_taken=ActionTaken.ACCEPTED,
+                cost=1,
+                result=execution_result,
+                executed_at=datetime.utcnow()
             )
-        
-        # Execute command
-        execution_result = simulate_execution(command_text)
-        
-        # Create command record
-        command = Command(
-            user_id=current_user.id,
-            command_text=command_text,
-            matched_rule_id=matched_rule.id,
-            action_taken=ActionTaken.ACCEPTED,
-            cost=1,
-            result=execution_result,
-            executed_at=datetime.utcnow()
-        )
         db.add(command)
         
-        # Log audit event
-        log_event(
+        # Log audit event (flushes the command with it)
+        event = log_event(
             db,
             current_user.id,
-            "COMMAND_EXECUTED",
+            "COMMAND_QUEUED" if execution_queue.queued else "COMMAND_EXECUTED",
             {
                 "command_id": str(command.id),
                 "rule_id": str(matched_rule.id),
@@ -231,24 +402,52 @@ async def submit_command(
             }
         )
         
-        # Commit transaction
-        db.commit()
+        # Check and deduct in one conditional statement (or from this worker's lease)
+        success, new_balance = charge_credits(db, current_user.id, amount=1)
         
-        # Send WebSocket notification
-        await send_to_user(current_user.id, {
-            "type": "command_update",
-            "command_id": str(command.id),
-            "status": "executed",
-            "result": execution_result,
-            "new_balance": new_balance
-        })
+        if not success:
+            # Insufficient credits after all: record the rejection instead
+            command.action_taken = ActionTaken.REJECTED
+            command.cost = 0
+            command.result = None
+            command.executed_at = None
+            event.event_type = "COMMAND_REJECTED"
+            event.details = {"reason": "INSUFFICIENT_CREDITS", "command_text": command_text}
+            db.flush()
+            
+            return CommandResponse(
+                status="rejected",
+                reason="INSUFFICIENT_CREDITS",
+                command_id=command.id
+            ), None, None
         
+        if execution_queue.queued:
+            defer_execution(db, ExecutionJob(command.id, current_user.id, parsed, matched_rule.id))
+            
+            return CommandResponse(
+                status="queued",
+                new_balance=new_balance,
+                command_id=command.id
+            ), {
+                "type": "command_update",
+                "command_id": str(command.id),
+                "status": "queued",
+                "new_balance": new_balance
+            }, None
+        
+        # Committed by the caller
         return CommandResponse(
             status="executed",
             result=execution_result,
             new_balance=new_balance,
             command_id=command.id
-        )
+        ), {
+            "type": "command_update",
+            "command_id": str(command.id),
+            "status": "executed",
+            "result": execution_result,
+            "new_balance": new_balance
+        }, None
     
     # Should never reach here
     raise HTTPException(
@@ -257,32 +456,234 @@ async def submit_command(
     )
 
 
+@router.post("/batch", response_model=CommandBatchResponse)
+async def submit_command_batch(
+    request: CommandBatchRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", min_length=1, max_length=255),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_user)
+):
+    """
+    Submit several commands at once, decided and recorded in one transaction.
+    
+    Each command costs one token from the user's and the global rate limits,
+    as if it were sent on its own; a batch larger than the burst needs a full
+    bucket and then leaves it in debt. Every command
+    is matched against the same snapshot of the rules; the credits for all
+    AUTO_ACCEPT commands are then taken from this worker's credit lease
+    (when leasing is enabled) and the rest deducted in a single statement. In
+    partial mode the earliest accepted commands run while credits last and
+    the rest are rejected with INSUFFICIENT_CREDITS; in all_or_nothing mode
+    none of them run unless all can be paid for. Rule rejections and
+    approval requests are recorded the same way in both modes.
+    
+    Results are returned in submission order. An Idempotency-Key makes a
+    retried batch replay the first response, as for POST /commands. In
+    queued execution mode paid-for commands are queued (202) instead of run.
+    """
+    if len(request.commands) > COMMAND_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {COMMAND_BATCH_MAX_SIZE} commands per batch"
+        )
+    
+    await enforce_rate_limits(current_user, len(request.commands))
+    idempotent = idempotent_request(idempotency_key, "/commands/batch", request)
+    replayed = await _stored_response(db, current_user, idempotent, response)
+    if replayed is not None:
+        return replayed
+    
+    parsed_commands = [parse_command(item.command_text) for item in request.commands]
+    matched_rules = await match_rules_async(parsed_commands, db)
+    accepted = sum(1 for rule in matched_rules if rule is not None and rule.action == RuleAction.AUTO_ACCEPT)
+    if accepted:
+        await reserve_credits(db, current_user.id, accepted)
+    reserved = _reserve_executions(accepted)
+    try:
+        replayed, outcome = await db.run_sync(
+            _process_idempotent, current_user, idempotent, _process_batch, parsed_commands, matched_rules,
+            request.mode
+        )
+    except BaseException:
+        _discard_executions(db, reserved)
+        raise
+    _submit_executions(db, reserved)
+    if replayed is not None:
+        return _replay(replayed, response)
+    
+    batch_response, admin_messages = outcome
+    if batch_response.queued:
+        response.status_code = status.HTTP_202_ACCEPTED
+    for result in batch_response.results:
+        await send_to_user(current_user.id, {
+            "type": "command_update",
+            "command_id": str(result.command_id),
+            "status": result.status,
+            **({"reason": result.reason} if result.reason else {}),
+            **({"result": result.result, "new_balance": result.new_balance} if result.status == "executed" else {})
+        })
+    await send_many_to_admins(admin_messages, db)
+    
+    return batch_response
+
+
+def _process_batch(
+    db: Session,
+    current_user: AuthenticatedUser,
+    parsed_commands: List[ParsedCommand],
+    matched_rules: List[Optional[CompiledRule]],
+    mode: str
+) -> Tuple[CommandBatchResponse, List[dict]]:
+    """
+    Decide, execute and record a batch (sync; the caller commits).
+    
+    Returns:
+        Tuple of (response, approval requests for admins)
+    """
+    # Pay for every command the rules accept, from the lease or in one ledger entry
+    wanted = sum(1 for rule in matched_rules if rule is not None and rule.action == RuleAction.AUTO_ACCEPT)
+    if mode == "all_or_nothing":
+        granted = wanted if wanted and charge_credits(db, current_user.id, wanted)[0] else 0
+    else:
+        granted = charge_credits_up_to(db, current_user.id, wanted)
+    
+    commands = []
+    events = []
+    results = []
+    admin_messages = []
+    now = datetime.utcnow()
+    for parsed, matched_rule in zip(parsed_commands, matched_rules):
+        command = Command(
+            id=uuid.uuid4(),
+            user_id=current_user.id,
+            command_text=parsed.text,
+            matched_rule_id=matched_rule.id if matched_rule else None,
+            action_taken=ActionTaken.REJECTED,
+            cost=0,
+            result=None
+        )
+        commands.append(command)
+        
+        if matched_rule is None:
+            events.append((current_user.id, "NO_MATCH", {"command_text": parsed.text}))
+            results.append(CommandResponse(status="rejected", reason="NO_MATCHING_RULE", command_id=command.id))
+        elif matched_rule.action == RuleAction.AUTO_REJECT:
+            reason = "RULE_TIMEOUT" if matched_rule is MATCH_TIMED_OUT else "AUTO_REJECT"
+            events.append((current_user.id, "COMMAND_REJECTED", {
+                "reason": reason,
+                "rule_id": str(matched_rule.id) if matched_rule.id else None,
+                "command_text": parsed.text
+            }))
+            results.append(CommandResponse(status="rejected", reason=reason, command_id=command.id))
+        elif matched_rule.action == RuleAction.REQUIRE_APPROVAL:
+            command.action_taken = ActionTaken.PENDING
+            events.append((current_user.id, "COMMAND_PENDING_APPROVAL", {
+                "command_id": str(command.id),
+                "rule_id": str(matched_rule.id),
+                "command_text": parsed.text
+            }))
+            admin_messages.append({
+                "type": "approval_request",
+                "command_id": str(command.id),
+                "command_text": parsed.text,
+                "submitted_by": str(current_user.id),
+                "user_name": current_user.name
+            })
+            results.append(CommandResponse(status="pending", command_id=command.id))
+        elif granted > 0 and execution_queue.queued:
+            granted -= 1
+            command.action_taken = ActionTaken.QUEUED
+            command.cost = 1
+            events.append((current_user.id, "COMMAND_QUEUED", {
+                "command_id": str(command.id),
+                "rule_id": str(matched_rule.id),
+                "command_text": parsed.text,
+                "cost": 1
+            }))
+            defer_execution(db, ExecutionJob(command.id, current_user.id, parsed, matched_rule.id))
+            results.append(CommandResponse(status="queued", command_id=command.id))
+        elif granted > 0:
+            granted -= 1
+            execution_result = simulate_execution(parsed)
+            command.action_taken = ActionTaken.ACCEPTED
+            command.cost = 1
+            command.result = execution_result
+            command.executed_at = now
+            events.append((current_user.id, "COMMAND_EXECUTED", {
+                "command_id": str(command.id),
+                "rule_id": str(matched_rule.id),
+                "command_text": parsed.text,
+                "cost": 1
+            }))
+            results.append(CommandResponse(status="executed", result=execution_result, command_id=command.id))
+        else:
+            events.append((current_user.id, "COMMAND_REJECTED", {
+                "reason": "INSUFFICIENT_CREDITS",
+                "command_text": parsed.text
+            }))
+            results.append(CommandResponse(status="rejected", reason="INSUFFICIENT_CREDITS", command_id=command.id))
+    
+    # Inserted as one multi-row statement per table
+    db.add_all(commands)
+    log_events(db, events)
+    db.flush()
+    
+    new_balance = get_balance(db, current_user.id)
+    for result in results:
+        if result.status in ("executed", "queued"):
+            result.new_balance = new_balance
+    
+    return CommandBatchResponse(
+        mode=mode,
+        results=results,
+        executed=sum(1 for result in results if result.status == "executed"),
+        rejected=sum(1 for result in results if result.status == "rejected"),
+        pending=sum(1 for result in results if result.status == "pending"),
+        queued=sum(1 for result in results if result.status == "queued"),
+        cost=sum(command.cost for command in commands),
+        new_balance=new_balance
+    ), admin_messages
+
+
 @router.get("", response_model=List[CommandDetailResponse])
-def list_commands(
+async def list_commands(
+    response: Response,
+    cursor: Optional[str] = None,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_user)
 ):
-    """List commands for the current user."""
-    commands = db.query(Command).filter(
-        Command.user_id == current_user.id
-    ).order_by(Command.created_at.desc()).offset(skip).limit(limit).all()
+    """
+    List commands for the current user, newest first.
     
+    A full page carries an X-Next-Cursor header; pass it back as cursor
+    for the next page, which costs the same however deep it is. skip still
+    works but scans every skipped row.
+    """
+    commands = (await db.scalars(
+        keyset_page(select(Command).where(Command.user_id == current_user.id), Command, cursor, limit)
+        .offset(skip)
+    )).all()
+    
+    set_next_cursor(response, commands, limit)
     return commands
 
 
 @router.get("/{command_id}", response_model=CommandDetailResponse)
-def get_command(
+async def get_command(
     command_id: UUID,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: AuthenticatedUser = Depends(get_current_user)
 ):
     """Get a specific command by ID."""
-    command = db.query(Command).filter(
-        Command.id == command_id,
-        Command.user_id == current_user.id
-    ).first()
+    command = await db.scalar(
+        select(Command).where(
+            Command.id == command_id,
+            Command.user_id == current_user.id
+        )
+    )
     
     if not command:
         raise HTTPException(
@@ -291,4 +692,3 @@ def get_command(
         )
     
     return command
-
@@ -0,0 +1,247 @@
+"""Idempotency keys for command submission."""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models import IdempotencyKey
+
+# Seconds a response is replayed for a repeated Idempotency-Key
+IDEMPOTENCY_KEY_TTL = float(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))
+# Completed responses kept in process, in front of the idempotency_keys table
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+# Seconds between deletions of expired keys; 0 disables the background purge
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "300"))
+
+
+class IdempotentRequest(NamedTuple):
+    """A client's Idempotency-Key and a hash of what it was sent with."""
+    key: str
+    request_hash: str
+
+
+def idempotent_request(key: Optional[str], endpoint: str, body: BaseModel) -> Optional[IdempotentRequest]:
+    """
+    Describe a request for idempotent handling.
+
+    Args:
+        key: Idempotency-Key header value (None if the client sent none)
+        endpoint: Path the request was sent to
+        body: Parsed request body
+
+    Returns:
+        IdempotentRequest, or None when there is no key
+    """
+    if key is None:
+        return None
+    payload = json.dumps([endpoint, body.model_dump(mode="json")], sort_keys=True, separators=(",", ":"))
+    return IdempotentRequest(key, hashlib.sha256(payload.encode()).hexdigest())
+
+
+class IdempotencyCache:
+    """
+    In-process LRU of completed idempotent responses.
+
+    Entries only exist once the response is committed, so a hit can be
+    replayed without touching the database.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        # (user id, key) -> (request hash, response, expires_at)
+        self._entries: "OrderedDict[Tuple[UUID, str], Tuple[str, Dict[str, Any], datetime]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: UUID, request: IdempotentRequest) -> Optional[Dict[str, Any]]:
+        """
+        Look up a remembered response.
+
+        Args:
+            user_id: Submitting user
+            request: The idempotent request
+
+        Returns:
+            The stored response, or None if not cached (or expired)
+
+        Raises:
+            HTTPException: 422 if the key was used with a different request
+        """
+        with self._lock:
+            entry = self._entries.get((user_id, request.key))
+            if entry is None:
+                return None
+            request_hash, response, expires_at = entry
+            if expires_at <= datetime.utcnow():
+                del self._entries[(user_id, request.key)]
+                return None
+            self._entries.move_to_end((user_id, request.key))
+        if request_hash != request.request_hash:
+            raise _key_reused()
+        return response
+
+    def put(self, user_id: UUID, request: IdempotentRequest, response: Dict[str, Any], expires_at: datetime):
+        """Remember a committed response."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[(user_id, request.key)] = (request.request_hash, response, expires_at)
+            self._entries.move_to_end((user_id, request.key))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Forget every entry."""
+        with self._lock:
+            self._entries.clear()
+
+
+idempotency_cache = IdempotencyCache(IDEMPOTENCY_CACHE_SIZE)
+
+
+def find_idempotent_response(db: Session, user_id: UUID, request: IdempotentRequest) -> Optional[Dict[str, Any]]:
+    """
+    Look up a committed response for a key, without reserving it.
+
+    One primary-key read, so a retry that missed the in-process cache is
+    answered before any matching or charging happens.
+
+    Args:
+        db: Database session
+        user_id: Submitting user
+        request: The idempotent request
+
+    Returns:
+        The stored response to replay, or None if the key has none (yet)
+
+    Raises:
+        HTTPException: 422 if the key was used with a different request
+    """
+    row = db.execute(
+        select(IdempotencyKey.request_hash, IdempotencyKey.response, IdempotencyKey.expires_at)
+        .where(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.key == request.key,
+            IdempotencyKey.expires_at > datetime.utcnow()
+        )
+    ).first()
+    if row is None or row.response is None:
+        return None
+    if row.request_hash != request.request_hash:
+        raise _key_reused()
+    idempotency_cache.put(user_id, request, row.response, row.expires_at)
+    return row.response
+
+
+def claim_idempotency_key(db: Session, user_id: UUID, request: IdempotentRequest) -> Optional[Dict[str, Any]]:
+    """
+    Reserve a key in the caller's transaction, or get the response it already has.
+
+    The reservation is a row insert. A concurrent request with the same key
+    waits on the primary key until the first one commits (or collides with
+    it), and then replays the stored response; anything it had done is
+    rolled back with its transaction.
+
+    Args:
+        db: Database session (the caller commits)
+        user_id: Submitting user
+        request: The idempotent request
+
+    Returns:
+        None if the key is now reserved (process the request), otherwise
+        the stored response to replay
+
+    Raises:
+        HTTPException: 422 if the key was used with a different request
+    """
+    now = datetime.utcnow()
+    # An expired key may be reused as if it were new
+    db.execute(
+        delete(IdempotencyKey)
+        .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == request.key, IdempotencyKey.expires_at <= now)
+        .execution_options(synchronize_session=False)
+    )
+    try:
+        with db.begin_nested():
+            db.add(IdempotencyKey(
+                user_id=user_id,
+                key=request.key,
+                request_hash=request.request_hash,
+                response=None,
+                expires_at=now + timedelta(seconds=IDEMPOTENCY_KEY_TTL)
+            ))
+        return None
+    except IntegrityError:
+        pass
+
+    row = db.execute(
+        select(IdempotencyKey.request_hash, IdempotencyKey.response, IdempotencyKey.expires_at)
+        .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == request.key)
+    ).first()
+    if row is None or row.response is None:
+        # The other request has not finished (or gave up); the client should retry
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A request with this Idempotency-Key is still in progress"
+        )
+    if row.request_hash != request.request_hash:
+        raise _key_reused()
+    idempotency_cache.put(user_id, request, row.response, row.expires_at)
+    return row.response
+
+
+def store_idempotent_response(db: Session, user_id: UUID, request: IdempotentRequest, response: Dict[str, Any]):
+    """
+    Attach the response to a reserved key (committed with the caller's transaction).
+
+    Args:
+        db: Database session holding the reservation
+        user_id: Submitting user
+        request: The idempotent request
+        response: JSON-serializable response to replay
+    """
+    row = db.get(IdempotencyKey, (user_id, request.key))
+    row.response = response
+
+
+def remember_idempotent_response(db: Session, user_id: UUID, request: IdempotentRequest, response: Dict[str, Any]):
+    """Cache a response after its transaction committed."""
+    row = db.get(IdempotencyKey, (user_id, request.key))
+    if row is not None:
+        idempotency_cache.put(user_id, request, response, row.expires_at)
+
+
+def purge_expired_idempotency_keys(db: Session) -> int:
+    """
+    Delete expired keys.
+
+    Args:
+        db: Database session (committed)
+
+    Returns:
+        Number of keys deleted
+    """
+    deleted = db.execute(
+        delete(IdempotencyKey)
+        .where(IdempotencyKey.expires_at <= datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return deleted
+
+
+def _key_reused() -> HTTPException:
+    """Error for a key sent again with a different request."""
+    return HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        detail="Idempotency-Key was already used with a different request"
+    )
@@ -0,0 +1,84 @@
+"""Keyset (cursor) pagination over (created_at, id)."""
+import base64
+import binascii
+from datetime import datetime
+from typing import Any, Optional, Sequence, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException, Response, status
+from sqlalchemy import Select, tuple_
+
+# Response header carrying the cursor of the next page (absent on the last page)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: datetime, row_id: UUID) -> str:
+    """
+    Opaque cursor pointing just past a row.
+
+    Args:
+        created_at: The row's created_at
+        row_id: The row's id
+
+    Returns:
+        URL-safe cursor string
+    """
+    raw = f"{created_at.isoformat()}|{row_id.hex}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    """
+    Read a cursor made by encode_cursor.
+
+    Args:
+        cursor: Cursor from a previous page
+
+    Returns:
+        Tuple of (created_at, id) of the last row already returned
+
+    Raises:
+        HTTPException: 400 if the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.split("|")
+        return datetime.fromisoformat(created_at), UUID(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def keyset_page(query: Select, model: Any, cursor: Optional[str], limit: int) -> Select:
+    """
+    Restrict a query to one page, newest first.
+
+    The page starts right after the cursor's row, so with an index on
+    (..., created_at, id) every page is an index range scan of limit rows,
+    however deep it is.
+
+    Args:
+        query: Select of model rows (filters applied)
+        model: Mapped class with created_at and id columns
+        cursor: Cursor from the previous page, or None for the first page
+        limit: Rows per page
+
+    Returns:
+        The paged select
+    """
+    if cursor is not None:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.where(tuple_(model.created_at, model.id) < (created_at, row_id))
+    return query.order_by(model.created_at.desc(), model.id.desc()).limit(limit)
+
+
+def set_next_cursor(response: Response, rows: Sequence[Any], limit: int):
+    """
+    Point the client at the next page if this one was full.
+
+    Args:
+        response: Response to add the X-Next-Cursor header to
+        rows: Rows of the page, in page order
+        limit: Rows per page
+    """
+    if rows and len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1].created_at, rows[-1].id)
@@ -0,0 +1,285 @@
+"""Token-bucket rate limits for command submission."""
+import asyncio
+import math
+import os
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from fastapi import Depends, HTTPException, status
+
+from app.models import UserRole
+from app.api.auth import AuthenticatedUser, get_current_user
+
+
+class RateLimit(NamedTuple):
+    """Sustained rate (tokens per second) and burst size of a token bucket."""
+    rate: float
+    burst: float
+
+
+def parse_rate_limit(spec: str) -> Optional[RateLimit]:
+    """
+    Parse a "rate/burst" limit, e.g. "10/20" for 10 per second with bursts of 20.
+
+    Args:
+        spec: Limit specification; a bare rate uses the same burst, and an
+            empty string or "0" means unlimited
+
+    Returns:
+        RateLimit, or None for no limit
+    """
+    rate, _, burst = spec.strip().partition("/")
+    if not rate or float(rate) <= 0:
+        return None
+    return RateLimit(float(rate), max(float(burst or rate), 1.0))
+
+
+# Per-user limit on POST /commands, by role ("rate/burst"; "0" disables)
+ROLE_LIMITS: Dict[UserRole, Optional[RateLimit]] = {
+    UserRole.MEMBER: parse_rate_limit(os.getenv("COMMAND_RATE_LIMIT_MEMBER", "10/20")),
+    UserRole.ADMIN: parse_rate_limit(os.getenv("COMMAND_RATE_LIMIT_ADMIN", "50/100")),
+}
+# Limit on POST /commands across all authenticated users
+GLOBAL_LIMIT = parse_rate_limit(os.getenv("COMMAND_RATE_LIMIT_GLOBAL", "200/400"))
+# Share buckets between worker processes through Redis (requires the redis package)
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "")
+# Tokens a worker takes from a shared bucket at once, then hands out locally
+RATE_LIMIT_LEASE_SIZE = int(os.getenv("RATE_LIMIT_LEASE_SIZE", "5"))
+# Seconds leased tokens stay usable; unused ones are forfeited, never returned
+RATE_LIMIT_LEASE_TTL = float(os.getenv("RATE_LIMIT_LEASE_TTL", "1.0"))
+
+# Buckets kept in process before idle (full) ones are swept
+_MAX_LOCAL_BUCKETS = 100000
+
+
+class LocalRateLimiter:
+    """
+    In-process token buckets, keyed by an arbitrary string.
+
+    A check is one dictionary lookup and a little arithmetic under a lock.
+    Buckets that have refilled completely carry no state worth keeping, so
+    they are swept once there are too many.
+    """
+
+    def __init__(self):
+        # key -> [tokens, monotonic time of last refill, limit]
+        self._buckets: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, limit: RateLimit, tokens: int = 1) -> float:
+        """
+        Take tokens, all or none.
+
+        A request costing more than the burst is let through once the bucket
+        is full and leaves it in debt, so the sustained rate still holds.
+
+        Args:
+            key: Bucket key
+            limit: Rate and burst of the bucket
+            tokens: Tokens the request costs
+
+        Returns:
+            0.0 if allowed, otherwise seconds until the tokens are available
+        """
+        now = time.monotonic()
+        needed = min(tokens, limit.burst)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= _MAX_LOCAL_BUCKETS:
+                    self._sweep(now)
+                bucket = self._buckets[key] = [limit.burst, now, limit]
+            else:
+                bucket[0] = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+                bucket[1] = now
+            if bucket[0] >= needed:
+                bucket[0] -= tokens
+                return 0.0
+            return (needed - bucket[0]) / limit.rate
+
+    async def acquire_async(self, key: str, limit: RateLimit, tokens: int = 1) -> float:
+        """Take tokens from an async caller (no I/O, so no thread hop)."""
+        return self.acquire(key, limit, tokens)
+
+    def clear(self):
+        """Forget every bucket."""
+        with self._lock:
+            self._buckets.clear()
+
+    def _sweep(self, now: float):
+        """Drop buckets that would be full by now (caller holds the lock)."""
+        for key in [key for key, (tokens, stamp, limit) in self._buckets.items()
+                    if tokens + (now - stamp) * limit.rate >= limit.burst]:
+            del self._buckets[key]
+
+
+# Atomically refill a bucket stored in a Redis hash and take up to ARGV[3]
+# tokens; with ARGV[4] = 1, take exactly ARGV[3] or none (a cost above the
+# burst needs a full bucket and leaves it in debt).
+# Returns {granted, milliseconds until the tokens are available}.
+_REDIS_TAKE = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local wanted = tonumber(ARGV[3])
+local exact = tonumber(ARGV[4]) == 1
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+local tokens = tonumber(state[1]) or burst
+local stamp = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - stamp) * rate)
+local needed = 1
+local granted = math.max(0, math.min(wanted, math.floor(tokens)))
+if exact then
+    needed = math.min(wanted, burst)
+    granted = tokens >= needed and wanted or 0
+end
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'stamp', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+if granted > 0 then
+    return {granted, 0}
+end
+return {0, math.ceil((needed - tokens) / rate * 1000)}
+"""
+
+
+class RedisRateLimiter:
+    """
+    Token buckets shared by every worker process through Redis.
+
+    To keep Redis off the path of most requests, each process takes a few
+    tokens at once (a lease) and hands them out locally until they run out
+    or expire. Expired leases are forfeited, so the shared limit can only be
+    undershot; at worst each worker holds one lease's worth of tokens the
+    others cannot use for a second.
+    """
+
+    def __init__(self, url: str, lease_size: int = RATE_LIMIT_LEASE_SIZE, lease_ttl: float = RATE_LIMIT_LEASE_TTL):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("RATE_LIMIT_REDIS_URL is set but the redis package is not installed") from e
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(_REDIS_TAKE)
+        self.lease_size = max(lease_size, 1)
+        self.lease_ttl = lease_ttl
+        # key -> [leased tokens left, monotonic expiry]
+        self._leases: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, limit: RateLimit, tokens: int = 1) -> float:
+        """
+        Take tokens (all or none), from the local lease if it holds enough.
+
+        Single tokens refill the lease from Redis; larger costs are taken
+        from the shared bucket directly.
+
+        Args:
+            key: Bucket key
+            limit: Rate and burst of the bucket
+            tokens: Tokens the request costs
+
+        Returns:
+            0.0 if allowed, otherwise seconds until the tokens are available
+        """
+        now = time.monotonic()
+        if self._take_leased(key, now, tokens):
+            return 0.0
+
+        if tokens > 1:
+            granted, wait_ms = self._take(
+                keys=[f"rate_limit:{key}"], args=[limit.rate, limit.burst, tokens, 1]
+            )
+            return 0.0 if granted else wait_ms / 1000
+
+        # Never lease more than a small share of the burst
+        wanted = max(1, min(self.lease_size, int(limit.burst // 4)))
+        granted, wait_ms = self._take(
+            keys=[f"rate_limit:{key}"], args=[limit.rate, limit.burst, wanted, 0]
+        )
+        if not granted:
+            return wait_ms / 1000
+        with self._lock:
+            self._leases[key] = [granted - 1, now + self.lease_ttl]
+        return 0.0
+
+    async def acquire_async(self, key: str, limit: RateLimit, tokens: int = 1) -> float:
+        """
+        Take tokens from an async caller.
+
+        Leased tokens are handed out on the event loop; only a Redis
+        round-trip runs in a worker thread.
+        """
+        if self._take_leased(key, time.monotonic(), tokens):
+            return 0.0
+        return await asyncio.to_thread(self.acquire, key, limit, tokens)
+
+    def _take_leased(self, key: str, now: float, tokens: int = 1) -> bool:
+        """Take tokens from the local lease, if it has that many left."""
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is not None and lease[0] >= tokens and lease[1] > now:
+                lease[0] -= tokens
+                return True
+            return False
+
+    def clear(self):
+        """Forget local leases (shared buckets refill on their own)."""
+        with self._lock:
+            self._leases.clear()
+
+
+limiter = RedisRateLimiter(RATE_LIMIT_REDIS_URL) if RATE_LIMIT_REDIS_URL else LocalRateLimiter()
+
+
+async def rate_limited_user(
+    current_user: AuthenticatedUser = Depends(get_current_user)
+) -> AuthenticatedUser:
+    """
+    Enforce the per-user limit for the user's role, then the global limit.
+
+    Both run after authentication, so requests with invalid API keys never
+    use up the global bucket, and a user held back by their own limit does
+    not use it up either.
+
+    Args:
+        current_user: Current user from get_current_user
+
+    Returns:
+        The same user, if under both limits
+
+    Raises:
+        HTTPException: 429 with Retry-After if over a limit
+    """
+    await enforce_rate_limits(current_user)
+    return current_user
+
+
+async def enforce_rate_limits(current_user: AuthenticatedUser, commands: int = 1):
+    """
+    Charge submitted commands to the user's bucket, then the global one.
+
+    Args:
+        current_user: Authenticated submitting user
+        commands: Commands submitted (one token each)
+
+    Raises:
+        HTTPException: 429 with Retry-After if over a limit
+    """
+    limit = ROLE_LIMITS.get(current_user.role)
+    if limit is not None:
+        _enforce(await limiter.acquire_async(f"commands:user:{current_user.id}", limit, commands))
+    if GLOBAL_LIMIT is not None:
+        _enforce(await limiter.acquire_async("commands:global", GLOBAL_LIMIT, commands))
+
+
+def _enforce(retry_after: float):
+    """Raise 429 if a limiter asked the caller to wait."""
+    if retry_after > 0:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
@@ -1,20 +1,39 @@
 """FastAPI application entry point."""
 import os
-import json
+import asyncio
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 
-from app.db import engine, get_db, Base
-from app.models import Rule, User, UserRole, RuleAction
+from app.db import engine, async_engine, get_db, Base, SessionLocal
+from app.models import Rule, User, UserRole
 from app.api import commands, admin
+from app.api.auth import authenticate_async
+from app.security import check_api_secret
+from app.api.idempotency import purge_expired_idempotency_keys, IDEMPOTENCY_PURGE_INTERVAL
 from app.notifications import ws
+from app.agent.rule_engine import (
+    invalidate_rule_set, load_rule_set, publish_rule_set_version, flush_rule_stats, regex_pool,
+    REGEX_EVAL_MODE
+)
+from app.agent.rule_stats import RULE_STATS_FLUSH_INTERVAL
+from app.agent.rule_sync import RuleSetWatcher, RULE_SET_POLL_INTERVAL
+from app.agent.rule_io import load_rules_file, rule_from_definition
+from app.agent.credits import compact_ledger, record_opening_balance, CREDIT_COMPACTION_INTERVAL
+from app.agent.executor import EXECUTOR_BACKEND
+from app.agent.execution_queue import execution_queue
+from app.agent.credit_leases import (
+    lease_manager, reclaim_expired_leases, CREDIT_LEASE_SIZE, CREDIT_LEASE_TTL
+)
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+# Reloads this worker's rules when another worker changes them
+rule_set_watcher = RuleSetWatcher(engine, SessionLocal)
+
 # CORS origins
 ALLOW_CORS_ORIGINS = os.getenv("ALLOW_CORS_ORIGINS", "").split(",") if os.getenv("ALLOW_CORS_ORIGINS") else ["*"]
 
@@ -22,18 +41,159 @@ ALLOW_CORS_ORIGINS = os.getenv("ALLOW_CORS_ORIGINS", "").split(",") if os.getenv
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events."""
-    # Startup: Seed rules and default admin
+    # Startup: never hash API keys under an empty secret in production
+    check_api_secret()
+    
+    # Seed rules and default admin
     db = next(get_db())
     try:
         seed_rules(db)
         seed_default_admin(db)
+        # Warm the compiled rule set so the first request doesn't pay for it
+        load_rule_set(db)
     finally:
         db.close()
     
+    # Pre-start the workers that evaluate untrusted regex patterns
+    if REGEX_EVAL_MODE == "pool":
+        regex_pool.start()
+    
+    # Follow rule changes made through other worker processes
+    if RULE_SET_POLL_INTERVAL > 0:
+        rule_set_watcher.start()
+    
+    # Periodically roll up per-rule counters into the rule_stats table
+    stats_task = None
+    if RULE_STATS_FLUSH_INTERVAL > 0:
+        stats_task = asyncio.create_task(flush_rule_stats_periodically())
+    
+    # Return expiring credit leases and reclaim those of crashed workers
+    lease_task = None
+    if CREDIT_LEASE_SIZE > 0:
+        lease_task = asyncio.create_task(maintain_credit_leases_periodically())
+    
+    # Fold credit ledger entries into users.credits
+    compaction_task = None
+    if CREDIT_COMPACTION_INTERVAL > 0:
+        compaction_task = asyncio.create_task(compact_credit_ledger_periodically())
+    
+    # Run accepted commands off the request path (EXECUTION_MODE=queued)
+    if execution_queue.queued:
+        execution_queue.start()
+    elif EXECUTOR_BACKEND != "mock":
+        # Inline execution only runs the mock inside the request's transaction
+        raise RuntimeError(f"EXECUTOR_BACKEND={EXECUTOR_BACKEND} requires EXECUTION_MODE=queued")
+    
+    # Delete expired Idempotency-Key responses
+    idempotency_task = None
+    if IDEMPOTENCY_PURGE_INTERVAL > 0:
+        idempotency_task = asyncio.create_task(purge_idempotency_keys_periodically())
+    
     yield
     
-    # Shutdown: cleanup if needed
-    pass
+    # Shutdown: finish queued commands, final stats flush, hand back leased
+    # credits, then stop background workers
+    await execution_queue.stop()
+    rule_set_watcher.stop()
+    if stats_task is not None:
+        stats_task.cancel()
+        await asyncio.to_thread(flush_rule_stats_once)
+    if lease_task is not None:
+        lease_task.cancel()
+        await asyncio.to_thread(release_credit_leases)
+    if compaction_task is not None:
+        compaction_task.cancel()
+    if idempotency_task is not None:
+        idempotency_task.cancel()
+    regex_pool.shutdown()
+    await async_engine.dispose()
+
+
+async def flush_rule_stats_periodically():
+    """Flush rule counters every RULE_STATS_FLUSH_INTERVAL seconds."""
+    while True:
+        await asyncio.sleep(RULE_STATS_FLUSH_INTERVAL)
+        await asyncio.to_thread(flush_rule_stats_once)
+
+
+def flush_rule_stats_once():
+    """Flush rule counters in a fresh session (runs off the event loop)."""
+    db = SessionLocal()
+    try:
+        flush_rule_stats(db)
+    except Exception as e:
+        print(f"Warning: rule stats flush failed: {e}")
+    finally:
+        db.close()
+
+
+async def maintain_credit_leases_periodically():
+    """Return and reclaim credit leases a few times per lease lifetime."""
+    while True:
+        await asyncio.sleep(max(CREDIT_LEASE_TTL / 4, 1.0))
+        await asyncio.to_thread(maintain_credit_leases_once)
+
+
+def maintain_credit_leases_once():
+    """Return this worker's expiring leases and reclaim expired ones (off the event loop)."""
+    db = SessionLocal()
+    try:
+        lease_manager.release_expiring(db)
+        reclaim_expired_leases(db)
+    except Exception as e:
+        db.rollback()
+        print(f"Warning: credit lease maintenance failed: {e}")
+    finally:
+        db.close()
+
+
+async def compact_credit_ledger_periodically():
+    """Compact the credit ledger every CREDIT_COMPACTION_INTERVAL seconds."""
+    while True:
+        await asyncio.sleep(CREDIT_COMPACTION_INTERVAL)
+        await asyncio.to_thread(compact_credit_ledger_once)
+
+
+def compact_credit_ledger_once():
+    """Fold pending ledger entries into balances (off the event loop)."""
+    db = SessionLocal()
+    try:
+        compact_ledger(db)
+    except Exception as e:
+        db.rollback()
+        print(f"Warning: credit ledger compaction failed: {e}")
+    finally:
+        db.close()
+
+
+async def purge_idempotency_keys_periodically():
+    """Purge expired idempotency keys every IDEMPOTENCY_PURGE_INTERVAL seconds."""
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_PURGE_INTERVAL)
+        await asyncio.to_thread(purge_idempotency_keys_once)
+
+
+def purge_idempotency_keys_once():
+    """Delete expired idempotency keys (off the event loop)."""
+    db = SessionLocal()
+    try:
+        purge_expired_idempotency_keys(db)
+    except Exception as e:
+        db.rollback()
+        print(f"Warning: idempotency key purge failed: {e}")
+    finally:
+        db.close()
+
+
+def release_credit_leases():
+    """Hand every lease of this worker back at shutdown."""
+    db = SessionLocal()
+    try:
+        lease_manager.release_all(db)
+    except Exception as e:
+        print(f"Warning: returning credit leases failed: {e}")
+    finally:
+        db.close()
 
 
 app = FastAPI(
@@ -50,6 +210,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets browser clients follow paginated lists
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Include routers
@@ -73,7 +235,7 @@ def health():
 async def websocket_endpoint(websocket):
     """WebSocket endpoint for real-time notifications."""
     from fastapi import WebSocket
-    from app.db import SessionLocal
+    from app.db import AsyncSessionLocal
     
     # Get API key from query parameter or header
     api_key = websocket.query_params.get("api_key") or websocket.headers.get("X-API-KEY")
@@ -82,31 +244,28 @@ async def websocket_endpoint(websocket):
         await websocket.close(code=1008, reason="Missing API key")
         return
     
-    # Authenticate user
-    db = SessionLocal()
+    # Authenticate user (the session only queries on an auth cache miss)
+    async with AsyncSessionLocal() as db:
+        user = await authenticate_async(api_key, db)
+    if not user:
+        await websocket.close(code=1008, reason="Invalid API key")
+        return
+    
+    # Connect WebSocket
+    await ws.connect_websocket(websocket, user.id)
+    
+    # Keep connection alive
     try:
-        user = db.query(User).filter(User.api_key == api_key).first()
-        if not user:
-            await websocket.close(code=1008, reason="Invalid API key")
-            return
-        
-        # Connect WebSocket
-        await ws.connect_websocket(websocket, user.id)
-        
-        # Keep connection alive
-        try:
-            while True:
-                # Wait for messages (client can send ping/pong)
-                data = await websocket.receive_text()
-                # Echo back or handle ping
-                if data == "ping":
-                    await websocket.send_text("pong")
-        except Exception:
-            pass
-        finally:
-            await ws.disconnect_websocket(websocket, user.id)
+        while True:
+            # Wait for messages (client can send ping/pong)
+            data = await websocket.receive_text()
+            # Echo back or handle ping
+            if data == "ping":
+                await websocket.send_text("pong")
+    except Exception:
+        pass
     finally:
-        db.close()
+        await ws.disconnect_websocket(websocket, user.id)
 
 
 def seed_rules(db: Session):
@@ -126,19 +285,14 @@ def seed_rules(db: Session):
             print(f"Warning: {rules_file} not found, skipping rule seeding")
             return
     
-    with open(rules_path, "r") as f:
-        rules_data = json.load(f)
+    rules_data = load_rules_file(rules_path)
     
     for rule_data in rules_data:
-        rule = Rule(
-            priority=rule_data["priority"],
-            pattern=rule_data["pattern"],
-            action=RuleAction(rule_data["action"]),
-            description=rule_data.get("description", "")
-        )
-        db.add(rule)
+        db.add(rule_from_definition(rule_data))
     
+    publish_rule_set_version(db)
     db.commit()
+    invalidate_rule_set()
     print(f"Seeded {len(rules_data)} rules from {rules_file}")
 
 
@@ -161,6 +315,7 @@ def seed_default_admin(db: Session):
     )
     
     db.add(admin_user)
+    record_opening_balance(db, admin_user)
     db.commit()
     print(f"Seeded default admin user: {admin_name}")
 
@@ -3,11 +3,15 @@ import uuid
 from datetime import datetime
 from enum import Enum as PyEnum
 
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, JSON, Enum
+from sqlalchemy import (
+    Column, Integer, BigInteger, Boolean, String, Text, ForeignKey, DateTime, JSON, Enum, Index,
+    UniqueConstraint
+)
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 
 from app.db import Base
+from app.security import api_key_fingerprint
 
 
 class UserRole(PyEnum):
@@ -21,6 +25,8 @@ class ActionTaken(PyEnum):
     ACCEPTED = "ACCEPTED"
     REJECTED = "REJECTED"
     PENDING = "PENDING"
+    # Accepted and paid for, waiting for the execution queue (EXECUTION_MODE=queued)
+    QUEUED = "QUEUED"
 
 
 class RuleAction(PyEnum):
@@ -36,8 +42,11 @@ class User(Base):
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = Column(String(255), nullable=False)
-    api_key = Column(String(255), unique=True, nullable=False, index=True)
+    # Public part of the API key (what lookups go by) and a hash of the secret part
+    api_key_id = Column(String(64), unique=True, nullable=False, index=True)
+    api_key_hash = Column(String(64), nullable=False)
     role = Column(Enum(UserRole), nullable=False, default=UserRole.MEMBER)
+    # Balance as of the last ledger compaction (see CreditLedger)
     credits = Column(Integer, nullable=False, default=100)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -45,6 +54,17 @@ class User(Base):
     commands = relationship("Command", back_populates="user")
     audit_logs = relationship("AuditLog", back_populates="actor_user")
 
+    @property
+    def api_key(self):
+        """Plaintext API key, known only on the instance it was assigned to."""
+        return getattr(self, "_api_key", None)
+
+    @api_key.setter
+    def api_key(self, value: str):
+        """Store the key id and secret hash for a plaintext API key."""
+        self.api_key_id, self.api_key_hash = api_key_fingerprint(value)
+        self._api_key = value
+
 
 class Rule(Base):
     """Rule model."""
@@ -77,6 +97,11 @@ class Command(Base):
     user = relationship("User", back_populates="commands")
     matched_rule = relationship("Rule", back_populates="commands")
 
+    __table_args__ = (
+        # Keyset pagination of a user's history (GET /commands)
+        Index("ix_commands_user_created_id", "user_id", "created_at", "id"),
+    )
+
 
 class AuditLog(Base):
     """Audit log model."""
@@ -90,3 +115,79 @@ class AuditLog(Base):
 
     actor_user = relationship("User", back_populates="audit_logs")
 
+    __table_args__ = (
+        # Keyset pagination of the audit log (GET /admin/audit-logs)
+        Index("ix_audit_logs_created_id", "created_at", "id"),
+    )
+
+
+
+class RuleSetVersion(Base):
+    """Single-row stamp bumped with every rule change, so all workers can tell when to reload."""
+    __tablename__ = "rule_set_version"
+
+    id = Column(Integer, primary_key=True, default=1)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class RuleStat(Base):
+    """Hourly rollup of per-rule evaluation counters and sampled match latency."""
+    __tablename__ = "rule_stats"
+    __table_args__ = (UniqueConstraint("rule_id", "bucket_start", name="uq_rule_stats_rule_bucket"),)
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    rule_id = Column(UUID(as_uuid=True), ForeignKey("rules.id", ondelete="CASCADE"), nullable=False, index=True)
+    bucket_start = Column(DateTime, nullable=False, index=True)
+    evaluated = Column(BigInteger, nullable=False, default=0)
+    matched = Column(BigInteger, nullable=False, default=0)
+    timed_samples = Column(Integer, nullable=False, default=0)
+    # Counts per latency bucket (see app.agent.rule_stats.LATENCY_BUCKETS_US)
+    latency_histogram = Column(JSON, nullable=False, default=list)
+
+
+class CreditLease(Base):
+    """Block of a user's credits reserved by one worker process."""
+    __tablename__ = "credit_leases"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    worker_id = Column(String(255), nullable=False)
+    # Credits moved out of users.credits into this lease, and how many of them are spent
+    reserved = Column(Integer, nullable=False)
+    spent = Column(Integer, nullable=False, default=0)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class CreditLedger(Base):
+    """
+    Signed credit movement for a user.
+
+    Entries are only ever inserted; compaction folds them into users.credits
+    and flips compacted, so a balance is users.credits plus the user's
+    uncompacted entries.
+    """
+    __tablename__ = "credit_ledger"
+    __table_args__ = (Index("ix_credit_ledger_user_pending", "user_id", "compacted"),)
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    delta = Column(Integer, nullable=False)
+    # opening, command, admin_set, lease, lease_return
+    reason = Column(String(32), nullable=False)
+    compacted = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+class IdempotencyKey(Base):
+    """Response remembered for a client-supplied Idempotency-Key."""
+    __tablename__ = "idempotency_keys"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    # SHA-256 of the endpoint and request body the key was first used with
+    request_hash = Column(String(64), nullable=False)
+    response = Column(JSON, nullable=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
@@ -1,5 +1,5 @@
 """WebSocket notification manager."""
-from typing import Dict, Set
+from typing import Dict, List, Set
 from uuid import UUID
 from fastapi import WebSocket
 
@@ -64,11 +64,25 @@ async def send_to_admins(message: dict, db):
     
     Args:
         message: Dictionary to send as JSON
-        db: Database session
+        db: Async database session
     """
+    await send_many_to_admins([message], db)
+
+
+async def send_many_to_admins(messages: List[dict], db):
+    """
+    Send several messages to all admin users, looking the admins up once.
+    
+    Args:
+        messages: Dictionaries to send as JSON, in order
+        db: Async database session
+    """
+    from sqlalchemy import select
     from app.models import User, UserRole
     
-    admins = db.query(User).filter(User.role == UserRole.ADMIN).all()
-    for admin in admins:
-        await send_to_user(admin.id, message)
-
+    if not messages:
+        return
+    admin_ids = (await db.execute(select(User.id).where(User.role == UserRole.ADMIN))).scalars().all()
+    for message in messages:
+        for admin_id in admin_ids:
+            await send_to_user(admin_id, message)
@@ -1,6 +1,6 @@
 """Pydantic schemas for request/response validation."""
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from uuid import UUID
 
 from pydantic import BaseModel, Field
@@ -50,6 +50,26 @@ class CommandResponse(BaseModel):
     command_id: Optional[UUID] = None
 
 
+class CommandBatchRequest(BaseModel):
+    """Schema for submitting several commands at once."""
+    commands: List[CommandRequest] = Field(..., min_length=1)
+    # partial: execute as many accepted commands as credits cover, in order
+    # all_or_nothing: execute none unless credits cover all of them
+    mode: str = Field("partial", pattern="^(partial|all_or_nothing)$")
+
+
+class CommandBatchResponse(BaseModel):
+    """Schema for batch command results (one per submitted command, in order)."""
+    mode: str
+    results: List[CommandResponse]
+    executed: int
+    rejected: int
+    pending: int
+    queued: int = 0
+    cost: int
+    new_balance: Optional[int] = None
+
+
 class CommandDetailResponse(BaseModel):
     """Schema for detailed command response."""
     id: UUID
@@ -66,6 +86,20 @@ class CommandDetailResponse(BaseModel):
         from_attributes = True
 
 
+class ExecutionQueueStatsResponse(BaseModel):
+    """Schema for this worker's execution queue (queued execution mode)."""
+    mode: str
+    workers: int
+    capacity: int
+    depth: int
+    running: int
+    completed: int
+    failed: int
+    wait_p50_ms: Optional[float] = None
+    wait_p99_ms: Optional[float] = None
+    wait_max_ms: Optional[float] = None
+
+
 # Rule schemas
 class RuleCreate(BaseModel):
     """Schema for creating a rule."""
@@ -96,6 +130,116 @@ class RuleResponse(BaseModel):
         from_attributes = True
 
 
+class RuleBulkResponse(BaseModel):
+    """Schema for bulk rule import results."""
+    mode: str
+    created: int
+    updated: int
+    unchanged: int
+    deleted: int
+    version: int
+
+
+class RuleDiffUpdate(RuleUpdate):
+    """Schema for a rule change inside a rule diff."""
+    id: UUID
+
+
+class RuleDiff(BaseModel):
+    """Schema for a set of changes against the current rules."""
+    create: List[RuleCreate] = Field(default_factory=list)
+    update: List[RuleDiffUpdate] = Field(default_factory=list)
+    delete: List[UUID] = Field(default_factory=list)
+
+
+class RuleSimulationRequest(BaseModel):
+    """Schema for simulating a candidate rule set (give exactly one of rules or diff)."""
+    rules: Optional[List[RuleCreate]] = None
+    diff: Optional[RuleDiff] = None
+    limit: int = Field(10000, ge=1, le=1000000)
+
+
+class RuleFlip(BaseModel):
+    """Schema for commands whose decision would change from one action to another."""
+    old_action: str
+    new_action: str
+    count: int
+
+
+class RuleSimulationResponse(BaseModel):
+    """Schema for rule simulation results."""
+    replayed: int
+    distinct_commands: int
+    changed: int
+    timed_out: int
+    flips: List[RuleFlip]
+    elapsed_ms: float
+
+
+class RuleStatsEntry(BaseModel):
+    """Schema for one rule's counters and sampled latency."""
+    rule_id: UUID
+    priority: int
+    pattern: str
+    action: str
+    evaluated: int
+    matched: int
+    timed_samples: int
+    latency_histogram: List[int]
+    p50_us: Optional[float] = None
+    p99_us: Optional[float] = None
+
+
+class RuleStatsResponse(BaseModel):
+    """Schema for rule statistics."""
+    since: Optional[datetime] = None
+    latency_buckets_us: List[float]
+    rules: List[RuleStatsEntry]
+    decision_cache: Dict[str, int]
+
+
+class RuleAnalysisEntry(BaseModel):
+    """Schema for one rule's reachability verdict."""
+    rule_id: UUID
+    priority: int
+    pattern: str
+    action: str
+    status: str
+    first_matches: int
+    history_first_matches: int
+    samples: int
+    shadowed_by: List[UUID]
+    replaced_by: List[UUID]
+
+
+class RuleAnalysisResponse(BaseModel):
+    """Schema for dead, shadowed and redundant rule analysis."""
+    history_commands: int
+    generated_samples: int
+    rules: List[RuleAnalysisEntry]
+    removable: List[UUID]
+
+
+# Credit schemas
+class CreditReconciliationEntry(BaseModel):
+    """Schema for one user's balance checked against the credit ledger."""
+    user_id: UUID
+    name: str
+    materialized: int
+    compacted_total: int
+    pending: int
+    leased: int
+    balance: int
+    drift: int
+
+
+class CreditReconciliationResponse(BaseModel):
+    """Schema for the credit ledger reconciliation report."""
+    users: List[CreditReconciliationEntry]
+    pending_entries: int
+    drifted: int
+
+
 # Audit log schemas
 class AuditLogResponse(BaseModel):
     """Schema for audit log response."""
@@ -0,0 +1,138 @@
+"""API key issuing and verification."""
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+from typing import NamedTuple
+
+# Server-side key for API key hashes; changing it invalidates every stored key
+API_SECRET = os.getenv("API_SECRET", "")
+
+# Deployment environment; only these may run with an empty API_SECRET
+APP_ENV = os.getenv("APP_ENV", "production")
+INSECURE_ENVS = ("development", "test")
+
+# Public prefix of keys issued by create_user
+API_KEY_PREFIX = "usr"
+
+
+class ApiKeyParts(NamedTuple):
+    """An API key split into its public id and its secret."""
+    key_id: str
+    secret: str
+
+
+def generate_api_key(prefix: str = API_KEY_PREFIX) -> str:
+    """
+    Issue a new API key of the form <prefix>_<key id>.<secret>.
+
+    Args:
+        prefix: Public prefix identifying the kind of key
+
+    Returns:
+        The plaintext API key (to be shown once and never stored)
+    """
+    return f"{prefix}_{secrets.token_hex(8)}.{secrets.token_urlsafe(32)}"
+
+
+def parse_api_key(api_key: str) -> ApiKeyParts:
+    """
+    Split an API key into the id it is looked up by and the secret to verify.
+
+    Keys issued as <key id>.<secret> split on the dot. Anything else is a
+    legacy key (such as a seeded ADMIN_DEFAULT_API_KEY): its id is derived
+    from the whole key, which is also the secret.
+
+    Args:
+        api_key: Plaintext API key as presented by a client
+
+    Returns:
+        ApiKeyParts
+    """
+    key_id, dot, secret = api_key.partition(".")
+    if dot and key_id and secret and "." not in secret:
+        return ApiKeyParts(key_id, secret)
+    return ApiKeyParts("legacy_" + _digest(b"key-id", api_key)[:32], api_key)
+
+
+def hash_api_key_secret(secret: str) -> str:
+    """
+    Hash the secret part of an API key for storage.
+
+    Keys are random with well over 128 bits of entropy, so a keyed
+    HMAC-SHA256 is enough; a deliberately slow password hash would add
+    milliseconds to every cache miss for no gain.
+
+    Args:
+        secret: Secret part of an API key
+
+    Returns:
+        Hex digest
+    """
+    return _digest(b"secret", secret)
+
+
+def api_key_fingerprint(api_key: str) -> ApiKeyParts:
+    """
+    Compute what is stored for an API key.
+
+    Args:
+        api_key: Plaintext API key
+
+    Returns:
+        ApiKeyParts with the key id and the hash of the secret (in place of the secret)
+    """
+    key_id, secret = parse_api_key(api_key)
+    return ApiKeyParts(key_id, hash_api_key_secret(secret))
+
+
+def verify_api_key_secret(secret: str, key_hash: str) -> bool:
+    """
+    Check a presented secret against a stored hash in constant time.
+
+    Args:
+        secret: Secret part of the presented API key
+        key_hash: Stored hash
+
+    Returns:
+        True if they match
+    """
+    return hmac.compare_digest(hash_api_key_secret(secret), key_hash)
+
+
+def check_api_secret():
+    """
+    Refuse to run without an API_SECRET outside development and test.
+
+    With an empty secret, key hashes are HMACs under a public key, so a
+    leaked table can be attacked offline; dev and test only get a warning.
+
+    Raises:
+        RuntimeError: If API_SECRET is unset and APP_ENV is not a dev/test one
+    """
+    if API_SECRET:
+        return
+    if APP_ENV not in INSECURE_ENVS:
+        raise RuntimeError(
+            f"API_SECRET must be set when APP_ENV={APP_ENV!r} "
+            f"(use APP_ENV={INSECURE_ENVS[0]!r} to run without one)"
+        )
+    logging.getLogger(__name__).warning(
+        "API_SECRET is not set: API key hashes use an empty HMAC key (APP_ENV=%s only)", APP_ENV
+    )
+
+
+# HMAC states already keyed with API_SECRET and fed the purpose, copied per
+# hash so the key schedule is not redone on every call
+_keyed = {
+    purpose: hmac.new(API_SECRET.encode(), purpose + b":", hashlib.sha256)
+    for purpose in (b"key-id", b"secret")
+}
+
+
+def _digest(purpose: bytes, value: str) -> str:
+    """HMAC-SHA256 of a value under API_SECRET, separated by purpose."""
+    mac = _keyed[purpose].copy()
+    mac.update(value.encode())
+    return mac.hexdigest()
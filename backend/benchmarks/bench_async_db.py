@@ -0,0 +1,144 @@
+"""Benchmark POST /commands throughput and event-loop stalls in one worker.
+
+"blocking" replays the previous handler: an async endpoint running the
+same decision code on a sync session, so every query blocks the event
+loop. "async" is the current endpoint on the async engine. Both run in one
+process through the ASGI app. Alongside the load, a probe sleeps 1 ms at a
+time and records how late it wakes up. That lag is what every WebSocket
+and request on the worker waits on top of its own work.
+
+On SQLite a query is a few microseconds of local file access, so the sync
+path has little to lose and aiosqlite's thread hop can cost throughput.
+Point DATABASE_URL at Postgres to see the effect of network round trips.
+
+Usage (from the backend directory, against the database in DATABASE_URL):
+    python benchmarks/bench_async_db.py
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Measure the database path, not the rate limiter or background tasks
+for name in ("COMMAND_RATE_LIMIT_MEMBER", "COMMAND_RATE_LIMIT_ADMIN", "COMMAND_RATE_LIMIT_GLOBAL"):
+    os.environ[name] = "0"
+
+import httpx  # noqa: E402
+from fastapi import Depends  # noqa: E402
+
+from app.db import Base, SessionLocal, async_engine, engine  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models import Rule, RuleAction, User, UserRole  # noqa: E402
+from app.schemas import CommandRequest, CommandResponse  # noqa: E402
+from app.agent.command_parser import parse_command  # noqa: E402
+from app.agent.credits import record_opening_balance  # noqa: E402
+from app.agent.rule_engine import invalidate_rule_set, match_rule  # noqa: E402
+from app.api.auth import AuthenticatedUser  # noqa: E402
+from app.api.commands import _process_command  # noqa: E402
+from app.api.rate_limit import rate_limited_user  # noqa: E402
+
+CONCURRENCY = [1, 16, 64]
+REQUESTS = 600
+API_KEY = "bench_async_key"
+
+
+@app.post("/bench/blocking", response_model=CommandResponse)
+async def submit_command_blocking(
+    request: CommandRequest,
+    current_user: AuthenticatedUser = Depends(rate_limited_user)
+):
+    """The previous handler: sync session work directly on the event loop."""
+    db = SessionLocal()
+    try:
+        parsed = parse_command(request.command_text)
+        response, _, _ = _process_command(db, current_user, parsed, match_rule(parsed, db))
+        db.commit()
+    finally:
+        db.close()
+    return response
+
+
+def seed():
+    """One user with plenty of credits and one rule accepting the benchmark command."""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.name == "bench_async").first()
+        if user is None:
+            user = User(name="bench_async", api_key=API_KEY, role=UserRole.MEMBER, credits=10 ** 9)
+            db.add(user)
+            record_opening_balance(db, user)
+        if db.query(Rule).filter(Rule.pattern == "^echo bench").first() is None:
+            db.add(Rule(priority=0, pattern="^echo bench", action=RuleAction.AUTO_ACCEPT))
+        db.commit()
+    finally:
+        db.close()
+    invalidate_rule_set()
+
+
+async def run(path: str, concurrency: int) -> dict:
+    """Send REQUESTS commands from concurrency tasks while probing loop lag."""
+    transport = httpx.ASGITransport(app=app)
+    latencies = []
+    lags = []
+    stop = asyncio.Event()
+
+    async def probe():
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - started - 0.001)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker(count: int):
+            for i in range(count):
+                started = time.perf_counter()
+                response = await client.post(
+                    path, json={"command_text": f"echo bench {i}"}, headers={"X-API-KEY": API_KEY}
+                )
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        # Warm the auth cache, rule set and connection pool
+        await worker(5)
+        latencies.clear()
+
+        prober = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(REQUESTS // concurrency) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await prober
+
+    latencies.sort()
+    lags.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "lag_p99_ms": lags[int(len(lags) * 0.99) - 1] * 1000 if lags else 0.0,
+        "lag_max_ms": lags[-1] * 1000 if lags else 0.0,
+    }
+
+
+async def main():
+    seed()
+    print(f"database: {engine.dialect.name}")
+    print(f"{'tasks':>5} {'handler':>9} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'lag p99':>8} {'lag max':>8}")
+    for concurrency in CONCURRENCY:
+        for name, path in (("blocking", "/bench/blocking"), ("async", "/commands")):
+            result = await run(path, concurrency)
+            print(
+                f"{concurrency:>5} {name:>9} {result['rps']:>8.0f} {result['p50_ms']:>8.2f} "
+                f"{result['p99_ms']:>8.2f} {result['lag_p99_ms']:>8.2f} {result['lag_max_ms']:>8.2f}",
+                flush=True
+            )
+    # Pooled aiosqlite connections own non-daemon threads
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
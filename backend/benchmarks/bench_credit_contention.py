@@ -0,0 +1,164 @@
+"""Benchmark credit deduction when many workers hit the same user row.
+
+Compares the earlier SELECT ... FOR UPDATE read-modify-write and the
+conditional UPDATE of users.credits with the ledger INSERT ... SELECT in
+deduct_credit. The ledger debit is also run inside a transaction that
+does BENCH_TRANSACTION_WORK_MS of other work, once debiting first and once
+debiting last (as command submission does): the user's other debits wait
+from the debit to the commit, so only the first order makes them wait for
+the work. Each run gives one user half
+the credits the threads will try to spend, and checks that no deduction was
+lost or double-spent: the balance must drop by exactly the number of
+successful deductions, and every attempt that did not error must succeed
+until the credits run out. (SQLite ignores FOR UPDATE, so the old method
+loses updates there; lock timeouts under heavy contention count as errors.)
+
+Usage (from the backend directory, against the database in DATABASE_URL):
+    python benchmarks/bench_credit_contention.py
+"""
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, update  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from app.db import Base, SessionLocal, engine  # noqa: E402
+from app.models import User, UserRole  # noqa: E402
+from app.agent.credits import deduct_credit, get_credit_balance  # noqa: E402
+
+THREAD_COUNTS = [1, 4, 16]
+ATTEMPTS_PER_THREAD = 200
+# Other work done in each transaction by the debit_first/debit_last methods
+TRANSACTION_WORK = float(os.getenv("BENCH_TRANSACTION_WORK_MS", "2")) / 1000
+
+
+def deduct_select_for_update(db, user_id, amount=1):
+    """The original implementation: lock the row, check and decrement in Python."""
+    user = db.execute(select(User).where(User.id == user_id).with_for_update()).scalar_one_or_none()
+    if not user or user.credits < amount:
+        return False, None
+    user.credits -= amount
+    db.flush()
+    return True, user.credits
+
+
+def deduct_conditional_update(db, user_id, amount=1):
+    """The previous implementation: one conditional UPDATE of the users row."""
+    result = db.execute(
+        update(User)
+        .where(User.id == user_id, User.credits >= amount)
+        .values(credits=User.credits - amount)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1, None
+
+
+def deduct_debit_first(db, user_id, amount=1):
+    """Debit, then the rest of the transaction: the user's lock is held through it."""
+    result = deduct_credit(db, user_id, amount)
+    time.sleep(TRANSACTION_WORK)
+    return result
+
+
+def deduct_debit_last(db, user_id, amount=1):
+    """The rest of the transaction, then the debit right before the commit."""
+    time.sleep(TRANSACTION_WORK)
+    return deduct_credit(db, user_id, amount)
+
+
+def run(deduct, threads: int) -> dict:
+    """Hammer one user from several threads, one transaction per deduction."""
+    attempts = threads * ATTEMPTS_PER_THREAD
+    credits = attempts // 2
+    db = SessionLocal()
+    user = User(name="bench", api_key=f"bench_{time.time_ns()}", role=UserRole.MEMBER, credits=credits)
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+
+    latencies = []
+    successes = []
+    errors = []
+    lock = threading.Lock()
+    start_gate = threading.Barrier(threads)
+
+    def worker():
+        session = SessionLocal()
+        local_latencies = []
+        local_successes = 0
+        local_errors = 0
+        start_gate.wait()
+        try:
+            for _ in range(ATTEMPTS_PER_THREAD):
+                started = time.perf_counter()
+                try:
+                    success, _ = deduct(session, user_id, 1)
+                    session.commit()
+                except OperationalError:
+                    session.rollback()
+                    local_errors += 1
+                    continue
+                local_latencies.append(time.perf_counter() - started)
+                local_successes += success
+        finally:
+            session.close()
+        with lock:
+            latencies.extend(local_latencies)
+            successes.append(local_successes)
+            errors.append(local_errors)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    db = SessionLocal()
+    try:
+        final = get_credit_balance(db, user_id)
+        db.query(User).filter(User.id == user_id).delete()
+        db.commit()
+    finally:
+        db.close()
+
+    latencies.sort()
+    succeeded = sum(successes)
+    completed = attempts - sum(errors)
+    return {
+        "ops_per_sec": completed / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "errors": sum(errors),
+        "correct": final == credits - succeeded and succeeded == min(credits, completed),
+    }
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    print(f"database: {engine.dialect.name}")
+    print(f"{'threads':>7} {'method':>20} {'ops/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'correct':>8}")
+    for threads in THREAD_COUNTS:
+        for name, deduct in (
+            ("select_for_update", deduct_select_for_update),
+            ("conditional_update", deduct_conditional_update),
+            ("ledger_insert", deduct_credit),
+            ("debit_first", deduct_debit_first),
+            ("debit_last", deduct_debit_last),
+        ):
+            result = run(deduct, threads)
+            print(
+                f"{threads:>7} {name:>20} {result['ops_per_sec']:>9.0f} {result['p50_ms']:>8.3f} "
+                f"{result['p99_ms']:>8.3f} {result['errors']:>7} {'yes' if result['correct'] else 'NO':>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
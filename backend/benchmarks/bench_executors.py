@@ -0,0 +1,73 @@
+"""Benchmark command throughput of the executor backends.
+
+Each backend runs the same commands from a number of concurrent tasks,
+the way the execution queue's workers call it, with output streamed to a
+no-op callback. The mock returns canned output; the subprocess backend
+pays for a fork/exec, rlimits and a fresh working directory per command.
+
+Usage (from the backend directory):
+    python benchmarks/bench_executors.py
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.agent.command_parser import parse_command  # noqa: E402
+from app.agent.executor import get_executor  # noqa: E402
+
+BACKENDS = ["mock", "subprocess"]
+CONCURRENCY = [1, 4, 16]
+COMMANDS = [parse_command(text) for text in ["echo bench", "ls -la", "pwd", "cat /etc/hostname"]]
+REQUESTS = 400
+
+
+async def discard(stream: str, text: str):
+    """Output callback standing in for the WebSocket."""
+
+
+async def run(backend: str, concurrency: int) -> dict:
+    """Run REQUESTS commands on a backend from concurrency tasks."""
+    execute = get_executor(backend)
+    latencies = []
+
+    async def worker(count: int):
+        for i in range(count):
+            started = time.perf_counter()
+            result = await execute(COMMANDS[i % len(COMMANDS)], discard)
+            assert result["exit_code"] == 0, result
+            latencies.append(time.perf_counter() - started)
+
+    # Warm up (imports, sandbox directory)
+    await worker(4)
+    latencies.clear()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(REQUESTS // concurrency) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main():
+    print(f"{'tasks':>5} {'backend':>10} {'cmd/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for concurrency in CONCURRENCY:
+        for backend in BACKENDS:
+            result = await run(backend, concurrency)
+            print(
+                f"{concurrency:>5} {backend:>10} {result['rps']:>9.0f} "
+                f"{result['p50_ms']:>8.3f} {result['p99_ms']:>8.3f}",
+                flush=True
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
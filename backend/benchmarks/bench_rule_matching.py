@@ -0,0 +1,78 @@
+"""Benchmark rule matching latency as the rule set grows.
+
+Usage (from the backend directory):
+    python benchmarks/bench_rule_matching.py
+"""
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.agent.matcher import RuleMatcher, match_sequential  # noqa: E402
+
+RULE_COUNTS = [10, 100, 1000, 5000]
+ITERATIONS = 200
+
+COMMANDS = [
+    "git status",
+    "ls -la /var/log",
+    "some_random_command_xyz --flag value",
+    "python manage.py migrate --noinput",
+]
+
+
+def _word(rng: random.Random) -> str:
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 9)))
+
+
+def build_patterns(count: int, seed: int = 42) -> list:
+    """Build a realistic mix of allow-list commands and deny-list fragments."""
+    rng = random.Random(seed)
+    patterns = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            patterns.append(rf"^{_word(rng)}\s+(start|stop|status)\b")
+        elif kind == 1:
+            patterns.append(rf"^{_word(rng)}(\s|$)")
+        elif kind == 2:
+            patterns.append(rf"{_word(rng)}\.{_word(rng)}")
+        else:
+            patterns.append(rf"--{_word(rng)}=\S+")
+    # Keep the seeded rules at the end so real commands have something to hit
+    patterns += [r"git\s+(status|log|diff)", r"^(ls|cat|pwd|echo)"]
+    return [re.compile(p, re.IGNORECASE) for p in patterns]
+
+
+def time_per_match(fn, commands) -> float:
+    """Average microseconds per match call."""
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        for command in commands:
+            fn(command)
+    return (time.perf_counter() - start) / (ITERATIONS * len(commands)) * 1e6
+
+
+def main():
+    print(f"{'rules':>6} {'sequential us':>14} {'matcher us':>12} {'speedup':>8}")
+    baseline = None
+    for count in RULE_COUNTS:
+        patterns = build_patterns(count)
+        matcher = RuleMatcher(patterns)
+        for command in COMMANDS:
+            assert matcher.first_match(command) == match_sequential(patterns, command)
+
+        sequential = time_per_match(lambda c: match_sequential(patterns, c), COMMANDS)
+        combined = time_per_match(matcher.first_match, COMMANDS)
+        baseline = baseline or (count, combined)
+        print(f"{count:>6} {sequential:>14.1f} {combined:>12.1f} {sequential / combined:>7.1f}x")
+
+    growth = combined / baseline[1]
+    print(f"\nmatcher latency grew {growth:.1f}x for {count // baseline[0]}x more rules")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,18 @@
 import os
 import pytest
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from fastapi.testclient import TestClient
 
-from app.db import Base, get_db
+from app.db import Base, get_db, get_async_db
 from app.main import app
 from app.models import User, Rule, UserRole, RuleAction
+from app.agent.rule_engine import invalidate_rule_set, rule_stats
+from app.api.auth import auth_cache
+from app.api.idempotency import idempotency_cache
+from app.api.rate_limit import limiter
 
 # Use in-memory SQLite for testing
 TEST_DATABASE_URL = "sqlite:///./test.db"
@@ -15,11 +21,23 @@ TEST_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(TEST_DATABASE_URL, connect_args={"check_same_thread": False})
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# The async endpoints reach the same file; no pooling, as each test client runs its own event loop
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 
 @pytest.fixture(scope="function")
 def db():
     """Create a fresh database for each test."""
     Base.metadata.create_all(bind=engine)
+    # Rules and users are seeded straight into the tables, so drop any
+    # compiled rule set, rule counters, cached API keys, idempotent
+    # responses and rate-limit buckets left over from a previous test
+    invalidate_rule_set()
+    rule_stats.clear()
+    auth_cache.clear()
+    idempotency_cache.clear()
+    limiter.clear()
     db = TestingSessionLocal()
     try:
         yield db
@@ -37,7 +55,12 @@ def client(db):
         finally:
             pass
     
+    async def override_get_async_db():
+        async with TestingAsyncSessionLocal() as session:
+            yield session
+    
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
     client = TestClient(app)
     yield client
     app.dependency_overrides.clear()
@@ -19,6 +19,26 @@ def test_create_user(client, admin_user):
     assert data["api_key"].startswith("usr_")
 
 
+def test_issued_api_key_is_stored_hashed(client, db, admin_user):
+    """Test that issued keys are stored as id + hash and a wrong secret is refused."""
+    response = client.post(
+        "/admin/users",
+        json={"name": "Hashed", "role": "member"},
+        headers={"X-API-KEY": admin_user.api_key}
+    )
+    api_key = response.json()["api_key"]
+    key_id, secret = api_key.split(".")
+    
+    user = db.query(User).filter(User.name == "Hashed").first()
+    assert user.api_key_id == key_id
+    assert secret not in user.api_key_hash
+    
+    response = client.get("/commands", headers={"X-API-KEY": api_key})
+    assert response.status_code == 200
+    response = client.get("/commands", headers={"X-API-KEY": f"{key_id}.wrong"})
+    assert response.status_code == 401
+
+
 def test_create_user_non_admin(client, member_user):
     """Test that non-admin users cannot create users."""
     response = client.post(
@@ -81,6 +101,22 @@ def test_create_rule_invalid_regex(client, admin_user):
     assert "Invalid regex" in response.json()["detail"]
 
 
+def test_create_rule_catastrophic_regex(client, admin_user):
+    """Test that patterns prone to catastrophic backtracking are rejected."""
+    response = client.post(
+        "/admin/rules",
+        json={
+            "priority": 10,
+            "pattern": "^(a+)+$",
+            "action": "AUTO_REJECT"
+        },
+        headers={"X-API-KEY": admin_user.api_key}
+    )
+    
+    assert response.status_code == 400
+    assert "catastrophic backtracking" in response.json()["detail"]
+
+
 def test_update_rule(client, admin_user, seed_rules):
     """Test updating a rule."""
     # Get first rule
@@ -129,3 +165,350 @@ def test_delete_rule(client, admin_user, seed_rules):
     finally:
         db.close()
 
+
+
+def test_rule_change_applies_immediately(client, admin_user, member_user, seed_rules):
+    """Test that a new rule is used by the next command without a restart."""
+    response = client.post(
+        "/commands",
+        json={"command_text": "deploy_xyz"},
+        headers={"X-API-KEY": member_user.api_key}
+    )
+    assert response.json()["status"] == "rejected"
+    
+    response = client.post(
+        "/admin/rules",
+        json={"priority": 0, "pattern": "^deploy_", "action": "AUTO_ACCEPT"},
+        headers={"X-API-KEY": admin_user.api_key}
+    )
+    assert response.status_code == 200
+    
+    response = client.post(
+        "/commands",
+        json={"command_text": "deploy_xyz"},
+        headers={"X-API-KEY": member_user.api_key}
+    )
+    assert response.json()["status"] == "executed"
+
+
+def test_simulate_rule_changes(client, admin_user, member_user, seed_rules):
+    """Test replaying command history against candidate rules without saving them."""
+    for command_text in ["ls -la", "ls -la", "git status"]:
+        client.post(
+            "/commands",
+            json={"command_text": command_text},
+            headers={"X-API-KEY": member_user.api_key}
+        )
+    
+    response = client.post(
+        "/admin/rules/simulate",
+        json={"diff": {"create": [{"priority": 0, "pattern": "^git", "action": "AUTO_ACCEPT"}]}},
+        headers={"X-API-KEY": admin_user.api_key}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["replayed"] == 3
+    assert data["distinct_commands"] == 2
+    assert data["changed"] == 1
+    assert data["flips"] == [{"old_action": "AUTO_REJECT", "new_action": "AUTO_ACCEPT", "count": 1}]
+    
+    response = client.post(
+        "/admin/rules/simulate",
+        json={"rules": [{"priority": 1, "pattern": "^ls", "action": "REQUIRE_APPROVAL"}]},
+        headers={"X-API-KEY": admin_user.api_key}
+    )
+    assert response.status_code == 200
+    assert response.json()["flips"] == [
+        {"old_action": "AUTO_ACCEPT", "new_action": "REQUIRE_APPROVAL", "count": 2},
+        {"old_action": "AUTO_REJECT", "new_action": "NO_MATCH", "count": 1},
+    ]
+    
+    # Nothing was saved
+    response = client.get("/admin/rules", headers={"X-API-KEY": admin_user.api_key})
+    assert len(response.json()) == len(seed_rules)
+
+
+def test_rule_stats(client, admin_user, member_user, seed_rules):
+    """Test per-rule evaluation and match counters."""
+    for command_text in ["ls -la", "ls -la", "rm -rf /", "git status"]:
+        client.post(
+            "/commands",
+            json={"command_text": command_text},
+            headers={"X-API-KEY": member_user.api_key}
+        )
+    
+    response = client.get("/admin/rules/stats", headers={"X-API-KEY": admin_user.api_key})
+    assert response.status_code == 200
+    data = response.json()
+    stats = {entry["pattern"]: entry for entry in data["rules"]}
+    
+    assert [entry["priority"] for entry in data["rules"]] == sorted(rule.priority for rule in seed_rules)
+    assert stats[r"^rm\s+-rf\s+/"]["matched"] == 1
+    assert stats["^ls|^cat|^pwd|^echo"]["matched"] == 2
+    assert stats[".*"]["matched"] == 1
+    # The second "ls -la" comes from the decision cache; "rm -rf /" stops at the first rule
+    assert stats[r"^rm\s+-rf\s+/"]["evaluated"] == 3
+    assert stats[".*"]["evaluated"] == 1
+    assert stats[".*"]["timed_samples"] == 3
+    assert len(stats[".*"]["latency_histogram"]) == len(data["latency_buckets_us"]) + 1
+
+
+def test_rule_analysis(client, admin_user, seed_rules):
+    """Test detection of shadowed and redundant rules."""
+    response = client.post(
+        "/admin/rules",
+        json={"priority": 6, "pattern": "^cat\\b", "action": "REQUIRE_APPROVAL"},
+        headers={"X-API-KEY": admin_user.api_key}
+    )
+    shadowed_id = response.json()["id"]
+    
+    response = client.get("/admin/rules/analysis", headers={"X-API-KEY": admin_user.api_key})
+    assert response.status_code == 200
+    data = response.json()
+    analysis = {entry["pattern"]: entry for entry in data["rules"]}
+    
+    assert analysis["^cat\\b"]["status"] == "shadowed"
+    assert analysis["^cat\\b"]["shadowed_by"] == [str(seed_rules[2].id)]
+    # The catch-all rejects everything the rm -rf / rule rejects
+    assert analysis[r"^rm\s+-rf\s+/"]["status"] == "redundant"
+    assert analysis[r"^rm\s+-rf\s+/"]["replaced_by"] == [str(seed_rules[3].id)]
+    assert analysis["^ls|^cat|^pwd|^echo"]["status"] == "active"
+    assert analysis[".*"]["status"] == "active"
+    assert shadowed_id in data["removable"]
+
+
+def test_bulk_import_and_export_rules(client, admin_user, member_user, seed_rules):
+    """Test replacing the rule set in one request and exporting it back."""
+    rules = [
+        {"priority": 1, "pattern": r"^rm\s+-rf\s+/", "action": "AUTO_REJECT", "description": "Moved"},
+        {"priority": 2, "pattern": "^deploy_", "action": "AUTO_ACCEPT", "description": "Deploys"},
+    ]
+    
+    response = client.post(
+        "/admin/rules/bulk?mode=replace",
+        json=rules,
+        headers={"X-API-KEY": admin_user.api_key}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert (data["created"], data["updated"], data["deleted"]) == (1, 1, 3)
+    
+    response = client.get("/admin/rules/export", headers={"X-API-KEY": admin_user.api_key})
+    assert response.json() == rules
+    
+    # The new rule set is live for the next command
+    response = client.post(
+        "/commands",
+        json={"command_text": "deploy_xyz"},
+        headers={"X-API-KEY": member_user.api_key}
+    )
+    assert response.json()["status"] == "executed"
+
+
+def test_bulk_import_rejects_invalid_patterns(client, admin_user, seed_rules):
+    """Test that one bad pattern rejects the whole import."""
+    response = client.post(
+        "/admin/rules/bulk?mode=upsert",
+        json=[
+            {"priority": 1, "pattern": "^ok", "action": "AUTO_ACCEPT"},
+            {"priority": 2, "pattern": "[invalid regex", "action": "AUTO_ACCEPT"},
+        ],
+        headers={"X-API-KEY": admin_user.api_key}
+    )
+    
+    assert response.status_code == 400
+    assert response.json()["detail"]["errors"][0]["pattern"] == "[invalid regex"
+    response = client.get("/admin/rules/export", headers={"X-API-KEY": admin_user.api_key})
+    assert len(response.json()) == len(seed_rules)
+
+
+def test_rule_change_reaches_other_workers(client, db, admin_user, seed_rules):
+    """Test that rule changes bump the shared version stamp other workers watch."""
+    from sqlalchemy.orm import sessionmaker
+    from app.agent.rule_engine import get_rule_set, publish_rule_set_version, read_rule_set_version
+    from app.agent.rule_sync import RuleSetWatcher
+    
+    response = client.post(
+        "/admin/rules",
+        json={"priority": 0, "pattern": "^deploy_", "action": "AUTO_ACCEPT"},
+        headers={"X-API-KEY": admin_user.api_key}
+    )
+    assert response.status_code == 200
+    
+    version = read_rule_set_version(db)
+    assert version >= 1
+    assert get_rule_set(db).version == version
+    
+    watcher = RuleSetWatcher(db.get_bind(), sessionmaker(bind=db.get_bind()))
+    # Already up to date: nothing to reload
+    assert watcher.check() is False
+    
+    # Another worker changes a rule and publishes
+    db.query(Rule).filter(Rule.pattern == "^deploy_").delete()
+    publish_rule_set_version(db)
+    db.commit()
+    
+    assert watcher.check() is True
+    assert get_rule_set(db).version == version + 1
+    assert "^deploy_" not in [rule.pattern.pattern for rule in get_rule_set(db).rules]
+
+
+def test_watcher_rebuild_does_not_stall_async_lookups(client, db, seed_rules, monkeypatch):
+    """Test that requests keep the current rules while the watcher rebuilds, without rebuilding themselves."""
+    import asyncio
+    import threading
+    from sqlalchemy.orm import sessionmaker
+    from app.agent import rule_engine
+    from app.agent.rule_sync import RuleSetWatcher
+    from tests.conftest import TestingAsyncSessionLocal
+    
+    current = rule_engine.get_rule_set(db)
+    rule_engine.publish_rule_set_version(db)
+    db.commit()
+    
+    compiling = threading.Event()
+    release = threading.Event()
+    compile_rules = rule_engine.compile_rules
+    
+    def slow_compile(rules, version=0):
+        compiling.set()
+        release.wait(10)
+        return compile_rules(rules, version)
+    
+    monkeypatch.setattr(rule_engine, "compile_rules", slow_compile)
+    watcher = RuleSetWatcher(db.get_bind(), sessionmaker(bind=db.get_bind()))
+    rebuild = threading.Thread(target=watcher.check)
+    rebuild.start()
+    try:
+        assert compiling.wait(5)
+        
+        async def lookup():
+            async with TestingAsyncSessionLocal() as session:
+                return await asyncio.wait_for(rule_engine.get_rule_set_async(session), 2)
+        
+        # The stale-looking window is closed: the old snapshot is served at once
+        assert asyncio.run(lookup()) is current
+    finally:
+        release.set()
+        rebuild.join(10)
+    assert rule_engine.get_rule_set(db).version == current.version + 1
+
+
+def test_auth_cache_negative_entries_and_invalidation(client, db, admin_user):
+    """Test that unknown keys are cached briefly and user changes drop cached keys."""
+    from app.api.auth import auth_cache
+    
+    response = client.get("/commands", headers={"X-API-KEY": "late_key"})
+    assert response.status_code == 401
+    
+    # The key is now valid, but still remembered as unknown in this process
+    user = User(name="Late", api_key="late_key", role=UserRole.MEMBER, credits=5)
+    db.add(user)
+    db.commit()
+    response = client.get("/commands", headers={"X-API-KEY": "late_key"})
+    assert response.status_code == 401
+    
+    auth_cache.forget_key("late_key")
+    response = client.get("/commands", headers={"X-API-KEY": "late_key"})
+    assert response.status_code == 200
+    assert auth_cache.get("late_key").id == user.id
+    
+    # An admin change drops the user's cached keys
+    response = client.put(
+        f"/admin/users/{user.id}",
+        json={"credits": 50},
+        headers={"X-API-KEY": admin_user.api_key}
+    )
+    assert response.status_code == 200
+    assert auth_cache.get("late_key") is auth_cache.MISSING
+
+
+def test_credit_ledger_compaction_and_reconciliation(client, db, admin_user, member_user, seed_rules):
+    """Test that spends are ledger entries until compacted and balances reconcile."""
+    from app.models import CreditLedger
+    from app.agent.credits import compact_ledger, get_credit_balance
+    
+    for _ in range(3):
+        client.post(
+            "/commands",
+            json={"command_text": "ls"},
+            headers={"X-API-KEY": member_user.api_key}
+        )
+    response = client.put(
+        f"/admin/users/{member_user.id}",
+        json={"credits": 40},
+        headers={"X-API-KEY": admin_user.api_key}
+    )
+    assert response.json()["credits"] == 40
+    
+    # users.credits is untouched until compaction; balances include pending entries
+    db.expire_all()
+    assert db.query(User.credits).filter(User.id == member_user.id).scalar() == 100
+    assert get_credit_balance(db, member_user.id) == 40
+    response = client.get("/admin/credits/reconciliation", headers={"X-API-KEY": admin_user.api_key})
+    report = {entry["user_id"]: entry for entry in response.json()["users"]}
+    assert response.json()["pending_entries"] == 4
+    assert report[str(member_user.id)]["pending"] == -60
+    assert report[str(member_user.id)]["balance"] == 40
+    
+    assert compact_ledger(db) == 4
+    assert compact_ledger(db) == 0
+    db.expire_all()
+    assert db.query(User.credits).filter(User.id == member_user.id).scalar() == 40
+    assert get_credit_balance(db, member_user.id) == 40
+    
+    # A user created through the API reconciles exactly (fixture users have no opening entry)
+    created = client.post(
+        "/admin/users",
+        json={"name": "Ledgered", "role": "member"},
+        headers={"X-API-KEY": admin_user.api_key}
+    ).json()
+    response = client.get("/admin/credits/reconciliation", headers={"X-API-KEY": admin_user.api_key})
+    report = {entry["user_id"]: entry for entry in response.json()["users"]}
+    assert report[created["id"]]["drift"] == 0
+    assert report[created["id"]]["balance"] == 100
+    assert response.json()["pending_entries"] == 0
+    assert db.query(CreditLedger).filter(CreditLedger.reason == "command").count() == 3
+
+
+def test_export_commands_and_audit_logs(client, admin_user, member_user, seed_rules):
+    """Test streaming exports in NDJSON, CSV and gzip with filters."""
+    import csv
+    import gzip
+    import io
+    import json
+    from datetime import datetime
+    for text in ["ls", "rm -rf /", "pwd"]:
+        client.post("/commands", json={"command_text": text}, headers={"X-API-KEY": member_user.api_key})
+    headers = {"X-API-KEY": admin_user.api_key}
+    
+    response = client.get("/admin/export/commands", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["command_text"] for row in rows] == ["ls", "rm -rf /", "pwd"]
+    assert rows[0]["action_taken"] == "ACCEPTED"
+    assert rows[0]["result"]["exit_code"] == 0
+    
+    response = client.get(
+        "/admin/export/commands", params={"format": "csv", "action": "REJECTED"}, headers=headers
+    )
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["command_text"] for row in rows] == ["rm -rf /"]
+    assert rows[0]["result"] == ""
+    
+    response = client.get(
+        "/admin/export/audit-logs", params={"gzip": "true", "event_type": "COMMAND_EXECUTED"}, headers=headers
+    )
+    assert response.headers["content-disposition"] == 'attachment; filename="audit_logs.ndjson.gz"'
+    rows = [json.loads(line) for line in gzip.decompress(response.content).decode().splitlines()]
+    assert len(rows) == 2
+    assert {row["details"]["command_text"] for row in rows} == {"ls", "pwd"}
+    
+    response = client.get(
+        "/admin/export/audit-logs", params={"since": datetime.utcnow().isoformat()}, headers=headers
+    )
+    assert response.text == ""
+    
+    response = client.get("/admin/export/audit-logs", headers={"X-API-KEY": member_user.api_key})
+    assert response.status_code == 403
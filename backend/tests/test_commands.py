@@ -137,6 +137,40 @@ def test_list_commands(client, member_user, seed_rules):
     assert data[0]["command_text"] == "ls -la"
 
 
+def test_list_commands_cursor_pagination(client, db, member_user, admin_user):
+    """Test that cursors walk the whole history once, newest first, across equal timestamps."""
+    from datetime import datetime, timedelta
+    now = datetime.utcnow()
+    # Three commands share a timestamp, so the id has to break the tie
+    for i, created_at in enumerate([now, now, now, now - timedelta(seconds=1), now - timedelta(seconds=2)]):
+        db.add(Command(
+            user_id=member_user.id, command_text=f"echo {i}", action_taken=ActionTaken.ACCEPTED, created_at=created_at
+        ))
+    db.add(Command(user_id=admin_user.id, command_text="echo admin", action_taken=ActionTaken.ACCEPTED))
+    db.commit()
+    headers = {"X-API-KEY": member_user.api_key}
+    
+    seen = []
+    pages = 0
+    params = {"limit": 2}
+    while True:
+        response = client.get("/commands", params=params, headers=headers)
+        assert response.status_code == 200
+        seen.extend(response.json())
+        pages += 1
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params = {"limit": 2, "cursor": response.headers["X-Next-Cursor"]}
+    
+    assert pages == 3
+    assert len({item["id"] for item in seen}) == 5
+    assert {item["command_text"] for item in seen} == {f"echo {i}" for i in range(5)}
+    assert [item["command_text"] for item in seen[3:]] == ["echo 3", "echo 4"]
+    
+    response = client.get("/commands", params={"cursor": "not-a-cursor"}, headers=headers)
+    assert response.status_code == 400
+
+
 def test_get_command_by_id(client, member_user, seed_rules):
     """Test getting a specific command by ID."""
     # Submit a command
@@ -169,3 +203,363 @@ def test_invalid_api_key(client):
     
     assert response.status_code == 401
 
+
+
+def test_rate_limit_returns_429(client, member_user, seed_rules, monkeypatch):
+    """Test that a user over their token bucket gets 429 with Retry-After."""
+    from app.api import rate_limit
+    monkeypatch.setitem(rate_limit.ROLE_LIMITS, UserRole.MEMBER, rate_limit.RateLimit(rate=0.5, burst=2))
+    
+    for _ in range(2):
+        response = client.post(
+            "/commands",
+            json={"command_text": "ls -la"},
+            headers={"X-API-KEY": member_user.api_key}
+        )
+        assert response.status_code == 200
+    
+    response = client.post(
+        "/commands",
+        json={"command_text": "ls -la"},
+        headers={"X-API-KEY": member_user.api_key}
+    )
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+
+
+def test_batch_commands_each_cost_a_rate_limit_token(client, member_user, seed_rules, monkeypatch):
+    """Test that a batch is charged one token per command, not one per request."""
+    from app.api import rate_limit
+    monkeypatch.setitem(rate_limit.ROLE_LIMITS, UserRole.MEMBER, rate_limit.RateLimit(rate=0.5, burst=3))
+    headers = {"X-API-KEY": member_user.api_key}
+    
+    response = client.post(
+        "/commands/batch",
+        json={"commands": [{"command_text": "ls"}, {"command_text": "pwd"}]},
+        headers=headers
+    )
+    assert response.status_code == 200
+    
+    response = client.post(
+        "/commands/batch",
+        json={"commands": [{"command_text": "ls"}, {"command_text": "pwd"}]},
+        headers=headers
+    )
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    
+    # The rejected batch took nothing, so the last token is still there
+    response = client.post("/commands", json={"command_text": "ls"}, headers=headers)
+    assert response.status_code == 200
+
+
+def test_batch_larger_than_burst_leaves_bucket_in_debt():
+    """Test that an oversized batch needs a full bucket and then pays it back."""
+    from app.api.rate_limit import LocalRateLimiter, RateLimit
+    limiter = LocalRateLimiter()
+    limit = RateLimit(rate=1, burst=4)
+    
+    assert limiter.acquire("k", limit, 10) == 0.0
+    # 4 - 10 = -6 tokens: one more needs 7 seconds of refill
+    assert 6.9 < limiter.acquire("k", limit, 1) <= 7.0
+    assert limiter.acquire("k", limit, 10) > 9.9
+
+
+def test_invalid_keys_do_not_drain_global_limit(client, member_user, seed_rules, monkeypatch):
+    """Test that the global bucket is only charged for authenticated requests."""
+    from app.api import rate_limit
+    monkeypatch.setattr(rate_limit, "GLOBAL_LIMIT", rate_limit.RateLimit(rate=0.5, burst=2))
+
+    for i in range(5):
+        response = client.post("/commands", json={"command_text": "ls"}, headers={"X-API-KEY": f"bogus_{i}"})
+        assert response.status_code == 401
+
+    statuses = [
+        client.post("/commands", json={"command_text": "ls"}, headers={"X-API-KEY": member_user.api_key}).status_code
+        for _ in range(3)
+    ]
+    assert statuses == [200, 200, 429]
+
+
+def test_credit_leasing_keeps_balances_exact(client, db, admin_user, member_user, seed_rules, monkeypatch):
+    """Test that leased credits are counted in balances and returned without minting."""
+    from datetime import datetime, timedelta
+    from app.models import CreditLease
+    from app.agent import credit_leases
+    from app.agent.credits import get_credit_balance
+    monkeypatch.setattr(credit_leases, "CREDIT_LEASE_SIZE", 10)
+    monkeypatch.setattr(credit_leases.lease_manager, "lease_size", 10)
+    
+    try:
+        balances = []
+        for _ in range(3):
+            response = client.post(
+                "/commands",
+                json={"command_text": "ls"},
+                headers={"X-API-KEY": member_user.api_key}
+            )
+            balances.append(response.json()["new_balance"])
+        assert balances == [99, 98, 97]
+        
+        # One block of 10 left the ledger balance; the admin view still counts it
+        assert get_credit_balance(db, member_user.id) == 90
+        response = client.get("/admin/users", headers={"X-API-KEY": admin_user.api_key})
+        listed = {user["id"]: user["credits"] for user in response.json()}
+        assert listed[str(member_user.id)] == 97
+        
+        # Graceful shutdown hands the unspent 7 back
+        credit_leases.lease_manager.release_all(db)
+        assert get_credit_balance(db, member_user.id) == 97
+        assert db.query(CreditLease).count() == 0
+        
+        # A crashed worker's lease is reclaimed for its unspent part only
+        response = client.post(
+            "/commands",
+            json={"command_text": "ls"},
+            headers={"X-API-KEY": member_user.api_key}
+        )
+        assert response.json()["new_balance"] == 96
+        credit_leases.lease_manager.clear()
+        db.query(CreditLease).update({CreditLease.expires_at: datetime.utcnow() - timedelta(minutes=5)})
+        db.commit()
+        assert credit_leases.reclaim_expired_leases(db, grace=0) == 9
+        assert get_credit_balance(db, member_user.id) == 96
+    finally:
+        credit_leases.lease_manager.clear()
+
+
+def test_concurrent_leased_charges_stay_exact(client, db, member_user, seed_rules, monkeypatch):
+    """Test that concurrent requests of two users lease once each and never overspend."""
+    import asyncio
+    import httpx
+    from app.main import app
+    from app.models import CreditLease, User, UserRole
+    from app.agent import credit_leases
+    from app.agent.credits import get_credit_balance, set_credit_balance
+    monkeypatch.setattr(credit_leases, "CREDIT_LEASE_SIZE", 10)
+    monkeypatch.setattr(credit_leases.lease_manager, "lease_size", 10)
+
+    other_user = User(name="Other Member", api_key="test_other_key", role=UserRole.MEMBER, credits=0)
+    db.add(other_user)
+    db.commit()
+    users = [member_user, other_user]
+    for user in users:
+        set_credit_balance(db, user.id, 12)
+    db.commit()
+
+    async def submit_all():
+        # One event loop, like a worker process
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            async def submit(api_key):
+                response = await http.post("/commands", json={"command_text": "ls"}, headers={"X-API-KEY": api_key})
+                return api_key, response.json()["status"]
+            return await asyncio.wait_for(
+                asyncio.gather(*(submit(user.api_key) for user in users for _ in range(16))), timeout=60
+            )
+
+    try:
+        statuses = {user.api_key: [] for user in users}
+        for api_key, status in asyncio.run(submit_all()):
+            statuses[api_key].append(status)
+
+        # Each user leased one block of 10 and paid for the other 2 directly
+        for user in users:
+            assert statuses[user.api_key].count("executed") == 12
+            assert statuses[user.api_key].count("rejected") == 4
+            assert db.query(CreditLease).filter(CreditLease.user_id == user.id).count() == 1
+
+        credit_leases.lease_manager.release_all(db)
+        for user in users:
+            assert get_credit_balance(db, user.id) == 0
+    finally:
+        credit_leases.lease_manager.clear()
+
+
+def test_command_batch_partial_and_all_or_nothing(client, db, member_user, seed_rules):
+    """Test that a batch is decided in order and pays only for what the balance covers."""
+    from app.models import AuditLog
+    from app.agent.credits import set_credit_balance
+    set_credit_balance(db, member_user.id, 2)
+    db.commit()
+    
+    batch = [{"command_text": text} for text in ["ls", "rm -rf /", "pwd", "echo hi", "whoami"]]
+    response = client.post(
+        "/commands/batch",
+        json={"commands": batch, "mode": "all_or_nothing"},
+        headers={"X-API-KEY": member_user.api_key}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert [(r["status"], r["reason"]) for r in data["results"]] == [
+        ("rejected", "INSUFFICIENT_CREDITS"),
+        ("rejected", "AUTO_REJECT"),
+        ("rejected", "INSUFFICIENT_CREDITS"),
+        ("rejected", "INSUFFICIENT_CREDITS"),
+        ("rejected", "AUTO_REJECT"),
+    ]
+    assert data["cost"] == 0
+    assert data["new_balance"] == 2
+    
+    response = client.post(
+        "/commands/batch",
+        json={"commands": batch},
+        headers={"X-API-KEY": member_user.api_key}
+    )
+    data = response.json()
+    assert [r["status"] for r in data["results"]] == ["executed", "rejected", "executed", "rejected", "rejected"]
+    assert data["results"][3]["reason"] == "INSUFFICIENT_CREDITS"
+    assert data["results"][2]["result"]["stdout"]
+    assert (data["executed"], data["rejected"], data["cost"], data["new_balance"]) == (2, 3, 2, 0)
+    
+    # Every command and audit event was recorded
+    assert db.query(Command).filter(Command.user_id == member_user.id).count() == 10
+    assert db.query(AuditLog).filter(AuditLog.event_type == "COMMAND_EXECUTED").count() == 2
+    
+    response = client.post(
+        "/commands/batch",
+        json={"commands": [], "mode": "partial"},
+        headers={"X-API-KEY": member_user.api_key}
+    )
+    assert response.status_code == 422
+
+
+def test_idempotency_key_replays_first_response(client, db, member_user, seed_rules, monkeypatch):
+    """Test that a retried request with the same Idempotency-Key runs only once."""
+    from app.agent.credits import get_credit_balance
+    from app.api.idempotency import idempotency_cache
+    headers = {"X-API-KEY": member_user.api_key, "Idempotency-Key": "retry-1"}
+    
+    first = client.post("/commands", json={"command_text": "ls"}, headers=headers)
+    assert first.status_code == 200
+    assert first.json()["status"] == "executed"
+    assert "Idempotent-Replayed" not in first.headers
+    
+    # Replayed from the in-process cache, then from the idempotency_keys table
+    for clear_cache in (False, True):
+        if clear_cache:
+            idempotency_cache.clear()
+        retry = client.post("/commands", json={"command_text": "ls"}, headers=headers)
+        assert retry.status_code == 200
+        assert retry.json() == first.json()
+        assert retry.headers["Idempotent-Replayed"] == "true"
+    
+    assert db.query(Command).filter(Command.user_id == member_user.id).count() == 1
+    assert get_credit_balance(db, member_user.id) == 99
+    
+    # A retry that misses the cache is answered before any matching or leasing
+    from app.api import commands
+    
+    async def not_called(*args):
+        raise AssertionError("retry was matched or charged again")
+    
+    idempotency_cache.clear()
+    monkeypatch.setattr(commands, "match_rule_async", not_called)
+    monkeypatch.setattr(commands, "reserve_credits", not_called)
+    retry = client.post("/commands", json={"command_text": "ls"}, headers=headers)
+    assert retry.json() == first.json()
+    monkeypatch.undo()
+    
+    # The key cannot be reused for a different request
+    response = client.post("/commands", json={"command_text": "pwd"}, headers=headers)
+    assert response.status_code == 422
+    response = client.post("/commands/batch", json={"commands": [{"command_text": "ls"}]}, headers=headers)
+    assert response.status_code == 422
+    
+    # Without a key every request runs
+    client.post("/commands", json={"command_text": "ls"}, headers={"X-API-KEY": member_user.api_key})
+    assert db.query(Command).filter(Command.user_id == member_user.id).count() == 2
+
+
+def test_queued_execution(client, db, member_user, seed_rules, monkeypatch):
+    """Test that queued mode answers 202 and the execution queue records the result."""
+    import asyncio
+    import httpx
+    from app.main import app
+    from app.agent.execution_queue import execution_queue
+    from app.agent.credits import get_credit_balance
+    from tests.conftest import TestingAsyncSessionLocal
+    monkeypatch.setattr(execution_queue, "mode", "queued")
+    monkeypatch.setattr(execution_queue, "session_factory", TestingAsyncSessionLocal)
+    headers = {"X-API-KEY": member_user.api_key}
+    
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as api:
+            execution_queue.start()
+            queued = await api.post("/commands", json={"command_text": "pwd"}, headers=headers)
+            rejected = await api.post("/commands", json={"command_text": "rm -rf /"}, headers=headers)
+            # Waits for the queued command to finish
+            await execution_queue.stop()
+            detail = await api.get(f"/commands/{queued.json()['command_id']}", headers=headers)
+            full = await api.post("/commands", json={"command_text": "ls"}, headers=headers)
+            # Commands that will not run never need a slot
+            not_run = [
+                await api.post("/commands", json={"command_text": "rm -rf /"}, headers=headers),
+                await api.post("/commands/batch", json={"commands": [{"command_text": "rm -rf /"}]},
+                               headers=headers)
+            ]
+            return queued, rejected, detail, full, not_run
+    
+    queued, rejected, detail, full, not_run = asyncio.run(scenario())
+    
+    assert queued.status_code == 202
+    assert queued.json()["status"] == "queued"
+    assert queued.json()["new_balance"] == 99
+    assert rejected.status_code == 200
+    assert rejected.json()["reason"] == "AUTO_REJECT"
+    assert detail.json()["action_taken"] == "ACCEPTED"
+    assert detail.json()["result"]["stdout"] == "/home/user\n"
+    assert detail.json()["executed_at"] is not None
+    # Without running workers there is no room in the queue
+    assert full.status_code == 503
+    assert [response.status_code for response in not_run] == [200, 200]
+    assert get_credit_balance(db, member_user.id) == 99
+    
+    stats = client.get("/admin/execution/stats", headers=headers)
+    assert stats.status_code == 403
+    stats = execution_queue.stats()
+    assert (stats["mode"], stats["depth"], stats["running"]) == ("queued", 0, 0)
+    assert stats["completed"] >= 1 and stats["wait_p50_ms"] is not None
+
+
+def test_concurrent_requests_after_rule_change(client, member_user, seed_rules, monkeypatch):
+    """Test that requests finding the rule set stale rebuild it once and match off the event loop."""
+    import asyncio
+    import threading
+    import httpx
+    from app.main import app
+    from app.agent import rule_engine
+    rule_engine.invalidate_rule_set()
+
+    loads = []
+    read_version = rule_engine.read_rule_set_version
+    monkeypatch.setattr(rule_engine, "read_rule_set_version", lambda db: loads.append(1) or read_version(db))
+    evaluated_on = set()
+    evaluate = rule_engine.evaluate_rule_set
+    monkeypatch.setattr(
+        rule_engine, "evaluate_rule_set",
+        lambda *args: evaluated_on.add(threading.get_ident()) or evaluate(*args)
+    )
+
+    outcome = {}
+
+    async def submit_all():
+        outcome["loop_thread"] = threading.get_ident()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            responses = await asyncio.gather(*(
+                http.post("/commands", json={"command_text": f"echo {i}"}, headers={"X-API-KEY": member_user.api_key})
+                for i in range(12)
+            ))
+        outcome["statuses"] = [response.json()["status"] for response in responses]
+
+    # A deadlock would block the loop itself, so watch it from another thread
+    runner = threading.Thread(target=lambda: asyncio.run(submit_all()), daemon=True)
+    runner.start()
+    runner.join(timeout=30)
+    assert not runner.is_alive(), "requests deadlocked rebuilding the rule set"
+
+    assert outcome["statuses"] == ["executed"] * 12
+    assert len(loads) == 1
+    assert evaluated_on and outcome["loop_thread"] not in evaluated_on
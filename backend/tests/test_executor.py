@@ -0,0 +1,74 @@
+"""Tests for the executor backends."""
+import asyncio
+import sys
+
+import pytest
+
+from app.agent import executor
+from app.agent.command_parser import parse_command
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="subprocess backend needs POSIX rlimits")
+
+
+def run(command_text: str):
+    """Run a command on the subprocess backend, collecting streamed chunks."""
+    chunks = []
+    
+    async def on_output(stream, text):
+        chunks.append((stream, text))
+    
+    result = asyncio.run(executor.subprocess_execution(parse_command(command_text), on_output))
+    return result, chunks
+
+
+def test_subprocess_backend_streams_output():
+    """Test that output is streamed and returned, without a shell, in an empty directory."""
+    result, chunks = run("echo 'hello world' $HOME")
+    assert result["exit_code"] == 0
+    assert result["stdout"] == "hello world $HOME\n"
+    assert chunks == [("stdout", "hello world $HOME\n")]
+    
+    result, _ = run("ls -A")
+    assert (result["stdout"], result["exit_code"]) == ("", 0)
+    
+    result, _ = run("no_such_program_xyz")
+    assert result["exit_code"] == 127
+
+
+def test_subprocess_backend_limits(monkeypatch):
+    """Test that runaway output and runtime get the command killed."""
+    monkeypatch.setattr(executor, "EXECUTOR_OUTPUT_LIMIT", 1000)
+    result, chunks = run("yes")
+    assert result["killed"] == "output_limit"
+    assert len(result["stdout"]) == 1000
+    assert sum(len(text) for _, text in chunks) == 1000
+    
+    monkeypatch.setattr(executor, "EXECUTOR_TIMEOUT", 0.2)
+    result, _ = run("sleep 5")
+    assert result["killed"] == "timeout"
+    assert result["exit_code"] == 128 + 9
+
+
+def test_subprocess_backend_detached_grandchild(monkeypatch):
+    """Test that a grandchild in its own session cannot keep a timed-out command open."""
+    import shutil
+    import time
+    if shutil.which("setsid") is None:
+        pytest.skip("setsid not available")
+    monkeypatch.setattr(executor, "EXECUTOR_TIMEOUT", 0.2)
+    monkeypatch.setattr(executor, "EXECUTOR_DRAIN_TIMEOUT", 0.2)
+    
+    # setsid forks: the command exits at once, the sleep keeps its pipes open
+    started = time.monotonic()
+    result, _ = run("setsid sleep 3")
+    assert time.monotonic() - started < 2
+    assert result["killed"] == "timeout"
+
+
+def test_mock_backend():
+    """Test that the mock backend serves the same interface."""
+    assert executor.get_executor("mock") is executor.mock_execution
+    result = asyncio.run(executor.mock_execution(parse_command("pwd")))
+    assert result == executor.simulate_execution(parse_command("pwd"))
+    with pytest.raises(ValueError):
+        executor.get_executor("nope")
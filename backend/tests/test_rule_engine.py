@@ -0,0 +1,368 @@
+"""Tests for the rule matching engine."""
+import re
+import time
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from app.models import RuleAction
+from app.agent.rule_engine import compile_rules
+from app.agent.matcher import RuleMatcher, match_sequential
+
+
+def make_rule(priority, pattern, action=RuleAction.AUTO_ACCEPT):
+    """Build a lightweight stand-in for a Rule row."""
+    return SimpleNamespace(id=uuid.uuid4(), priority=priority, pattern=pattern, action=action)
+
+
+def test_compile_rules_sorted_by_priority():
+    """Test that compiled rules are ordered by ascending priority."""
+    rules = [make_rule(10, "^b"), make_rule(1, "^a"), make_rule(5, "^c")]
+
+    rule_set = compile_rules(rules, version=7)
+
+    assert rule_set.version == 7
+    assert [r.priority for r in rule_set.rules] == [1, 5, 10]
+    assert isinstance(rule_set.rules, tuple)
+
+
+def test_compile_rules_skips_invalid_patterns():
+    """Test that invalid patterns are dropped instead of failing the whole set."""
+    rules = [make_rule(1, "[invalid"), make_rule(2, "^ls")]
+
+    rule_set = compile_rules(rules)
+
+    assert [r.priority for r in rule_set.rules] == [2]
+
+
+MIXED_PATTERNS = [
+    r"^rm\s+-rf\s+/",
+    r":\s*\(\s*\)\s*\{\s*:\s*\|\s*:\s*&\s*\}\s*;\s*:",
+    r"mkfs\.",
+    r"git\s+(status|log|diff)",
+    r"^ls|^cat|^pwd|^echo",
+    r"(\w+)\s+\1",
+    r"(?P<tool>kubectl)\s+delete",
+    r"(?x) sudo \s+ su",
+    r"^\s*shutdown\b",
+    r"\bcurl\b.*\|\s*sh",
+    r".*",
+]
+
+SAMPLE_COMMANDS = [
+    "ls -la", "rm -rf /", "RM -RF /tmp", ":(){ :|:& };:", "mkfs.ext4 /dev/sda",
+    "git status", "git push", "echo echo", "kubectl delete pod", "sudo su",
+    "  shutdown now", "curl http://x | sh", "cat file", "some_random_command_xyz", "",
+]
+
+
+@pytest.mark.parametrize("drop_catch_all", [False, True])
+def test_matcher_agrees_with_sequential(drop_catch_all):
+    """Test that the combined matcher returns the same rule as a per-rule loop."""
+    patterns = MIXED_PATTERNS[:-1] if drop_catch_all else MIXED_PATTERNS
+    compiled = [re.compile(p, re.IGNORECASE) for p in patterns]
+    matcher = RuleMatcher(compiled)
+
+    for command in SAMPLE_COMMANDS:
+        assert matcher.first_match(command) == match_sequential(compiled, command), command
+
+
+def test_matcher_respects_priority_across_positions():
+    """Test that a higher-priority rule wins even if a later rule matches earlier in the text."""
+    compiled = [re.compile(p, re.IGNORECASE) for p in [r"danger", r"^run", r"run"]]
+    matcher = RuleMatcher(compiled)
+
+    assert matcher.first_match("run danger") == 0
+    assert matcher.first_match("run safe") == 1
+    assert matcher.first_match("please run") == 2
+    assert matcher.first_match("nothing") is None
+
+
+def test_matcher_respects_scoped_case_sensitivity():
+    """Test that (?-i:...) groups are never answered by the case-insensitive literal paths."""
+    from app.agent.regex_analysis import literal_form
+
+    assert literal_form(r"(?-i:ABC)") is None
+    assert literal_form(r"^(?-i:PWD)$") is None
+    assert literal_form(r"(?i:ABC)").text == "abc"
+
+    for patterns in ([r"(?-i:ABC)"], [r"^(?-i:PWD)$", r".*"], [r"(?-i:Make) install", r".*"],
+                     [r"x(?-i:Y)z", r"^(?-i:ls)", r"ls"]):
+        compiled = [re.compile(p, re.IGNORECASE) for p in patterns]
+        matcher = RuleMatcher(compiled)
+        for command in ["abc", "ABC", "pwd", "PWD", "make install", "Make install", "XyZ", "xYz", "ls", "LS"]:
+            assert matcher.first_match(command) == match_sequential(compiled, command), (patterns, command)
+
+
+def test_required_literals_from_seed_patterns():
+    """Test literal extraction for the seeded rule shapes."""
+    from app.agent.regex_analysis import literal_form, required_literals
+
+    assert required_literals(r"rm\s+-rf\s+/") == frozenset(["-rf"])
+    assert required_literals(r"git\s+(status|log|diff)") == frozenset(["git"])
+    assert required_literals(r"^(ls|cat|pwd|echo)") == frozenset(["ls", "cat", "pwd", "echo"])
+    assert required_literals(r".*") is None
+
+    assert literal_form(r"mkfs\.").text == "mkfs."
+    assert literal_form(r"^PWD$").text == "pwd"
+    assert literal_form(r"^pwd") is None
+
+
+def test_aho_corasick_finds_all_literals():
+    """Test that one pass reports every literal present, including overlaps."""
+    from app.agent.aho_corasick import AhoCorasick
+
+    index = AhoCorasick(["he", "she", "his", "hers"])
+
+    found = {index.literals[i] for i in index.find("ushers")}
+
+    assert found == {"he", "she", "hers"}
+
+
+def test_matcher_literal_index_and_exact_commands():
+    """Test that literal-indexed and exact-command rules keep priority order."""
+    compiled = [re.compile(p, re.IGNORECASE) for p in [r"^pwd$", r"mkfs\.", r"git\s+push", r"^\w+"]]
+    matcher = RuleMatcher(compiled)
+
+    assert matcher.first_match("PWD") == 0
+    assert matcher.first_match("pwd\n") == 0
+    assert matcher.first_match("pwd -P") == 3
+    assert matcher.first_match("sudo mkfs.ext4") == 1
+    assert matcher.first_match("git  push origin") == 2
+    assert matcher.first_match("gitpush") == 3
+    assert matcher.first_match("") is None
+
+
+def test_untrusted_patterns_use_isolated_search():
+    """Test that only patterns with nested quantifiers go through the isolated evaluator."""
+    compiled = [re.compile(p, re.IGNORECASE) for p in [r"(a+)+$", r"^ls"]]
+    matcher = RuleMatcher(compiled)
+    seen = []
+
+    def isolated_search(pattern, text):
+        seen.append(pattern.pattern)
+        return False
+
+    assert matcher.first_match("aaaa ls", isolated_search) is None
+    assert matcher.first_match("ls -la", isolated_search) == 1
+    assert seen == [r"(a+)+$", r"(a+)+$"]
+
+
+def test_isolated_rules_after_the_winner_are_not_searched():
+    """Test that lower-priority untrusted rules are skipped once a literal rule decides the command."""
+    compiled = [re.compile(p, re.IGNORECASE) for p in [r"echo", r"(\w+\s?)+$", r"^(a|aa)+$", r"git\s+push"]]
+    matcher = RuleMatcher(compiled)
+    seen = []
+
+    def isolated_search(pattern, text):
+        seen.append(pattern.pattern)
+        return pattern.search(text) is not None
+
+    assert matcher.first_match("echo hello", isolated_search) == 0
+    assert seen == []
+    assert matcher.first_match("git push", isolated_search) == 1
+    assert seen == [r"(\w+\s?)+$"]
+
+
+def test_timeout_after_the_winner_does_not_reject(monkeypatch):
+    """Test that a low-priority rule timing out cannot override a higher-priority literal rule."""
+    from app.agent import rule_engine
+
+    monkeypatch.setattr(rule_engine, "REGEX_EVAL_MODE", "pool")
+    monkeypatch.setattr(rule_engine.regex_pool, "search_timed", lambda *args: None)
+    rule_set = compile_rules([
+        make_rule(1, r"echo", RuleAction.AUTO_ACCEPT),
+        make_rule(2, r"(\w+\s?)+$", RuleAction.AUTO_REJECT),
+    ])
+
+    matched, timed_out = rule_engine.evaluate_rule_set(rule_set, "echo hello")
+    assert not timed_out and matched.priority == 1
+    assert rule_engine.evaluate_rule_set(rule_set, "ls hello") == (None, True)
+
+
+def test_regex_pool_times_out_and_recovers():
+    """Test that a runaway pattern is abandoned and the pool keeps working."""
+    from app.agent.regex_pool import RegexWorkerPool
+
+    pool = RegexWorkerPool(size=1)
+    try:
+        assert pool.search(r"(a+)+$", "a" * 40 + "!", timeout=0.5) is None
+        assert pool.search(r"^ls", "LS -la", timeout=10) is True
+    finally:
+        pool.shutdown()
+
+
+def test_saturated_pool_fails_closed(monkeypatch):
+    """Test that a rule stuck behind a busy pool rejects the command instead of falling through."""
+    import threading
+    from app.agent import rule_engine
+    from app.agent.regex_pool import RegexWorkerPool
+
+    pool = RegexWorkerPool(size=1)
+    monkeypatch.setattr(rule_engine, "regex_pool", pool)
+    monkeypatch.setattr(rule_engine, "REGEX_EVAL_MODE", "pool")
+    monkeypatch.setattr(rule_engine, "RULE_MATCH_TIME_BUDGET", 0.2)
+    rule_set = compile_rules([
+        make_rule(1, r"^(a+)+$", RuleAction.AUTO_REJECT),
+        make_rule(2, ".*", RuleAction.AUTO_ACCEPT),
+    ])
+    try:
+        pool.start()
+        # Keep the only worker busy for a few hundred milliseconds
+        busy = threading.Thread(target=pool.search, args=(r"(a+)+$", "a" * 22 + "!", 10))
+        busy.start()
+        time.sleep(0.1)
+
+        # Waiting for the worker does not use up the budget...
+        monkeypatch.setattr(rule_engine, "RULE_MATCH_QUEUE_TIMEOUT", 10.0)
+        matched, timed_out = rule_engine.evaluate_rule_set(rule_set, "aaaa")
+        assert not timed_out and matched.action == RuleAction.AUTO_REJECT
+
+        # ...but a rule that cannot get a worker at all stops matching there
+        busy = threading.Thread(target=pool.search, args=(r"(a+)+$", "a" * 22 + "!", 10))
+        busy.start()
+        time.sleep(0.1)
+        monkeypatch.setattr(rule_engine, "RULE_MATCH_QUEUE_TIMEOUT", 0.1)
+        assert rule_engine.evaluate_rule_set(rule_set, "aaaa") == (None, True)
+        command = SimpleNamespace(text="aaaa", lower="aaaa")
+        assert rule_engine._match_in(rule_set, command) is rule_engine.MATCH_TIMED_OUT
+        busy.join()
+    finally:
+        pool.shutdown()
+
+
+def test_redos_risks_with_attack_shapes():
+    """Test that risky repeat shapes are found and safe ones are not."""
+    from app.agent.regex_analysis import find_redos_risks
+
+    nested, = find_redos_risks(r"^(a+)+$")
+    assert nested.kind == "nested quantifier"
+    assert re.fullmatch(r"(a+)+", nested.pump)
+    assert not re.fullmatch(r"(a+)+$", nested.attack(10))
+
+    assert find_redos_risks(r"(a|aa)+$")[0].kind == "overlapping alternation"
+    assert find_redos_risks(r"\d+\d+$")[0].kind == "adjacent overlapping quantifiers"
+
+    for pattern in [r"rm\s+-rf\s+/", r"git\s+(status|log|diff)", r"^[a-z]+(-[a-z]+)*$", r"(\w|\d)+$"]:
+        assert find_redos_risks(pattern) == []
+
+
+def test_validate_rejects_superlinear_patterns():
+    """Test that validation times attack inputs and names the risky shape."""
+    from app.agent.rule_engine import validate_regex_pattern
+
+    valid, error = validate_regex_pattern(r"^(\w+\s?)+$")
+    assert not valid
+    assert "nested quantifier" in error and "* n" in error
+
+    valid, error = validate_regex_pattern(r".*.*=.*")
+    assert not valid
+    assert "adjacent overlapping quantifiers" in error
+
+    assert validate_regex_pattern(r"^[a-z]+(-[a-z]+)*$") == (True, None)
+    assert validate_regex_pattern(r"git\s+(status|log|diff)") == (True, None)
+
+
+def test_validate_inline_mode_does_not_start_pool(monkeypatch):
+    """Test that inline mode probes risky patterns in process, without starting regex workers."""
+    from app.agent import rule_engine
+    from app.agent.regex_pool import RegexWorkerPool
+
+    pool = RegexWorkerPool(size=1)
+    monkeypatch.setattr(rule_engine, "regex_pool", pool)
+    monkeypatch.setattr(rule_engine, "REGEX_EVAL_MODE", "inline")
+
+    valid, error = rule_engine.validate_regex_pattern(r"^(\w+\s?)+$")
+    assert not valid and "nested quantifier" in error
+    assert rule_engine.validate_regex_pattern(r"^[a-z]+(-[a-z]+)*$") == (True, None)
+    assert not pool._started
+
+
+def test_decision_cache_lru_and_counters():
+    """Test LRU eviction order and hit/miss/eviction accounting."""
+    from app.agent.rule_engine import DecisionCache
+
+    cache = DecisionCache(maxsize=2)
+    cache.put((1, "ls"), "a")
+    cache.put((1, "pwd"), None)
+    assert cache.get((1, "ls")) == "a"
+    cache.put((1, "git status"), "b")  # evicts "pwd", the least recently used
+
+    assert cache.get((1, "pwd")) is DecisionCache.MISSING
+    assert cache.get((1, "git status")) == "b"
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 2, "misses": 1, "evictions": 1}
+
+
+def test_decision_cache_dropped_on_rule_change():
+    """Test that bumping the rule-set version empties the decision cache."""
+    from app.agent.rule_engine import decision_cache, invalidate_rule_set
+
+    decision_cache.put((0, "ls"), None)
+    invalidate_rule_set()
+
+    assert decision_cache.stats()["size"] == 0
+
+
+def test_latency_histogram_percentiles():
+    """Test latency bucketing and percentile estimates."""
+    from app.agent.rule_stats import LATENCY_BUCKETS_US, histogram_percentile, latency_bucket, merge_histograms
+
+    histogram = merge_histograms([])
+    for seconds in [0.000003, 0.000003, 0.000003, 0.0004]:
+        histogram[latency_bucket(seconds)] += 1
+    histogram[latency_bucket(None)] += 1  # a timeout
+
+    assert sum(histogram) == 5
+    assert histogram_percentile(histogram, 0.5) == 5
+    assert histogram_percentile(histogram, 0.8) == 500
+    assert histogram_percentile(histogram, 0.99) is None
+    assert histogram_percentile(merge_histograms([]), 0.5) is None
+    assert len(histogram) == len(LATENCY_BUCKETS_US) + 1
+
+
+def test_generate_samples_match_their_pattern():
+    """Test that generated samples cover alternatives and really match."""
+    from app.agent.regex_analysis import generate_samples
+
+    samples = generate_samples(r"git\s+(status|log|diff)")
+    assert {"git status", "git log", "git diff"} <= set(samples)
+    assert "x git log x" in samples
+
+    # Anchored patterns can't be matched in context
+    assert generate_samples(r"^(ls|cat)$") == ["cat", "ls"]
+
+    for pattern in [r"^rm\s+-rf\s+/", r"\bcurl\b.*\|\s*sh", r"^(?!sudo)\w+", r"mkfs\."]:
+        samples = generate_samples(pattern, limit=4)
+        assert 0 < len(samples) <= 4
+        assert all(re.search(pattern, sample, re.IGNORECASE) for sample in samples)
+
+
+def test_parse_command_tokens_and_fallback():
+    """Test that commands are stripped, shell-tokenized and tolerate bad quoting."""
+    from app.agent.command_parser import parse_command
+
+    parsed = parse_command('  CAT "my file.txt" -n \n')
+    assert parsed.text == 'CAT "my file.txt" -n'
+    assert parsed.argv == ("CAT", "my file.txt", "-n")
+    assert parsed.program == "CAT"
+    assert parsed.lower == 'cat "my file.txt" -n'
+
+    # Unbalanced quote: fall back to whitespace splitting
+    assert parse_command("echo 'oops").argv == ("echo", "'oops")
+    assert parse_command("   ").program == ""
+
+
+def test_simulate_execution_uses_parsed_argv():
+    """Test that the mock executor dispatches on the parsed program name."""
+    from app.agent.command_parser import parse_command
+    from app.agent.executor import simulate_execution
+
+    assert simulate_execution(parse_command("LS -la"))["stdout"].startswith("file1.txt")
+    assert simulate_execution(parse_command('cat "a b.txt"'))["stdout"].startswith("Contents of a b.txt\n")
+    assert simulate_execution(parse_command(" pwd "))["stdout"] == "/home/user\n"
+    assert simulate_execution(parse_command("echo hello   world"))["stdout"] == "hello world\n"
+    assert simulate_execution(parse_command("cat"))["stdout"] == "Mock execution of: cat\n"
+
+    rule_set = compile_rules([make_rule(1, r"^cat\s+my"), make_rule(2, r"^ls")])
+    parsed = parse_command("Cat my.txt")
+    assert rule_set.matcher.first_match(parsed.text, lowered=parsed.lower) == 0
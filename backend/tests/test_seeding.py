@@ -50,5 +50,27 @@ def test_default_admin_seeded(client, db):
     admin = db.query(User).filter(User.role == UserRole.ADMIN).first()
     assert admin is not None
     assert admin.name == "test_admin"
-    assert admin.api_key == "test_admin_key_123"
+    
+    # Only the key id and hash are stored, and the seeded key authenticates
+    from app.api.auth import authenticate
+    from app.security import api_key_fingerprint
+    assert (admin.api_key_id, admin.api_key_hash) == api_key_fingerprint("test_admin_key_123")
+    assert authenticate("test_admin_key_123", db).id == admin.id
+
+
 
+def test_api_secret_required_outside_dev(monkeypatch):
+    """Test that startup refuses an empty API_SECRET unless APP_ENV is dev/test."""
+    from app import security
+    monkeypatch.setattr(security, "API_SECRET", "")
+    
+    monkeypatch.setattr(security, "APP_ENV", "production")
+    with pytest.raises(RuntimeError):
+        security.check_api_secret()
+    
+    monkeypatch.setattr(security, "APP_ENV", "development")
+    security.check_api_secret()
+    
+    monkeypatch.setattr(security, "API_SECRET", "s3cret")
+    monkeypatch.setattr(security, "APP_ENV", "production")
+    security.check_api_secret()
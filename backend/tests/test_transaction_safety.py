@@ -51,10 +51,39 @@ def test_concurrent_credit_deduction(client, member_user, seed_rules):
     assert reject_count == 1, "Exactly one command should be rejected"
     
     # Verify final credit balance is 0
+    from app.agent.credits import get_credit_balance
     db = SessionLocal()
     try:
-        user = db.query(User).filter(User.id == member_user.id).first()
-        assert user.credits == 0, "Final balance should be 0"
+        assert get_credit_balance(db, member_user.id) == 0, "Final balance should be 0"
     finally:
         db.close()
 
+
+
+def test_concurrent_charges_never_overdraw(client, db, member_user, seed_rules):
+    """Test that concurrent submissions pay for exactly as many commands as the balance covers."""
+    import asyncio
+    import httpx
+    from app.main import app
+    from app.agent.credits import get_credit_balance, set_credit_balance
+    set_credit_balance(db, member_user.id, 5)
+    db.commit()
+
+    async def submit_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            responses = await asyncio.wait_for(asyncio.gather(*(
+                http.post("/commands", json={"command_text": "ls"}, headers={"X-API-KEY": member_user.api_key})
+                for _ in range(12)
+            )), timeout=60)
+        return [response.json() for response in responses]
+
+    results = asyncio.run(submit_all())
+
+    assert sum(1 for r in results if r["status"] == "executed") == 5
+    assert all(r["reason"] == "INSUFFICIENT_CREDITS" for r in results if r["status"] == "rejected")
+    assert get_credit_balance(db, member_user.id) == 0
+    # Commands that lost the race are recorded as unpaid rejections
+    db.expire_all()
+    assert db.query(Command).filter(Command.cost == 1).count() == 5
+    assert db.query(Command).count() == 12